@@ -39,6 +39,13 @@ NO CARRIER 0 ERROR 0
 #define MIN_APP_SIZE 0x0020
 #define FORCE_STAY_IN_BOOTLOADER B, 1
 
+/*
+** optional commands, default image has to fit in boot section of 0x780 bytes
+** USE_READ:   crc and read (and bread with USE_BINARY), announced in hello
+** USE_BINARY: bflash and sflash, binary frames announced in hello
+** enable them by: make USE_READ=1 USE_BINARY=1, check size by make meminfo
+*/
+
 static uint16_t crc16_update(uint16_t crc, uint8_t a) {
 	uint8_t i;
 	crc ^= a;
@@ -51,17 +58,38 @@ static uint16_t crc16_update(uint16_t crc, uint8_t a) {
 	return crc;
 }
 
+static uint16_t flashCrc(uint16_t addr, uint16_t size) {
+	uint16_t crc16 = 0;
+	while (size--) {
+		crc16 = crc16_update (crc16, pgm_read_byte(addr++));
+		wdt_reset();
+	}
+	return crc16;
+}
+
+#ifdef USE_READ
+/** stop long answer if new line is received
+@return         1 if rest of answer should not be sent */
+static uint8_t abortReceived() {
+	while (uartIsChar()) {
+		char ch = uartGetChar();
+		/* ignore rest of line ending from actual command */
+		if (ch == '\r' || ch == 0) continue;
+		while (ch != '\n') {
+			wdt_reset();
+			ch = uartGetChar();
+		}
+		return 1;
+	}
+	return 0;
+}
+#endif
+
 static uint8_t checkCrc() {
-	uint16_t i;
 	uint16_t size = pgm_read_word(BOOT_ADDRESS - 4);
-	uint16_t crc16 = 0;
 	if (size < MIN_APP_SIZE) return 0;
 	if (size > BOOT_ADDRESS - 4) return 0;
-	for (i = 0; i < size; i++) {
-		crc16 = crc16_update (crc16, pgm_read_byte(i));
-		wdt_reset();
-	}
-	return (crc16) == pgm_read_word(BOOT_ADDRESS - 2);
+	return flashCrc(0, size) == pgm_read_word(BOOT_ADDRESS - 2);
 }
 
 //void printString(const char *str) {
@@ -84,20 +112,22 @@ void printNum(unsigned int n) {
 	uartPutChar('0' + n % 10);
 }
 
-//void printHex4(unsigned char n) {
-//	n &= 0x0f;
-//	uartPutChar((n < 10) ? n + '0' : n + 'a' - 10);
-//}
-//
-//void printHex8(uint8_t n) {
-//	printHex4(n >> 4);
-//	printHex4(n);
-//}
-//
-//void printHex16(uint16_t n) {
-//	printHex8((uint8_t)(n >> 8));
-//	printHex8((uint8_t)n);
-//}
+#ifdef USE_READ
+void printHex4(unsigned char n) {
+	n &= 0x0f;
+	uartPutChar((n < 10) ? n + '0' : n + 'a' - 10);
+}
+
+void printHex8(uint8_t n) {
+	printHex4(n >> 4);
+	printHex4(n);
+}
+
+void printHex16(uint16_t n) {
+	printHex8((uint8_t)(n >> 8));
+	printHex8((uint8_t)n);
+}
+#endif
 
 char compareString(PGM_P str1, char *str2) {
 	while (pgm_read_byte(str1++) == *str2++) {
@@ -142,6 +172,74 @@ char readHexString(const char *str, unsigned char *buffer, unsigned int size) {
 	return count;
 }
 
+/*
+** binary frame: <length_16bit><data><crc8>
+** bytes 0x00, '\t' - '\r', FRAME_ESC and ' ' are sent as FRAME_ESC, byte ^ 0x40,
+** so frame is one word in line and can be used in place of hex string
+*/
+#define FRAME_ESC 0x1b
+
+#ifdef USE_READ
+static void printFrameByte(uint8_t n) {
+	if (n == 0x00 || (n >= '\t' && n <= '\r') || n == FRAME_ESC || n == ' ') {
+		uartPutCharBinary(FRAME_ESC);
+		n ^= 0x40;
+	}
+	uartPutCharBinary(n);
+}
+#endif
+
+#ifdef USE_BINARY
+static int readFrameByte(const char **str) {
+	uint8_t ch = *(*str)++;
+	if (ch == 0) return -1;
+	if (ch != FRAME_ESC) return ch;
+	ch = *(*str)++;
+	if (ch == 0) return -1;
+	return ch ^ 0x40;
+}
+
+/** decode binary frame in to buffer, rest of buffer is filled with 0xff
+@param sparse   frame data are segments <skip_8bit><count_8bit><count data bytes>,
+                skip is number of 0xff bytes before data */
+char readFrame(const char *str, unsigned char *buffer, unsigned int size, uint8_t sparse) {
+	int high = readFrameByte(&str);
+	int low = (high < 0) ? -1 : readFrameByte(&str);
+	unsigned int length = (high << 8) | low;
+	if (low < 0 || length > size) return -1;
+	uint8_t crc8 = 0x00;
+	unsigned int i;
+	unsigned int pos = 0;
+	/* bytes of segment header to read and data bytes left in segment */
+	uint8_t header = sparse ? 2 : 0;
+	uint8_t count = 0;
+	/* data and crc8 */
+	for (i = 0; i <= length; i++) {
+		int data = readFrameByte(&str);
+		if (data < 0) return -1;
+		crc8 ^= data;
+		if (i == length) break;
+		if (header == 2) {
+			while (data--) {
+				if (pos >= size) return -1;
+				buffer[pos++] = 0xff;
+			}
+			header = 1;
+		} else if (header == 1) {
+			count = data;
+			header = count ? 0 : 2;
+		} else {
+			if (pos >= size) return -1;
+			buffer[pos++] = data;
+			if (sparse && !--count) header = 2;
+		}
+	}
+	if (*str || crc8) return -1;
+	while (pos < size) buffer[pos++] = 0xff;
+	return 0;
+}
+#endif
+
 static char ready = 0;
 static uint8_t crcOk;
 #ifdef USE_ECHO
@@ -157,6 +255,12 @@ void readCommand(char **cmd, char count) {
 		printNum(SPM_PAGESIZE);
 		printStringP(PSTR("\ncrc "));
 		printStringP(crcOk ? PSTR("ok\n") : PSTR("error\n"));
+#ifdef USE_READ
+		printStringP(PSTR("read 1\n"));
+#endif
+#ifdef USE_BINARY
+		printStringP(PSTR("binary 2\n"));
+#endif
 #ifdef USE_ECHO
 	} else if (ready && compareString(PSTR("echo"), cmd[0])) {
 		if (count == 2) {
@@ -170,8 +274,14 @@ void readCommand(char **cmd, char count) {
 		printStringP(PSTR("rebooting..\n"));
 		wdt_enable(WDTO_250MS);
 		while(1);
+#ifdef USE_BINARY
+	} else if (ready && (compareString(PSTR("flash"), cmd[0]) || compareString(PSTR("bflash"), cmd[0]) || compareString(PSTR("sflash"), cmd[0]))) {
+#else
 	} else if (ready && compareString(PSTR("flash"), cmd[0])) {
+#endif
 		/* flash <addr_16bit> <PG_MAGIC> <data_SPM_PAGESIZE> */
+		/* bflash <addr_16bit> <PG_MAGIC> <frame_SPM_PAGESIZE> */
+		/* sflash <addr_16bit> <PG_MAGIC> <sparse_frame_SPM_PAGESIZE> */
 		static uint16_t addr;
 		static uint16_t pgMagic;
 		static unsigned char buff[SPM_PAGESIZE + 1];
@@ -179,13 +289,86 @@ void readCommand(char **cmd, char count) {
 			printStringP(PSTR("parameters error\n"));
 		} else if ((addr % SPM_PAGESIZE) || (addr >= BOOT_ADDRESS)) {
 			printStringP(PSTR("address error\n"));
+#ifdef USE_BINARY
+		} else if ((*cmd[0] == 'f' ? readHexString(cmd[3], buff, SPM_PAGESIZE) : readFrame(cmd[3], buff, SPM_PAGESIZE, *cmd[0] == 's')) == -1) {
+#else
 		} else if (readHexString(cmd[3], buff, SPM_PAGESIZE) == -1) {
+#endif
 			printStringP(PSTR("data error\n"));
 		} else if (programPage(addr, (uint16_t *)buff, pgMagic)) {
 			printStringP(PSTR("flash error\n"));
 		} else {
 			printStringP(PSTR("flash ok\n"));
 		}
+#ifdef USE_READ
+	} else if (ready && compareString(PSTR("crc"), cmd[0])) {
+		/* crc <addr_16bit> <size_16bit> */
+		uint16_t addr;
+		uint16_t size;
+		if (count != 3 || readHexNum(cmd[1], (unsigned char *)&addr, 2) || readHexNum(cmd[2], (unsigned char *)&size, 2)) {
+			printStringP(PSTR("parameters error\n"));
+		} else if ((uint32_t)addr + size > BOOT_ADDRESS) {
+			printStringP(PSTR("address error\n"));
+		} else {
+			printStringP(PSTR("crc "));
+			printHex16(flashCrc(addr, size));
+			uartPutChar('\n');
+		}
+#ifdef USE_BINARY
+	} else if (ready && (compareString(PSTR("read"), cmd[0]) || compareString(PSTR("bread"), cmd[0]))) {
+#else
+	} else if (ready && compareString(PSTR("read"), cmd[0])) {
+#endif
+		/* read|bread <addr_16bit> <size_16bit> */
+		/* answer lines: data <addr_16bit> <data_max_32_bytes><crc8> */
+		/* or in binary: bdata <addr_16bit> <frame_max_128_bytes> */
+#ifdef USE_BINARY
+		uint8_t binary = (*cmd[0] == 'b');
+#else
+		const uint8_t binary = 0;
+#endif
+		uint8_t lineSize = binary ? 128 : 32;
+		uint16_t addr;
+		uint16_t size;
+		if (count != 3 || readHexNum(cmd[1], (unsigned char *)&addr, 2) || readHexNum(cmd[2], (unsigned char *)&size, 2)) {
+			printStringP(PSTR("parameters error\n"));
+		} else if ((uint32_t)addr + size > BOOT_ADDRESS) {
+			printStringP(PSTR("address error\n"));
+		} else {
+			while (size) {
+				wdt_reset();
+				if (abortReceived()) {
+					printStringP(PSTR("read aborted\n"));
+					break;
+				}
+				printStringP(binary ? PSTR("bdata ") : PSTR("data "));
+				printHex16(addr);
+				uartPutChar(' ');
+				if (binary) {
+					uint16_t count = lineSize - addr % lineSize;
+					if (count > size) count = size;
+					printFrameByte(count >> 8);
+					printFrameByte(count);
+				}
+				uint8_t crc8 = 0;
+				do {
+					uint8_t data = pgm_read_byte(addr++);
+					crc8 ^= data;
+					if (binary) {
+						printFrameByte(data);
+					} else {
+						printHex8(data);
+					}
+				} while (--size && addr % lineSize);
+				if (binary) {
+					printFrameByte(crc8);
+				} else {
+					printHex8(crc8);
+				}
+				uartPutChar('\n');
+			}
+		}
+#endif
 	//} else if (compareString(PSTR("RING"), cmd[0])) {
 	//	/* COMMAND FROM BLUETOOTH MODULE BLUEGIGA WT12 - client connected */
 	//	_delay_ms(100);
@@ -46,6 +46,13 @@ NO CARRIER 0 ERROR 0
 #define VERSION "v2.0"
 #define COPYRIGHT "(c)2012-2013 pavel.revak@gmail.com"
 
+/*
+** optional commands, check size of image by make meminfo
+** USE_BINARY: avr flash bread, bwrite and swrite, binary frames announced in hello
+** USE_CRC:    avr flash crc (host reads flash without it)
+** enable them by: make USE_BINARY=1 USE_CRC=1
+*/
+
 static char ready = 0;
 static char echo = 0;
 static char avrIspConnected = 0;
@@ -210,6 +217,9 @@ void unknownCommand(char ch, char *command) {
 void helloCommand() {
 	ready = 1;
 	printStringP(PSTR("\nhello\ndevice " NAME " " VERSION "\n"));
+#ifdef USE_BINARY
+	printStringP(PSTR("binary 2\n"));
+#endif
 }
 
 void rebootCommand(char ch) {
@@ -299,53 +309,158 @@ void avrFlashEraseCommand() {
 	printStringP(PSTR("avr flash erase done\n"));
 }
 
-void avrFlashReadCommand(char ch) {
-	if (ch == '\n') return;
+/** read <addr_from_24bit> <addr_to_24bit> params of flash commands
+@return         0 if params are ok, -1 if error was printed */
+char readAddrRange(char ch, unsigned long *addrFrom, unsigned long *addrTo) {
 	char param[8];
 	ch = uartReadString(param, 8);
 	if (ch == 0 || ch == '\n') {
 		badParam(ch);
-		return;
+		return -1;
 	}
-	unsigned long addrFrom = 0;
-	if (parseHexNum(param, (unsigned char *)&addrFrom, 3)) {
+	*addrFrom = 0;
+	if (parseHexNum(param, (unsigned char *)addrFrom, 3)) {
 		badParam(ch);
-		return;
+		return -1;
 	}
 	ch = uartReadString(param, 8);
 	if (ch != '\n') {
 		badParam(ch);
-		return;
+		return -1;
 	}
-	unsigned long addrTo = 0;
-	if (parseHexNum(param, (unsigned char *)&addrTo, 3)) {
+	*addrTo = 0;
+	if (parseHexNum(param, (unsigned char *)addrTo, 3)) {
 		badParam(ch);
-		return;
+		return -1;
+	}
+	return 0;
+}
+
+static unsigned char avrFlashReadByte(unsigned long addr) {
+	return avrCmd(
+		(addr & 1) ? 0x28 : 0x20,
+		(unsigned char)(addr >> 9),
+		(unsigned char)(addr >> 1),
+		0x00
+	);
+}
+
+#ifdef USE_CRC
+static uint16_t crc16_update(uint16_t crc, uint8_t a) {
+	int i;
+	crc ^= a;
+	for (i = 0; i < 8; ++i) {
+		if (crc & 1)
+			crc = (crc >> 1) ^ 0xA001;
+		else
+			crc = (crc >> 1);
+	}
+	return crc;
+}
+#endif
+
+#ifdef USE_BINARY
+/*
+** binary frame: <length_16bit><data><crc8>
+** bytes 0x00, '\t' - '\r', FRAME_ESC and ' ' are sent as FRAME_ESC, byte ^ 0x40,
+** so frame is one word in line and can be used in place of hex string
+*/
+#define FRAME_ESC 0x1b
+
+void printFrameByte(unsigned char n) {
+	if (n == 0x00 || (n >= '\t' && n <= '\r') || n == FRAME_ESC || n == ' ') {
+		uartPutCharBinary(FRAME_ESC);
+		n ^= 0x40;
 	}
+	uartPutCharBinary(n);
+}
+
+/** read one byte of binary frame
+@param ch       last readed character
+@return         decoded byte or -1 if word ends */
+int uartReadFrameByte(char *ch) {
+	*ch = uartReadChar();
+	if (*ch == '\n' || *ch == ' ') return -1;
+	if (*ch != FRAME_ESC) return (unsigned char)*ch;
+	*ch = uartReadChar();
+	if (*ch == '\n' || *ch == ' ') return -1;
+	return (unsigned char)*ch ^ 0x40;
+}
+#endif
+
+/** avr flash read|bread <addr_from_24bit> <addr_to_24bit>
+answer lines: data <addr_24bit> <hex_data_max_32_bytes><crc8>
+or in binary: bdata <addr_24bit> <frame_max_128_bytes> */
+void avrFlashReadCommand(char ch, char binary) {
+	if (ch == '\n') return;
+	unsigned long addrFrom;
+	unsigned long addrTo;
+	if (readAddrRange(ch, &addrFrom, &addrTo)) return;
+	unsigned char lineSize = binary ? 128 : 32;
 	while (addrFrom <= addrTo) {
 		wdt_reset();
-		printStringP(PSTR("data "));
+		/* any received line aborts reading */
+		while (uartIsChar()) {
+			/* ignore rest of line ending from read command */
+			ch = uartGetChar();
+			if (ch != '\r' && ch != 0x00) {
+				uartWaitForEol(ch);
+				printStringP(PSTR("avr flash read aborted\n"));
+				return;
+			}
+		}
+		printStringP(binary ? PSTR("bdata ") : PSTR("data "));
 		printHex24(addrFrom);
 		uartPutChar(' ');
+#ifdef USE_BINARY
+		if (binary) {
+			unsigned int count = lineSize - addrFrom % lineSize;
+			if (count > addrTo - addrFrom + 1) count = addrTo - addrFrom + 1;
+			printFrameByte(count >> 8);
+			printFrameByte(count);
+		}
+#endif
 		char crc8 = 0;
 		while (addrFrom <= addrTo) {
-			char tmp = avrCmd(
-				(addrFrom & 1) ? 0x28 : 0x20,
-				(unsigned char)(addrFrom >> 9),
-				(unsigned char)(addrFrom >> 1),
-				0x00
-			);
+			char tmp = avrFlashReadByte(addrFrom);
 			crc8 ^= tmp;
+#ifdef USE_BINARY
+			if (binary) printFrameByte(tmp);
+			else
+#endif
 			printHex8(tmp);
 			addrFrom++;
-			if (addrFrom % 32 == 0) break;
+			if (addrFrom % lineSize == 0) break;
 		}
+#ifdef USE_BINARY
+		if (binary) printFrameByte(crc8);
+		else
+#endif
 		printHex8(crc8);
 		uartPutChar('\n');
 	}
 	printStringP(PSTR("avr flash read done\n"));
 }
 
+#ifdef USE_CRC
+/** avr flash crc <addr_from_24bit> <addr_to_24bit>
+answer crc16 (same as in bootloader) of flash content: crc <crc_16bit> */
+void avrFlashCrcCommand(char ch) {
+	if (ch == '\n') return;
+	unsigned long addrFrom;
+	unsigned long addrTo;
+	if (readAddrRange(ch, &addrFrom, &addrTo)) return;
+	uint16_t crc16 = 0;
+	while (addrFrom <= addrTo) {
+		if (addrFrom % 256 == 0) wdt_reset();
+		crc16 = crc16_update(crc16, avrFlashReadByte(addrFrom++));
+	}
+	printStringP(PSTR("crc "));
+	printHex16(crc16);
+	uartPutChar('\n');
+}
+#endif
+
 char avrFlashWriteBuffer(unsigned char bufferSize) {
 	unsigned char bufferAddress = 0;
 	char crc8 = 0x00;
@@ -398,7 +513,71 @@ char avrFlashWriteBuffer(unsigned char bufferSize) {
 	return 6;
 }
 
-void avrFlashWriteCommand(char ch) {
+#ifdef USE_BINARY
+static void avrFlashLoadByte(unsigned int pos, unsigned char data) {
+	avrCmd((pos & 1) ? 0x48 : 0x40, 0x00, pos >> 1, data);
+}
+
+/** load page from binary frame
+@param sparse   frame data are segments <skip_8bit><count_8bit><count data bytes>,
+                skip is number of 0xff bytes before data */
+char avrFlashWriteFrame(unsigned char bufferSize, char sparse) {
+	char ch;
+	int high = uartReadFrameByte(&ch);
+	int low = (high < 0) ? -1 : uartReadFrameByte(&ch);
+	unsigned int size = (high << 8) | low;
+	if (low < 0 || size > 2 * (unsigned int)bufferSize) {
+		uartWaitForEol(ch);
+		printStringP(PSTR("wrong frame length\n"));
+		return -1;
+	}
+	char crc8 = 0x00;
+	unsigned int i;
+	unsigned int pos = 0;
+	/* bytes of segment header to read and data bytes left in segment */
+	unsigned char header = sparse ? 2 : 0;
+	unsigned char count = 0;
+	/* data and crc8 */
+	for (i = 0; i <= size; i++) {
+		int data = uartReadFrameByte(&ch);
+		if (data < 0) {
+			uartWaitForEol(ch);
+			printStringP(PSTR("unexpected end of data\n"));
+			return -1;
+		}
+		crc8 ^= data;
+		if (i == size) break;
+		if (header == 2) {
+			while (data-- && pos <= 2 * (unsigned int)bufferSize) avrFlashLoadByte(pos++, 0xff);
+			header = 1;
+		} else if (header == 1) {
+			count = data;
+			header = count ? 0 : 2;
+		} else {
+			avrFlashLoadByte(pos++, data);
+			if (sparse && !--count) header = 2;
+		}
+	}
+	ch = uartReadChar();
+	if (ch != '\n' || pos > 2 * (unsigned int)bufferSize) {
+		uartWaitForEol(ch);
+		printStringP(PSTR("too long data\n"));
+		return -1;
+	}
+	if (crc8) {
+		printStringP(PSTR("wrong checksum: "));
+		printHex8(crc8);
+		uartPutChar('\n');
+		return -1;
+	}
+	while (pos < 2 * (unsigned int)bufferSize) avrFlashLoadByte(pos++, 0xff);
+	return 0;
+}
+#endif
+
+/** avr flash write|bwrite|swrite <size_words_8bit> <addr_24bit> <hex_data><crc8>|<frame>
+@param binary   0: hex data, 1: binary frame, 2: binary frame with sparse data */
+void avrFlashWriteCommand(char ch, char binary) {
 	if (ch == '\n') return;
 	char param[8];
 	ch = uartReadString(param, 8);
@@ -426,7 +605,11 @@ void avrFlashWriteCommand(char ch) {
 		printStringP(PSTR("address error\n"));
 		return;
 	}
-	if ((avrFlashWriteBuffer(bufferSize))) {
+#ifdef USE_BINARY
+	if (binary ? avrFlashWriteFrame(bufferSize, binary == 2) : avrFlashWriteBuffer(bufferSize)) {
+#else
+	if (avrFlashWriteBuffer(bufferSize)) {
+#endif
 		return;
 	}
 	addr >>= 1;
@@ -446,9 +629,21 @@ void avrFlashCommand(char ch) {
 	if (compareStringP(param, PSTR("erase"))) {
 		avrFlashEraseCommand(ch);
 	} else if (compareStringP(param, PSTR("read"))) {
-		avrFlashReadCommand(ch);
+		avrFlashReadCommand(ch, 0);
+#ifdef USE_CRC
+	} else if (compareStringP(param, PSTR("crc"))) {
+		avrFlashCrcCommand(ch);
+#endif
 	} else if (compareStringP(param, PSTR("write"))) {
-		avrFlashWriteCommand(ch);
+		avrFlashWriteCommand(ch, 0);
+#ifdef USE_BINARY
+	} else if (compareStringP(param, PSTR("bread"))) {
+		avrFlashReadCommand(ch, 1);
+	} else if (compareStringP(param, PSTR("bwrite"))) {
+		avrFlashWriteCommand(ch, 1);
+	} else if (compareStringP(param, PSTR("swrite"))) {
+		avrFlashWriteCommand(ch, 2);
+#endif
 	} else {
 		badParam(ch);
 		return;
@@ -0,0 +1,6 @@
+"""programmer and bootloader client for Atmel AVR CPUs
+
+modules are imported only by commands which need them, avrprog.py
+starts by avrproglib.cli.main()"""
+
+VERSION = "v2.0"
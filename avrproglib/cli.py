@@ -0,0 +1,333 @@
+"""command line interface"""
+
+import sys
+import threading
+import glob
+import time
+import copy
+import os
+
+from avrproglib import VERSION
+from avrproglib.dbg import dbg
+from avrproglib.exceptions import AvrProgException, FleetException, UnknownCommandException
+from avrproglib.image import IntelHexException, MemoryImage, SrecException
+from avrproglib.programmer import AvrProg
+
+
+def processCommand(avrProg, cmd, arg):
+    if cmd == 'help':
+        print "avrprog - avr programmer"
+        print "commands:"
+        print "  help\n    print this help"
+        print "  verbose:<loglevel>\n    set loglevel (0 == no output, 4 = print everything)"
+        print "  progress:<seconds>|off\n    redraw progress at most once per seconds (default 0.2) or do not show it"
+        print "  clear\n    clear buffer"
+        print "  load:<file>\n    load file in to buffer"
+        print "  save:<file>\n    save buffer in to file (.hex or .bin)"
+        print "  buffer\n    print content of buffer"
+        print "  port:<serialport>\n    connect to serial port"
+        print "  link\n    print measured round trip and transfer time of port and its timeout"
+        print "  fleet:<serialport>[:<serialport>..]\n    run all following commands on all ports in parallel, ports can be glob patterns"
+        print "  batch[:<jobfile>]\n    compile commands from job file and all following commands in to plan and run it"
+        print "    fuse reads are sent at once, verify followed by download read flash only once"
+        print "  schedule:<jobfile>:<serialport>[:<serialport>..]\n    run jobs from json job file on free ports, failed jobs are retried"
+        print "  daemon[:<socket>]\n    keep ports open and run jobs sent by remote (default socket ~/.avrprog.sock)"
+        print "  remote[:<socket>]\n    run all following commands as job in daemon, connected port is reused"
+        print "  bootloader\n    try to start bootloader"
+        print "  reboot\n    reboot device"
+        print "  sign\n    sign content of buffer (use this for flashing from bootloader)"
+        print "  cpu[:<cpuid>]\n    connect to CPU, and detect it (optional validation)"
+        print "  cpuimport:<avrdude.conf>[:<file>]\n    add parts programmable by ISP from avrdude.conf to cpu database (default ~/.avrprog/cpus.txt)"
+        print "  erase\n    chip erase, cause erase flash, eeprom and lockbits"
+        print "  window:<pages>\n    count of pages sent to device before waiting for answer (default 1)"
+        print "    more than 1 is safe only with binary frames shorter than uart buffer of device (128 bytes)"
+        print "  binary:on|off\n    transfer flash data in binary frames if device support them (default on)"
+        print "  flash[:diff][:resume]\n    write buffer to flash, with diff only pages which differ from device are written"
+        print "    with resume acknowledged pages are written to journal (~/.avrprog/journal), pages acknowledged"
+        print "    before previous flash:resume was interrupted are skipped and last of them is verified"
+        print "  download\n    read flash to buffer"
+        print "  verify[:full][:read]\n    verify flash with buffer, pages with 0xff only are skipped unless full is used"
+        print "    flash is compared by crc computed in device, with read or if crc differ data are read back"
+        print "  fuse[:<fuseid>[:<value>]]\n    read fuse(s) or write fuse. value is in hex"
+        print "  benchmark[:<kb>]\n    measure receiving of flash read answer (default 256 KB) from pseudo terminal"
+    elif cmd == 'about':
+        print "avrprog %s (c)2012-2013 pavel.revak@gmail.com" % VERSION
+    elif cmd == 'cpulist':
+        avrProg.printCpuList()
+    elif cmd == 'cpuimport':
+        importCpus(*arg[0:2])
+    elif cmd == 'verbose':
+        dbg.verbose = int(arg[0])
+    elif cmd == 'progress':
+        dbg.progressInterval = None if arg[0:1] == ['off'] else float(arg[0])
+    elif cmd == 'window':
+        avrProg.flashWindow = int(arg[0])
+    elif cmd == 'binary':
+        if arg[0:1] not in (['on'], ['off']):
+            raise AvrProgException("Wrong binary option, use binary:on or binary:off")
+        avrProg.binaryMode = arg[0] == 'on'
+    elif cmd == 'clear':
+        avrProg.clearBuffer()
+    elif cmd == 'load':
+        avrProg.readFile(arg[0])
+    elif cmd == 'save':
+        avrProg.writeFile(arg[0])
+    elif cmd == 'buffer':
+        avrProg.printBuffer()
+    elif cmd == 'port':
+        avrProg.connect(arg[0])
+    elif cmd == 'link':
+        avrProg.printLinkStats()
+    elif cmd == 'bootloader':
+        avrProg.startBootloader(arg[0:])
+    elif cmd == 'reboot':
+        avrProg.reboot()
+    elif cmd == 'sign':
+        avrProg.signBuffer()
+    elif cmd == 'cpu':
+        avrProg.setCpu(arg[0:])
+    elif cmd == 'erase':
+        avrProg.erase()
+    elif cmd == 'flash':
+        avrProg.flash(arg[0:])
+    elif cmd == 'download':
+        avrProg.flashDownload(arg[0:])
+    elif cmd == 'verify':
+        avrProg.flashVerify(arg[0:])
+    elif cmd == 'fuse':
+        avrProg.fuse(arg[0:])
+    elif cmd == 'test':
+        import unittest
+        if dbg.isDefaultVerbose:
+            dbg.verbose = 0
+        unittest.main(module='avrproglib.tests', argv=[sys.argv[0]] + arg[0:])
+    elif cmd == 'benchmark':
+        from avrproglib.terminal import benchmarkTerminal
+        benchmarkTerminal(*[int(a) for a in arg[0:1]])
+    else:
+        raise UnknownCommandException(cmd)
+
+
+class Batch(object):
+    """commands compiled in to plan, compatible steps are merged
+
+    consecutive fuse reads are one step sending all reads at once, verify
+    followed by download use one readback of flash, diff of flash after
+    erase is skipped (device is blank) and repeated cpu is done once"""
+
+    # commands after which flash content is unknown
+    FLASH_CHANGING = ('port', 'bootloader', 'reboot', 'flash')
+
+    def __init__(self, commands):
+        self.plan = self.compile(commands)
+
+    @staticmethod
+    def readJob(fileName):
+        """job file contains commands separated by white spaces or lines,
+        text after # is comment"""
+        commands = []
+        with open(fileName) as f:
+            for line in f:
+                commands += line.split('#')[0].split()
+        return commands
+
+    @classmethod
+    def compile(cls, commands):
+        """return plan, list of (cmd, args), merged steps are
+        ('fuses', fuseIds) and ('verify+download', (verifyArgs, downloadArgs))"""
+        plan = []
+        erased = False
+        for command in commands:
+            command = command.split(':')
+            cmd, args = command[0], command[1:]
+            last = plan[-1] if plan else (None, None)
+            if cmd == 'fuse' and len(args) < 2:
+                # read of fuse, None is all fuses
+                fuseIds = args or [None]
+                if last[0] == 'fuses':
+                    last[1].extend(fuseId for fuseId in fuseIds if fuseId not in last[1])
+                else:
+                    plan.append(('fuses', fuseIds))
+                continue
+            if cmd == 'cpu' and last == (cmd, args):
+                continue
+            if cmd == 'flash' and erased:
+                args = [arg for arg in args if arg != 'diff']
+            if cmd == 'download' and last[0] == 'verify':
+                plan[-1] = ('verify+download', (last[1], args))
+                continue
+            if cmd == 'erase':
+                erased = True
+            elif cmd in cls.FLASH_CHANGING:
+                erased = False
+            plan.append((cmd, args))
+        return plan
+
+    def run(self, avrProg):
+        for cmd, args in self.plan:
+            dbg.info("batch: %s %s" % (cmd, args))
+            if cmd == 'fuses':
+                avrProg.printFuses(None if None in args else args)
+            elif cmd == 'verify+download':
+                avrProg.flashVerifyDownload(*args)
+            else:
+                processCommand(avrProg, cmd, args)
+
+
+def runCommands(avrProg, commands):
+    """run commands, batch[:<jobfile>] compile rest of commands in to plan"""
+    for i, command in enumerate(commands):
+        command = command.split(':')
+        if command[0] == 'batch':
+            jobCommands = Batch.readJob(command[1]) if len(command) > 1 else []
+            Batch(jobCommands + commands[i + 1:]).run(avrProg)
+            return
+        processCommand(avrProg, command[0], command[1:])
+
+
+def expandPorts(ports):
+    """ports can be glob patterns"""
+    expanded = []
+    for port in ports:
+        if glob.has_magic(port):
+            expanded += sorted(glob.glob(port))
+        else:
+            expanded.append(port)
+    return expanded
+
+
+class Fleet(object):
+    """run same commands on many devices in parallel, each device in own thread"""
+
+    def __init__(self, ports, dataBuffer=None, avrProgClass=AvrProg):
+        self.ports = expandPorts(ports)
+        self.dataBuffer = dataBuffer if dataBuffer is not None else MemoryImage()
+        self.avrProgClass = avrProgClass
+        self.results = []
+
+    def runDevice(self, result, commands, flashWindow):
+        dbg.prefix = '%s: ' % result['port']
+        timeStart = time.time()
+        avrProg = self.avrProgClass()
+        avrProg.flashWindow = flashWindow
+        avrProg.dataBuffer = copy.deepcopy(self.dataBuffer)
+        try:
+            avrProg.connect(result['port'])
+            runCommands(avrProg, commands)
+            if avrProg.isProgrammer() and avrProg.deviceCpu:
+                avrProg.avrDisable()
+        except reportedErrors() as e:
+            result['error'] = str(e)
+            dbg.error(e)
+        except Exception as e:
+            # unexpected error fails only its device, others keep running
+            result['error'] = "%s: %s" % (e.__class__.__name__, e)
+            dbg.error(result['error'])
+        result['cpu'] = avrProg.deviceCpu
+        result['time'] = time.time() - timeStart
+
+    def run(self, commands, flashWindow=1):
+        if not self.ports:
+            raise AvrProgException("No port found for fleet.")
+        dbg.msg("running on %d devices" % len(self.ports))
+        self.results = []
+        threads = []
+        for port in self.ports:
+            result = {'port': port, 'cpu': '', 'error': None, 'time': 0}
+            self.results.append(result)
+            thread = threading.Thread(target=self.runDevice, args=(result, commands, flashWindow))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # join with timeout, so KeyboardInterrupt is not blocked
+            while thread.is_alive():
+                thread.join(0.1)
+        if [result for result in self.results if result['error']]:
+            raise FleetException(self.results)
+
+    def printSummary(self):
+        print "{:<24} {:<12} {:>8} {}".format('port', 'cpu', 'time', 'result')
+        for result in self.results:
+            print "{:<24} {:<12} {:>7.1f}s {}".format(
+                result['port'],
+                result['cpu'] or '-',
+                result['time'],
+                'error' if result['error'] else 'ok'
+            )
+
+
+def importCpus(avrdudeConf, fileName=None):
+    """add parts from avrdude.conf to user cpu file (default
+    ~/.avrprog/cpus.txt, loaded over cpus.txt of avrproglib) or to other
+    file, cpus.txt of package is not changed"""
+    from avrproglib.cpus import USER_CPU_FILE, CpuDb, cpuDb, importAvrdudeConf
+    cpus = importAvrdudeConf(avrdudeConf)
+    db = CpuDb(fileName or USER_CPU_FILE)
+    if not os.path.exists(db.fileName):
+        db.setCpus([])
+    added = db.merge(cpus)
+    db.save()
+    if db.fileName == cpuDb.userFileName:
+        # imported cpus are used by next lookup
+        cpuDb.lines = None
+    dbg.msg("imported %d cpus, %d new, %d cpus in %s" % (len(cpus), added, len(db), db.fileName))
+
+
+def reportedErrors():
+    """errors printed without traceback, pyserial is not imported only
+    for its exception (SerialException is also IOError)"""
+    errors = (IOError, AvrProgException, SrecException, IntelHexException)
+    if 'serial' in sys.modules:
+        errors += (sys.modules['serial'].SerialException, )
+    return errors
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    avrProg = AvrProg()
+    try:
+        for i, arg in enumerate(args):
+            arg = arg.split(':')
+            if arg[0] == 'fleet':
+                fleet = Fleet(arg[1:], avrProg.dataBuffer)
+                try:
+                    fleet.run(args[i + 1:], avrProg.flashWindow)
+                finally:
+                    fleet.printSummary()
+                break
+            if arg[0] == 'batch':
+                runCommands(avrProg, args[i:])
+                break
+            if arg[0] == 'schedule':
+                from avrproglib.scheduler import Scheduler
+                scheduler = Scheduler(arg[2:], flashWindow=avrProg.flashWindow)
+                scheduler.loadJobs(arg[1])
+                try:
+                    scheduler.run()
+                finally:
+                    scheduler.printSummary()
+                break
+            if arg[0] == 'daemon':
+                import signal
+                from avrproglib.daemon import Daemon
+                daemon = Daemon(*arg[1:2])
+                signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+                daemon.serve()
+                break
+            if arg[0] == 'remote':
+                from avrproglib.daemon import remoteJob
+                if not remoteJob(args[i + 1:], *arg[1:2]):
+                    sys.exit(1)
+                break
+            processCommand(avrProg, arg[0], arg[1:])
+        if avrProg.isProgrammer() and avrProg.deviceCpu:
+            avrProg.avrDisable()
+        dbg.msg("done.")
+    except reportedErrors() as e:
+        dbg.error(e)
+        sys.exit(1)
+    except (KeyboardInterrupt), e:
+        dbg.error("interrupted by keyboard")
+        sys.exit(1)
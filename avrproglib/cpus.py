@@ -0,0 +1,288 @@
+"""database of AVR CPUs
+
+cpus are read on first lookup from cpus.txt of package and from user file
+~/.avrprog/cpus.txt, which is extended by parts from avrdude.conf (command
+cpuimport) and overrides cpus of package with same id"""
+
+import os
+import re
+import copy
+
+CPU_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cpus.txt')
+USER_CPU_FILE = os.path.expanduser('~/.avrprog/cpus.txt')
+
+CPU_FILE_HEADER = """\
+# AVR CPUs known by avrprog, generated by: avrprog.py cpuimport:<avrdude.conf>
+# id alias signature flashPageWords flashPagesCount eepromSize fuses name
+"""
+
+# fuses in order as they are printed
+FUSES = ('low', 'high', 'extend', 'lock', 'calib')
+
+# avrdude memory names of fuses
+AVRDUDE_FUSES = {
+    'lfuse': 'low',
+    'hfuse': 'high',
+    'efuse': 'extend',
+    'lock': 'lock',
+    'calibration': 'calib',
+}
+
+# programmer does not support extended addresses (load extended address
+# instruction), so only 128KB of flash can be written
+MAX_FLASH_SIZE = 0x20000
+
+
+class CpuDb(object):
+    """cpus indexed by id, alias and signature
+
+    each cpu is dict with keys: id, alias, name, signature,
+    flashPageWords, flashPagesCount, eepromSize, fuses. File is read on
+    first lookup, but line is parsed only when its cpu is used."""
+
+    def __init__(self, fileName=CPU_FILE, userFileName=None):
+        self.fileName = fileName
+        # cpus of this file are added to cpus of fileName
+        self.userFileName = userFileName
+        self.lines = None
+        self.parsed = {}
+        self.ids = {}
+        self.signatures = {}
+
+    @staticmethod
+    def parseLine(line):
+        cpuId, alias, signature, flashPageWords, flashPagesCount, eepromSize, fuses, name = line.split(None, 7)
+        return {
+            'id': cpuId,
+            'alias': alias if alias != '-' else None,
+            'name': name.strip(),
+            'signature': tuple(bytearray.fromhex(signature)),
+            'flashPageWords': int(flashPageWords),
+            'flashPagesCount': int(flashPagesCount),
+            'eepromSize': int(eepromSize),
+            'fuses': tuple(fuses.split(',')),
+        }
+
+    @staticmethod
+    def formatLine(cpu):
+        return "%s %s %s %d %d %d %s %s\n" % (
+            cpu['id'],
+            cpu['alias'] or '-',
+            ''.join('%02x' % byte for byte in cpu['signature']),
+            cpu['flashPageWords'],
+            cpu['flashPagesCount'],
+            cpu['eepromSize'],
+            ','.join(cpu['fuses']),
+            cpu['name'],
+        )
+
+    @staticmethod
+    def readLines(fileName):
+        lines = []
+        with open(fileName) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    lines.append(line)
+        return lines
+
+    @staticmethod
+    def mergeLines(lines, newLines):
+        """replace lines with same cpu id or append new ones, return count
+        of new lines"""
+        positions = dict((line.split(None, 1)[0], i) for i, line in enumerate(lines))
+        added = 0
+        for line in newLines:
+            cpuId = line.split(None, 1)[0]
+            if cpuId in positions:
+                lines[positions[cpuId]] = line
+            else:
+                positions[cpuId] = len(lines)
+                lines.append(line)
+                added += 1
+        return added
+
+    def load(self):
+        if self.lines is None:
+            lines = self.readLines(self.fileName)
+            if self.userFileName and os.path.exists(self.userFileName):
+                self.mergeLines(lines, self.readLines(self.userFileName))
+            self.setLines(lines)
+        return self.lines
+
+    def setLines(self, lines):
+        self.lines = lines
+        self.parsed = {}
+        self.ids = {}
+        self.signatures = {}
+        for i, line in enumerate(lines):
+            cpuId, alias, signature, rest = line.split(None, 3)
+            self.ids[cpuId] = i
+            if alias != '-':
+                self.ids.setdefault(alias, i)
+            # some parts share signature, first one is detected
+            self.signatures.setdefault(signature, i)
+
+    def setCpus(self, cpus):
+        self.setLines([self.formatLine(cpu) for cpu in cpus])
+
+    def cpu(self, i):
+        if i not in self.parsed:
+            self.parsed[i] = self.parseLine(self.lines[i])
+        return self.parsed[i]
+
+    def save(self, fileName=None):
+        lines = self.load()
+        fileName = fileName or self.fileName
+        directory = os.path.dirname(fileName)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(fileName, 'w') as f:
+            f.write(CPU_FILE_HEADER)
+            f.writelines(lines)
+
+    def merge(self, cpus):
+        """add cpus, existing cpus with same id are replaced, return
+        count of new cpus"""
+        lines = list(self.load())
+        added = self.mergeLines(lines, [self.formatLine(cpu) for cpu in cpus])
+        self.setLines(lines)
+        return added
+
+    def byId(self, cpuId):
+        self.load()
+        i = self.ids.get(cpuId.lower())
+        return self.cpu(i) if i is not None else None
+
+    def bySignature(self, signature):
+        self.load()
+        i = self.signatures.get(''.join('%02x' % byte for byte in signature))
+        return self.cpu(i) if i is not None else None
+
+    def __iter__(self):
+        self.load()
+        return (self.cpu(i) for i in xrange(len(self.lines)))
+
+    def __len__(self):
+        return len(self.load())
+
+cpuDb = CpuDb(userFileName=USER_CPU_FILE)
+
+
+AVRDUDE_TOKEN_RE = re.compile(r'"[^"]*"|;|=|[^\s;="]+')
+
+
+def avrdudeTokens(text):
+    for line in text.splitlines():
+        # comments are only outside of strings
+        line = re.sub(r'#[^"]*$', '', line)
+        for token in AVRDUDE_TOKEN_RE.findall(line):
+            yield token
+
+
+def avrdudeBlocks(tokens):
+    """parse avrdude.conf tokens, yield (kind, parent, statements)
+
+    statements are dict of values (list of tokens) and memories, which
+    are dicts of memory statements"""
+    tokens = iter(tokens)
+    for token in tokens:
+        if token not in ('part', 'programmer', 'serialadapter'):
+            # top level assignment 'key = value;'
+            for token in tokens:
+                if token == ';':
+                    break
+            continue
+        kind = token
+        parent = None
+        statements = {'memories': {}}
+        memory = None
+        key = None
+        values = []
+        for token in tokens:
+            if key is not None:
+                if token == ';':
+                    (memory if memory is not None else statements)[key] = values
+                    key = None
+                    values = []
+                elif token != '=':
+                    values.append(token.strip('"'))
+            elif token == ';':
+                if memory is None:
+                    break
+                memory = None
+            elif token == 'parent' and memory is None and not statements['memories'] and len(statements) == 1:
+                parent = next(tokens).strip('"')
+            elif token == 'memory':
+                name = next(tokens).strip('"')
+                memory = statements['memories'].setdefault(name, {})
+            else:
+                key = token
+        yield kind, parent, statements
+
+
+def avrdudePart(part):
+    """convert avrdude part to cpu dict, return None if part is not
+    programmable by ISP with paged flash"""
+    modes = ' '.join(part.get('prog_modes', []))
+    if modes and 'PM_ISP' not in modes:
+        return None
+    for key in ('has_pdi', 'has_tpi', 'has_updi'):
+        if part.get(key) == ['yes']:
+            return None
+    memories = part['memories']
+    flash = memories.get('flash', {})
+    try:
+        flashSize = int(flash['size'][0], 0)
+        pageSize = int(flash['page_size'][0], 0)
+        signature = tuple(int(byte, 16) for byte in part['signature'])
+        name = part['desc'][0]
+    except (KeyError, IndexError, ValueError):
+        return None
+    if flash.get('paged') == ['no'] or pageSize < 2 or flashSize > MAX_FLASH_SIZE or len(signature) != 3:
+        return None
+    if not re.match(r'^\w+$', name):
+        return None
+    eepromSize = 0
+    if 'eeprom' in memories and 'size' in memories['eeprom']:
+        eepromSize = int(memories['eeprom']['size'][0], 0)
+    fuses = set(AVRDUDE_FUSES[memory] for memory in memories if memory in AVRDUDE_FUSES)
+    return {
+        'id': name.lower(),
+        'alias': part['id'][0] if part.get('id') else None,
+        'name': name,
+        'signature': signature,
+        'flashPageWords': pageSize / 2,
+        'flashPagesCount': flashSize / pageSize,
+        'eepromSize': eepromSize,
+        'fuses': tuple(fuse for fuse in FUSES if fuse in fuses),
+    }
+
+
+def importAvrdudeConf(fileName):
+    """return cpus from parts of avrdude.conf, part derived from parent
+    part (part parent "m328") inherits all its values and memories"""
+    with open(fileName) as f:
+        blocks = avrdudeBlocks(avrdudeTokens(f.read()))
+    parts = {}
+    cpus = []
+    for kind, parent, statements in blocks:
+        if kind != 'part':
+            continue
+        part = {'memories': {}}
+        if parent in parts:
+            part = copy.deepcopy(parts[parent])
+            # id and desc are never inherited
+            part.pop('id', None)
+            part.pop('desc', None)
+        for key, value in statements.items():
+            if key == 'memories':
+                for name, memory in value.items():
+                    part['memories'].setdefault(name, {}).update(memory)
+            else:
+                part[key] = value
+        if part.get('id'):
+            parts[part['id'][0]] = part
+        cpu = avrdudePart(part)
+        if cpu:
+            cpus.append(cpu)
+    return cpus
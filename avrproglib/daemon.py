@@ -0,0 +1,239 @@
+"""daemon keeping ports open between jobs, jobs are sent over unix socket
+
+job is one line of json: {"commands": [..], "cwd": ".."}, answer is one
+line of json: {"error": .., "output": .., "log": ..}"""
+
+import os
+import sys
+import errno
+import json
+import time
+import socket
+import threading
+import StringIO
+
+from avrproglib.cli import reportedErrors, runCommands
+from avrproglib.dbg import dbg
+from avrproglib.exceptions import AvrProgException, NotRespondingException
+from avrproglib.programmer import AvrProg
+
+DAEMON_SOCKET = os.path.expanduser('~/.avrprog.sock')
+
+# commands with file name argument, relative names are from client cwd
+FILE_COMMANDS = ('load', 'save', 'batch')
+
+# commands which need connected AVR
+AVR_COMMANDS = ('erase', 'flash', 'verify', 'download', 'fuse')
+
+
+class JobOutput(object):
+    """replacement of sys.stdout or dbg.stream, output of job thread is
+    collected for client, other threads write to original stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start(self):
+        self.local.output = StringIO.StringIO()
+
+    def stop(self):
+        output = self.local.output.getvalue()
+        self.local.output = None
+        return output
+
+    def write(self, data):
+        (getattr(self.local, 'output', None) or self.stream).write(data)
+
+    def flush(self):
+        if not getattr(self.local, 'output', None):
+            self.stream.flush()
+
+
+class Session(object):
+    """AvrProg connected to one port, jobs for the port run one by one"""
+
+    def __init__(self, port, avrProgClass):
+        self.port = port
+        self.avrProg = avrProgClass()
+        # cpu detected by previous job, AVR is disconnected after each job
+        self.cpu = ''
+        self.lock = threading.Lock()
+
+    def jobCommands(self, commands):
+        """connect AVR detected by previous job, if job uses AVR without
+        cpu command"""
+        names = [command.split(':')[0] for command in commands]
+        if not self.cpu or 'cpu' in names or not set(names) & set(AVR_COMMANDS):
+            return commands
+        ports = len([name for name in names if name == 'port'])
+        return commands[:ports] + ['cpu:' + self.cpu] + commands[ports:]
+
+    def disconnect(self):
+        avrProg = self.avrProg
+        if avrProg.isProgrammer() and avrProg.deviceCpu:
+            avrProg.avrDisable()
+            self.cpu = avrProg.deviceCpu
+            avrProg.deviceCpu = ''
+
+
+class Daemon(object):
+    def __init__(self, socketPath=DAEMON_SOCKET, avrProgClass=AvrProg):
+        self.socketPath = socketPath
+        self.avrProgClass = avrProgClass
+        self.sessions = {}
+        self.sessionsLock = threading.Lock()
+        self.sock = None
+        self.running = False
+
+    def session(self, port):
+        with self.sessionsLock:
+            if port not in self.sessions:
+                self.sessions[port] = Session(port, self.avrProgClass)
+            return self.sessions[port]
+
+    def dropSession(self, session):
+        """device is lost, next job for port connects again"""
+        with self.sessionsLock:
+            if self.sessions.get(session.port) is session:
+                del self.sessions[session.port]
+
+    @staticmethod
+    def jobCommands(commands, cwd, connected):
+        """return (port, commands), port command is removed if port is
+        already connected, file names are resolved in client cwd"""
+        port = None
+        jobCommands = []
+        for command in commands:
+            cmd = command.split(':')
+            if cmd[0] in ('fleet', 'daemon', 'remote'):
+                raise AvrProgException("Command %s can not run in daemon." % cmd[0])
+            if cmd[0] == 'port':
+                if port is not None:
+                    raise AvrProgException("Only one port can be used in job.")
+                port = cmd[1]
+                if connected(port):
+                    continue
+            if cmd[0] in FILE_COMMANDS and len(cmd) > 1 and cwd:
+                command = '%s:%s' % (cmd[0], os.path.join(cwd, ':'.join(cmd[1:])))
+            jobCommands.append(command)
+        return port, jobCommands
+
+    def connected(self, port):
+        session = self.sessions.get(port)
+        return session is not None and session.avrProg.term is not None
+
+    def runJob(self, job):
+        """run job, return answer for client"""
+        result = {'error': None, 'output': '', 'log': '', 'time': 0}
+        timeStart = time.time()
+        sys.stdout.start()
+        dbg.stream.start()
+        dbg.threadLoglevel()
+        try:
+            # json strings are unicode, commands are sent to serial port
+            commands = [str(command) for command in job.get('commands', [])]
+            port, commands = self.jobCommands(commands, job.get('cwd'), self.connected)
+            session = self.session(port)
+            # gauges of parallel jobs would overwrite each other
+            dbg.prefix = '%s: ' % port if port else ''
+            with session.lock:
+                avrProg = session.avrProg
+                # only port stays open, buffer and settings of previous
+                # job are not used
+                avrProg.resetJob()
+                try:
+                    runCommands(avrProg, session.jobCommands(commands))
+                    session.disconnect()
+                except (NotRespondingException, IOError):
+                    self.dropSession(session)
+                    raise
+        except reportedErrors() as e:
+            result['error'] = str(e)
+            dbg.error(e)
+        except Exception as e:
+            # unexpected error of job is sent to client, daemon keeps running
+            result['error'] = "%s: %s" % (e.__class__.__name__, e)
+            dbg.error(result['error'])
+        finally:
+            dbg.threadLoglevel(False)
+            result['output'] = sys.stdout.stop()
+            result['log'] = dbg.stream.stop()
+        result['time'] = time.time() - timeStart
+        return result
+
+    def handleConnection(self, conn):
+        try:
+            line = conn.makefile().readline()
+            if line:
+                conn.sendall(json.dumps(self.runJob(json.loads(line))) + '\n')
+        except (ValueError, socket.error) as e:
+            dbg.error("job failed: %s" % e)
+        finally:
+            conn.close()
+
+    def listen(self):
+        if os.path.exists(self.socketPath):
+            # socket of daemon which is not running any more
+            os.remove(self.socketPath)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socketPath)
+        self.sock.listen(5)
+        self.sock.settimeout(0.2)
+        self.running = True
+
+    def serve(self):
+        """accept jobs until stop(), each job runs in own thread"""
+        if not self.sock:
+            self.listen()
+        dbg.msg("daemon listening on %s" % self.socketPath)
+        stdout, dbgStream = sys.stdout, dbg.stream
+        sys.stdout, dbg.stream = JobOutput(stdout), JobOutput(dbgStream)
+        try:
+            while self.running:
+                try:
+                    conn, address = self.sock.accept()
+                except socket.timeout:
+                    continue
+                except socket.error as e:
+                    # accept interrupted by signal which stopped daemon
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                conn.settimeout(None)
+                thread = threading.Thread(target=self.handleConnection, args=(conn, ))
+                thread.daemon = True
+                thread.start()
+        finally:
+            sys.stdout, dbg.stream = stdout, dbgStream
+            self.sock.close()
+            self.sock = None
+            os.remove(self.socketPath)
+
+    def stop(self):
+        self.running = False
+
+
+def sendJob(commands, socketPath=DAEMON_SOCKET):
+    """send commands to daemon, return its answer"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+    except socket.error as e:
+        raise AvrProgException("Daemon is not running on %s: %s" % (socketPath, e))
+    try:
+        sock.sendall(json.dumps({'commands': commands, 'cwd': os.getcwd()}) + '\n')
+        line = sock.makefile().readline()
+    finally:
+        sock.close()
+    if not line:
+        raise AvrProgException("Daemon closed connection.")
+    return json.loads(line)
+
+
+def remoteJob(commands, socketPath=DAEMON_SOCKET):
+    """run commands in daemon, print its output, return True if job succeeded"""
+    result = sendJob(commands, socketPath)
+    sys.stdout.write(result['output'])
+    dbg.stream.write(result['log'])
+    return not result['error']
@@ -0,0 +1,173 @@
+"""logging and progress output"""
+
+import sys
+import threading
+import time
+
+
+class Progress(object):
+    """progress of one phase (flash, verify, download) counted in bytes,
+    bar is redrawn at most once per interval seconds"""
+
+    def __init__(self, dbg, phase, total, interval):
+        self.dbg = dbg
+        self.phase = phase
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.timeStart = time.time()
+        self.nextDraw = self.timeStart
+
+    def add(self, size):
+        self.done += size
+        now = time.time()
+        if now >= self.nextDraw:
+            self.nextDraw = now + self.interval
+            self.dbg.drawProgress(self, now)
+
+    def end(self):
+        self.dbg.drawProgress(self, time.time(), end=True)
+
+    def rate(self, now):
+        """throughput in bytes per second"""
+        elapsed = now - self.timeStart
+        return self.done / elapsed if elapsed > 0 else 0
+
+    def eta(self, now):
+        """remaining seconds or None if nothing is done yet"""
+        rate = self.rate(now)
+        if not rate:
+            return None
+        return (self.total - self.done) / rate
+
+
+class Dbg(object):
+    def __init__(self, verbose=3, gaugeLength=50, useColors=True, progressInterval=0.2, stream=None):
+        self.gaugeLength = gaugeLength
+        self.local = threading.local()
+        self.loglevel = verbose
+        self.useColors = useColors
+        # None disable progress
+        self.progressInterval = progressInterval
+        self.stream = stream or sys.stderr
+        self.gaugeStrLen = 0
+        self.defaultVerbose = True
+        self.lock = threading.Lock()
+        self.colors = {
+            'gray': '\033[1;90m',
+            'red': '\033[1;91m',
+            'green': '\033[1;92m',
+            'yellow': '\033[1;93m',
+            'blue': '\033[1;94m',
+            'pink': '\033[1;95m',
+            'cyan': '\033[1;96m',
+            'silver': '\033[1;97m',
+            'white': '\033[1;98m',
+            'normal': '\033[0m',
+        }
+
+    @property
+    def loglevel(self):
+        return getattr(self.local, 'loglevel', self.globalLoglevel)
+
+    @loglevel.setter
+    def loglevel(self, value):
+        if hasattr(self.local, 'loglevel'):
+            self.local.loglevel = value
+        else:
+            self.globalLoglevel = value
+
+    def threadLoglevel(self, enable=True):
+        """with enable, loglevel set in actual thread does not change
+        loglevel of other threads (jobs of daemon)"""
+        if enable:
+            self.local.loglevel = self.globalLoglevel
+        elif hasattr(self.local, 'loglevel'):
+            del self.local.loglevel
+
+    @property
+    def verbose(self):
+        return self.loglevel
+
+    @verbose.setter
+    def verbose(self, value):
+        self.loglevel = value
+        self.defaultVerbose = False
+
+    @property
+    def isDefaultVerbose(self):
+        return self.defaultVerbose
+
+    @property
+    def prefix(self):
+        """prefix of messages logged from actual thread"""
+        return getattr(self.local, 'prefix', '')
+
+    @prefix.setter
+    def prefix(self, value):
+        self.local.prefix = value
+
+    def isLogged(self, loglevel=3):
+        """check before formatting messages logged for each line or page"""
+        return loglevel < self.loglevel
+
+    def log(self, message, loglevel=3, color=None):
+        if loglevel < self.loglevel:
+            message = self.prefix + str(message)
+            if self.useColors and color in self.colors.keys():
+                message = self.colors[color] + message + self.colors['normal']
+            with self.lock:
+                if self.gaugeStrLen:
+                    message = '\n' + message
+                    self.gaugeStrLen = 0
+                self.stream.write(message + '\n')
+
+    def progress(self, phase, total, loglevel=2):
+        """return Progress of phase or None if progress is not shown"""
+        # gauges from parallel threads would overwrite each other
+        if loglevel < self.loglevel and self.progressInterval is not None and total and not self.prefix:
+            return Progress(self, phase, total, self.progressInterval)
+        return None
+
+    def drawProgress(self, progress, now, end=False):
+        gauge = self.gaugeLength * progress.done / progress.total
+        if end:
+            timeStr = 'in %.1fs' % (now - progress.timeStart)
+        else:
+            eta = progress.eta(now)
+            timeStr = 'ETA %ds' % eta if eta is not None else 'ETA -'
+        gaugeStr = '%-8s [%s%s] %3d%% %s/s %s' % (
+            progress.phase,
+            '=' * gauge,
+            ' ' * (self.gaugeLength - gauge),
+            100 * progress.done / progress.total,
+            byteSize(progress.rate(now), prefix='', sufix='B'),
+            timeStr,
+        )
+        with self.lock:
+            # pad to overwrite rest of longer previous gauge
+            self.stream.write('\r' + gaugeStr.ljust(self.gaugeStrLen) + ('\n' if end else ''))
+            self.gaugeStrLen = 0 if end else len(gaugeStr)
+            self.stream.flush()
+
+    def msg(self, message, loglevel=2, color='white'):
+        self.log(message, loglevel=loglevel, color=color)
+
+    def info(self, message, loglevel=2, color='gray'):
+        self.log(message, loglevel=loglevel, color=color)
+
+    def warning(self, message, loglevel=1, color='yellow'):
+        self.log(message, loglevel=loglevel, color=color)
+
+    def error(self, message, loglevel=1, color='red'):
+        self.log(message, loglevel=loglevel, color=color)
+
+dbg = Dbg()
+
+
+def byteSize(val, mult=1024, maxMult=1, prefix=' ', sufix='Bytes', units=['', 'K', 'M', 'G', 'T', ]):
+    i = 0
+    while val >= (maxMult * mult) and i < len(units) - 1:
+        val /= mult
+        i += 1
+    return "%d%s%s%s" % (val, prefix, units[i], sufix)
@@ -0,0 +1,203 @@
+"""exceptions reported to user without traceback"""
+
+from avrproglib.dbg import byteSize
+
+
+def structuredString(data, indent='  ', actualIndent='\n'):
+    if isinstance(data, list):
+        return ''.join([structuredString(d, indent, actualIndent + indent) for d in data])
+    return actualIndent + str(data)
+
+
+class AvrProgException(Exception):
+    def __init__(self, message=None, messages=None):
+        # subclasses without arguments provide message as property
+        if message is not None:
+            self.message = message
+        if messages is not None:
+            self.messages = messages
+
+    def __str__(self):
+        message = self.__class__.__name__
+        if hasattr(self, 'message') and self.message:
+            message += ": %s" % self.message
+        if hasattr(self, 'messages') and self.messages:
+            message += structuredString(self.messages)
+        return message
+
+
+class UnexpectedAnswerException(AvrProgException):
+    def __init__(self, command, receivedLines, expectedLines):
+        self.command = command
+        self.receivedLines = receivedLines
+        self.expectedLines = expectedLines
+
+    @property
+    def message(self):
+        return "in answer to command: '%s'" % self.command
+
+    @property
+    def messages(self):
+        return [
+            "received:",
+            self.receivedLines,
+            "expected:",
+            self.expectedLines,
+        ]
+
+
+class NotConnectedException(AvrProgException):
+    @property
+    def message(self):
+        return "Not connected."
+
+
+class NotRespondingException(AvrProgException):
+    @property
+    def message(self):
+        return "Device is not responding."
+
+
+class NotReadyException(AvrProgException):
+    def __init__(self, lines):
+        self.lines = lines
+
+    @property
+    def message(self):
+        return "Device is not ready"
+
+    @property
+    def messages(self):
+        return [
+            'received:',
+            self.lines
+        ]
+
+class NotEnoughtSpaceException(AvrProgException):
+    def __init__(self, bufferSize, flashSize):
+        self.bufferSize = bufferSize
+        self.flashSize = flashSize
+
+    @property
+    def message(self):
+        return "Not enought space in memmory, need %s, but %s only is free." % (
+            byteSize(self.bufferSize),
+            byteSize(self.flashSize)
+        )
+
+
+class FlashWriteException(AvrProgException):
+    def __init__(self, failedPages):
+        self.failedPages = failedPages
+
+    @property
+    def message(self):
+        return "Error writing %d page(s), first at address 0x%06x." % (
+            len(self.failedPages),
+            self.failedPages[0][0]
+        )
+
+    @property
+    def messages(self):
+        messages = []
+        for addr, lines in self.failedPages:
+            messages.append("page 0x%06x:" % addr)
+            messages.append(lines if lines else ['no answer'])
+        return messages
+
+
+class VerifyException(AvrProgException):
+    pass
+
+
+class BufferEmptyException(AvrProgException):
+    @property
+    def message(self):
+        return "Buffer is empty."
+
+
+class NotInBootloaderException(AvrProgException):
+    @property
+    def message(self):
+        return "Not in bootloader."
+
+
+class NotInProgrammerException(AvrProgException):
+    @property
+    def message(self):
+        return "Not in programmer."
+
+
+class NotReadableException(AvrProgException):
+    @property
+    def message(self):
+        return "Device can not read flash, bootloader is built without read commands (make USE_READ=1)."
+
+
+class UnknownCommandException(AvrProgException):
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    @property
+    def message(self):
+        return "Unknown command '%s'." % self.cmd
+
+
+class UnknownCpuException(AvrProgException):
+    def __init__(self, signature):
+        self.signature = signature
+
+    @property
+    def message(self):
+        if not self.signature:
+            return "Error detecting CPU."
+        return 'Unknown CPU with signature: %s.' % ' '.join(
+            ['0x%02x' % byte for byte in self.signature]
+        )
+
+
+class NotExpectedCpuException(AvrProgException):
+    def __init__(self, expected, detected):
+        self.expected = expected
+        self.detected = detected
+
+    @property
+    def message(self):
+        return "Detected CPU is %s but expected is %s." % (
+            self.detected,
+            ' or '.join(self.expected)
+        )
+
+
+class FleetException(AvrProgException):
+    def __init__(self, results):
+        self.results = results
+
+    @property
+    def failedResults(self):
+        return [result for result in self.results if result['error']]
+
+    @property
+    def message(self):
+        return "Failed %d of %d devices." % (len(self.failedResults), len(self.results))
+
+    @property
+    def messages(self):
+        return ["%s: %s" % (result['port'], result['error']) for result in self.failedResults]
+
+
+class SchedulerException(AvrProgException):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    @property
+    def failedJobs(self):
+        return [job for job in self.jobs if job.error]
+
+    @property
+    def message(self):
+        return "Failed %d of %d jobs." % (len(self.failedJobs), len(self.jobs))
+
+    @property
+    def messages(self):
+        return ["%s: %s" % (job.name, job.error) for job in self.failedJobs]
@@ -0,0 +1,413 @@
+"""memory image and file formats (intel hex, srec)"""
+
+import bisect
+import binascii
+import struct
+
+from avrproglib.dbg import dbg, byteSize
+
+
+class MemoryImage(object):
+    """sparse memory image
+
+    ordered list of non-overlapping and non-adjacent segments, address
+    space between segments is not populated (erased flash, 0xff)"""
+
+    def __init__(self, data=None, addr=0):
+        # start addresses of segments, sorted (for bisect)
+        self.starts = []
+        # data of segments (bytearray)
+        self.segments = []
+        if data:
+            self.write(addr, data)
+
+    def __len__(self):
+        """count of populated bytes"""
+        return sum([len(segment) for segment in self.segments])
+
+    @property
+    def startAddr(self):
+        return self.starts[0] if self.starts else 0
+
+    @property
+    def endAddr(self):
+        """address after last populated byte"""
+        return self.starts[-1] + len(self.segments[-1]) if self.starts else 0
+
+    def extents(self):
+        """(addr, data) of all segments"""
+        return zip(self.starts, self.segments)
+
+    def write(self, addr, data):
+        size = len(data)
+        if not size:
+            return
+        end = addr + size
+        if self.starts and addr == self.endAddr:
+            # fast path for sequential loading
+            try:
+                self.segments[-1] += data
+            except BufferError:
+                # segment is exported by memoryview, so it can not be resized
+                self.segments[-1] = self.segments[-1] + data
+            return
+        # all segments overlapping or touching written range
+        i = bisect.bisect_left(self.starts, addr)
+        if i > 0 and self.starts[i - 1] + len(self.segments[i - 1]) >= addr:
+            i -= 1
+        j = bisect.bisect_right(self.starts, end)
+        if i == j:
+            self.starts.insert(i, addr)
+            self.segments.insert(i, bytearray(data))
+            return
+        start = min(self.starts[i], addr)
+        segmentEnd = max(self.starts[j - 1] + len(self.segments[j - 1]), end)
+        if j - i == 1 and start == self.starts[i] and segmentEnd == start + len(self.segments[i]):
+            # inside of one segment
+            self.segments[i][addr - start:end - start] = data
+            return
+        merged = bytearray(segmentEnd - start)
+        for segmentStart, segment in zip(self.starts[i:j], self.segments[i:j]):
+            merged[segmentStart - start:segmentStart - start + len(segment)] = segment
+        merged[addr - start:end - start] = data
+        self.starts[i:j] = [start]
+        self.segments[i:j] = [merged]
+
+    def read(self, addr, size, fill=0xff):
+        """copy of memory, not populated bytes are filled"""
+        data = bytearray(chr(fill)) * size
+        end = addr + size
+        i = max(bisect.bisect_right(self.starts, addr) - 1, 0)
+        while i < len(self.starts) and self.starts[i] < end:
+            start = self.starts[i]
+            segment = self.segments[i]
+            dataFrom = max(start, addr)
+            dataTo = min(start + len(segment), end)
+            if dataFrom < dataTo:
+                data[dataFrom - addr:dataTo - addr] = buffer(segment, dataFrom - start, dataTo - dataFrom)
+            i += 1
+        return data
+
+    def view(self, addr, size):
+        """memoryview of memory if it is whole in one segment, otherwise copy"""
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr + size <= self.starts[i] + len(self.segments[i]):
+            offset = addr - self.starts[i]
+            return memoryview(self.segments[i])[offset:offset + size]
+        return memoryview(self.read(addr, size))
+
+    def pages(self, pageSize):
+        """(addr, data) of pages with some populated bytes
+
+        data starts on page address (not populated bytes are 0xff)
+        and ends with last populated byte in page"""
+        previousPageAddr = None
+        for start, segment in self.extents():
+            for pageAddr in xrange(start - start % pageSize, start + len(segment), pageSize):
+                if pageAddr == previousPageAddr:
+                    # page is shared with previous segment
+                    continue
+                previousPageAddr = pageAddr
+                # last segment which starts in this page
+                i = bisect.bisect_left(self.starts, pageAddr + pageSize) - 1
+                dataEnd = min(pageAddr + pageSize, self.starts[i] + len(self.segments[i]))
+                yield pageAddr, self.view(pageAddr, dataEnd - pageAddr)
+
+    def crc16(self, addr, size, fill=0xff):
+        """CRC16 of memory, not populated bytes are filled"""
+        crc = Crc16()
+        end = addr + size
+        for start, segment in self.extents():
+            dataFrom = max(start, addr)
+            dataTo = min(start + len(segment), end)
+            if dataFrom >= dataTo:
+                continue
+            crc.updateFill(dataFrom - addr, fill)
+            crc.update(buffer(segment, dataFrom - start, dataTo - dataFrom))
+            addr = dataTo
+        crc.updateFill(end - addr, fill)
+        return crc.crc
+
+
+class IntelHexException(Exception):
+    def __init__(self, message="IntelHexException."):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class IntelHex(object):
+    # record types
+    DATA = 0x00
+    END_OF_FILE = 0x01
+    EXTENDED_SEGMENT_ADDRESS = 0x02
+    START_SEGMENT_ADDRESS = 0x03
+    EXTENDED_LINEAR_ADDRESS = 0x04
+    START_LINEAR_ADDRESS = 0x05
+
+    def __init__(self, dataBuffer=None):
+        self.dataBuffer = dataBuffer if dataBuffer is not None else MemoryImage()
+        self.loadSize = 0
+        self.startAddr = None
+        self.entryAddr = None
+        self.baseAddr = 0
+        self.finished = False
+
+    def encodeRecord(self, record):
+        record = record.strip()
+        if not record:
+            return
+        if not record.startswith(':'):
+            raise IntelHexException("This is not an intel hex file.")
+        # decode whole record (count, address, type, data, checksum) at once
+        try:
+            recordBytes = bytearray(binascii.unhexlify(record[1:]))
+        except TypeError:
+            if len(record) % 2 == 0:
+                raise IntelHexException("Wrong intel hex line length.")
+            raise IntelHexException("Wrong intel hex data.")
+        # validate length
+        if len(recordBytes) < 5 or recordBytes[0] + 5 != len(recordBytes):
+            raise IntelHexException("Wrong intel hex line length.")
+        # validate checksum
+        if sum(recordBytes) & 0xff:
+            raise IntelHexException("Wrong intel hex checksum.")
+        addr = (recordBytes[1] << 8) | recordBytes[2]
+        recordType = recordBytes[3]
+        bytes = recordBytes[4:-1]
+        if recordType == self.DATA:
+            addr += self.baseAddr
+            if self.startAddr is None:
+                self.startAddr = addr
+            self.dataBuffer.write(addr, bytes)
+            self.loadSize += len(bytes)
+        elif recordType == self.END_OF_FILE:
+            self.finished = True
+        elif recordType in (self.EXTENDED_SEGMENT_ADDRESS, self.EXTENDED_LINEAR_ADDRESS) and len(bytes) == 2:
+            self.baseAddr = (bytes[0] << 8) | bytes[1]
+            self.baseAddr <<= 4 if recordType == self.EXTENDED_SEGMENT_ADDRESS else 16
+        elif recordType == self.START_SEGMENT_ADDRESS and len(bytes) == 4:
+            cs, ip = struct.unpack('>HH', str(bytes))
+            self.entryAddr = (cs << 4) + ip
+        elif recordType == self.START_LINEAR_ADDRESS and len(bytes) == 4:
+            self.entryAddr = struct.unpack('>I', str(bytes))[0]
+        else:
+            raise IntelHexException("Unknown record: %02x." % recordType)
+
+    def encodeLines(self, lines):
+        for line in lines:
+            self.encodeRecord(line)
+            if self.finished:
+                break
+        if self.startAddr is None:
+            raise IntelHexException("No data section found in intel hex file.")
+
+    def encodeFile(self, fileName):
+        with open(fileName) as hexFile:
+            self.encodeLines(hexFile)
+        dbg.info('  loaded from address: 0x%06x: %s' % (
+            self.startAddr,
+            byteSize(self.loadSize, maxMult=10)
+        ))
+        if self.entryAddr is not None:
+            dbg.info('  entry address: 0x%06x' % self.entryAddr, loglevel=3)
+
+    @staticmethod
+    def record(recordType, addr, data=''):
+        recordBytes = bytearray(struct.pack('>BHB', len(data), addr, recordType)) + data
+        return ':%s%02X' % (binascii.hexlify(recordBytes).upper(), -sum(recordBytes) & 0xff)
+
+    def decodeLines(self, recordSize=16):
+        """generate records for populated parts of buffer"""
+        baseAddr = 0
+        for start, segment in self.dataBuffer.extents():
+            end = start + len(segment)
+            addr = start
+            while addr < end:
+                if addr >> 16 != baseAddr:
+                    baseAddr = addr >> 16
+                    yield self.record(self.EXTENDED_LINEAR_ADDRESS, 0, struct.pack('>H', baseAddr))
+                # record can not cross 64KB boundary
+                size = min(recordSize, end - addr, 0x10000 - (addr & 0xffff))
+                yield self.record(self.DATA, addr & 0xffff, str(buffer(segment, addr - start, size)))
+                addr += size
+        yield self.record(self.END_OF_FILE, 0)
+
+    def decodeFile(self, fileName):
+        with open(fileName, 'w') as hexFile:
+            for line in self.decodeLines():
+                hexFile.write(line + '\n')
+
+
+class SrecException(Exception):
+    def __init__(self, message="SrecException."):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class Srec(object):
+    # size of address field for records S0..S9, 0 for unknown record
+    ADDR_SIZES = (2, 2, 3, 4, 0, 2, 3, 4, 3, 2, )
+
+    def __init__(self, dataBuffer=None):
+        self.dataBuffer = dataBuffer if dataBuffer is not None else MemoryImage()
+        self.loadSize = 0
+        self.startAddr = None
+        self.entryAddr = None
+        self.srecHeader = None
+        self.dataRecordsCount = 0
+        self.finished = False
+
+    def encodeRecord(self, srec):
+        srec = srec.strip()
+        if not srec:
+            return
+        if not srec.startswith('S'):
+            raise SrecException("This is not an motorola srec file.")
+        record = srec[1:2]
+        # decode whole record (count, address, data, checksum) at once
+        try:
+            recordBytes = bytearray(binascii.unhexlify(srec[2:]))
+        except TypeError:
+            if len(srec) % 2:
+                raise SrecException("Wrong srec line length.")
+            raise SrecException("Wrong srec data.")
+        # validate length
+        if not recordBytes or recordBytes[0] + 1 != len(recordBytes):
+            raise SrecException("Wrong srec line length.")
+        # validate checksum
+        if sum(recordBytes) & 0xff != 0xff:
+            raise SrecException("Wrong srec checksum.")
+        # address size
+        addrSize = self.ADDR_SIZES[int(record)] if record.isdigit() else 0
+        if addrSize == 0 or len(recordBytes) < addrSize + 2:
+            raise SrecException("Unknown record: %s." % record)
+        record = int(record)
+        addr = int(srec[4:(4 + addrSize * 2)], 16)
+        bytes = recordBytes[1 + addrSize:-1]
+        if record == 0:
+            # srec header record
+            self.srecHeader = str(bytes)
+            dbg.info('  srec header: %s.' % self.srecHeader, loglevel=3)
+        elif record in (1, 2, 3):
+            # data sequence record
+            if self.startAddr is None:
+                self.startAddr = addr
+            self.dataBuffer.write(addr, bytes)
+            self.dataRecordsCount += 1
+            self.loadSize += len(bytes)
+        elif record in (5, 6):
+            # count of data records in actual transmition
+            if addr != self.dataRecordsCount:
+                raise SrecException("Wrong srec records count, expected %d, found %d." % (
+                    addr,
+                    self.dataRecordsCount
+                ))
+        elif record in (7, 8, 9):
+            # end of transmition with entry address
+            self.entryAddr = addr
+            self.finished = True
+
+    def encodeLines(self, srecLines):
+        for srec in srecLines:
+            self.encodeRecord(srec)
+            if self.finished:
+                break
+        if self.startAddr is None:
+            raise SrecException("No data section found in srec file.")
+
+    def encodeFile(self, fileName):
+        with open(fileName) as srecFile:
+            self.encodeLines(srecFile)
+        dbg.info('  loaded from address: 0x%06x: %s' % (
+            self.startAddr,
+            byteSize(self.loadSize, maxMult=10)
+        ))
+        if self.entryAddr is not None:
+            dbg.info('  entry address: 0x%06x' % self.entryAddr, loglevel=3)
+
+
+def crc16_update(crc, val, poly=0xa001):
+    crc ^= (val & 0x00ff)
+    i = 0
+    while (i < 8):
+        if (crc & 1):
+            crc = (crc >> 1) ^ poly
+        else:
+            crc = (crc >> 1)
+        i += 1
+    return crc & 0xffff
+
+
+class Crc16(object):
+    """CRC16 with polynomial 0xa001 and zero init, same as avrboot checkCrc()
+
+    table is built on first use, runs of one repeated byte (0xff padding)
+    are computed in O(log n) as powers of affine map of one byte step"""
+
+    POLY = 0xa001
+    table = None
+    fillMaps = {}
+
+    def __init__(self, crc=0):
+        self.crc = crc
+
+    @classmethod
+    def getTable(cls):
+        if cls.table is None:
+            cls.table = [crc16_update(0, byte, cls.POLY) for byte in xrange(256)]
+        return cls.table
+
+    def update(self, data):
+        table = self.getTable()
+        crc = self.crc
+        for byte in bytearray(data):
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+        self.crc = crc
+        return self
+
+    @staticmethod
+    def mapApply(crcMap, crc):
+        columns, constant = crcMap
+        for column in columns:
+            if crc & 1:
+                constant ^= column
+            crc >>= 1
+        return constant
+
+    @classmethod
+    def mapCompose(cls, crcMap1, crcMap2):
+        """map which apply crcMap1 and then crcMap2"""
+        columns, constant = crcMap1
+        return (
+            [cls.mapApply(crcMap2, column) ^ crcMap2[1] for column in columns],
+            cls.mapApply(crcMap2, constant)
+        )
+
+    @classmethod
+    def getFillMaps(cls, byte, count):
+        """maps of 1, 2, 4, .. repeated bytes, enough to cover count"""
+        maps = cls.fillMaps.setdefault(byte, [])
+        if not maps:
+            table = cls.getTable()
+            constant = table[byte]
+            maps.append((
+                [((1 << bit) >> 8) ^ table[(1 << bit) & 0xff] for bit in xrange(16)],
+                constant
+            ))
+        while (1 << len(maps)) <= count:
+            maps.append(cls.mapCompose(maps[-1], maps[-1]))
+        return maps
+
+    def updateFill(self, count, byte=0xff):
+        """same as update(chr(byte) * count)"""
+        crc = self.crc
+        for crcMap in self.getFillMaps(byte, count):
+            if count & 1:
+                crc = self.mapApply(crcMap, crc)
+            count >>= 1
+        self.crc = crc
+        return self
@@ -0,0 +1,88 @@
+"""journal of flash pages acknowledged by device, it is written by
+flash:resume, so flash interrupted by lost link can be resumed from it"""
+
+import os
+import struct
+import hashlib
+
+JOURNAL_DIR = os.path.expanduser('~/.avrprog/journal')
+
+
+def imageHash(dataBuffer, pageSize):
+    """sha1 of page size, addresses and data of all buffer segments"""
+    h = hashlib.sha1(struct.pack('>I', pageSize))
+    for start, data in dataBuffer.extents():
+        h.update(struct.pack('>I', start))
+        h.update(data)
+    return h.hexdigest()
+
+
+class FlashJournal(object):
+    """journal file of one device (port and cpu)
+
+    first line is hash of image, next lines are addresses of acknowledged
+    pages, each written when its acknowledge is received. Journal of
+    finished flash is removed."""
+
+    def __init__(self, journalDir, port, device, imageHash):
+        self.fileName = os.path.join(journalDir, hashlib.sha1('%s\n%s' % (port, device)).hexdigest())
+        self.imageHash = imageHash
+        self.pages = set()
+        # page acknowledged as last, first page to verify on resume
+        self.lastPage = None
+        self.file = None
+
+    def load(self):
+        """read pages of interrupted flash of same image, return True if
+        journal was found"""
+        try:
+            with open(self.fileName) as f:
+                lines = f.read().split('\n')
+        except IOError:
+            return False
+        if lines[0] != self.imageHash:
+            return False
+        # last line is not finished (empty if program was not killed
+        # while writing it)
+        for line in lines[1:-1]:
+            try:
+                addr = int(line, 16)
+            except ValueError:
+                continue
+            self.pages.add(addr)
+            self.lastPage = addr
+        return True
+
+    def open(self):
+        """start journal, pages loaded by load() are kept"""
+        directory = os.path.dirname(self.fileName)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(self.fileName, 'w')
+        self.file.write(self.imageHash + '\n')
+        for addr in sorted(self.pages):
+            self.file.write('%06x\n' % addr)
+        self.file.flush()
+
+    def add(self, addr):
+        self.file.write('%06x\n' % addr)
+        # flushed to system, so journal survives killed program
+        self.file.flush()
+        self.pages.add(addr)
+        self.lastPage = addr
+
+    def discard(self, addr):
+        """forget page, journal file is written again"""
+        self.pages.discard(addr)
+        self.open()
+        self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
@@ -0,0 +1,1037 @@
+"""AvrProg, client of avrprog programmer and avrboot bootloader"""
+
+import collections
+import binascii
+import struct
+
+from avrproglib.dbg import dbg, byteSize
+from avrproglib.exceptions import (
+    AvrProgException,
+    BufferEmptyException,
+    FlashWriteException,
+    NotConnectedException,
+    NotEnoughtSpaceException,
+    NotExpectedCpuException,
+    NotInBootloaderException,
+    NotInProgrammerException,
+    NotReadableException,
+    NotReadyException,
+    NotRespondingException,
+    UnexpectedAnswerException,
+    UnknownCpuException,
+    VerifyException,
+)
+from avrproglib.image import Crc16, IntelHex, MemoryImage, Srec
+from avrproglib.journal import JOURNAL_DIR, FlashJournal, imageHash
+from avrproglib.protocol import crc8, frameDecode, frameEncode, printable, sparseEncode
+from avrproglib.terminal import (
+    AsyncSerialTerminal,
+    CmdFlush,
+    CmdReceive,
+    CmdWrite,
+    Return,
+    SerialTerminal,
+)
+
+
+class AvrProg(object):
+    terminalClass = SerialTerminal
+    asyncTerminalClass = AsyncSerialTerminal
+
+    # device works before it answers these commands (reads flash, erases,
+    # connects cpu or is starting after reboot), so their answers are
+    # waited for at least default timeout of terminal
+    SLOW_COMMANDS = (
+        'hello',
+        'avr connect',
+        'avr flash erase',
+        'avr flash crc',
+        'avr flash read',
+        'avr flash bread',
+        'crc',
+        'read',
+        'bread',
+    )
+    # uart receive buffer of avrprog and avrboot firmware, pipelined page
+    # command longer than this can overrun it while device writes page
+    DEVICE_RX_BUFFER = 128
+
+    def __init__(self):
+        self.term = None
+        self.port = None
+
+        self.deviceName = ''
+        self.deviceCpu = ''
+        self.deviceVersion = ''
+        self.deviceCrcStatus = ''
+        self.deviceFlashMagic = 0x4321
+        # device can compute crc16 of flash, None if not known yet
+        self.deviceFlashCrc = None
+        # Progress of actual phase, None if not shown
+        self.progress = None
+
+        self.flashSize = 0
+        self.flashPageSize = 0
+        self.eepromSize = 0
+        self.fuses = []
+
+        self.deviceBinary = 0
+        # bootloader can read flash (crc and read), programmer always can
+        self.deviceRead = False
+        # directory of journals of flash:resume, None is JOURNAL_DIR
+        self.journalDir = None
+
+        self.resetJob()
+
+    def resetJob(self):
+        """clear buffer and set settings of commands to defaults, connected
+        port and detected device are kept"""
+        # count of pages sent to device before waiting for acknowledge
+        self.flashWindow = 1
+        # size of flash parts compared by crc16 in verify
+        self.crcBlockSize = 1024
+        # use binary frames if device support them
+        self.binaryMode = True
+
+        self.dataBuffer = MemoryImage()
+
+    def cmdSend(self, cmd, expectedLines=list(), expectedLinesCount=None):
+        if not self.term:
+            raise NotConnectedException()
+        res = self.term.cmdSend(
+            cmd,
+            disableResultError=bool(expectedLines),
+            expectedLinesCount=expectedLinesCount,
+            slow=self.isSlowCommand(cmd)
+        )
+        return self.checkAnswer(cmd, res, expectedLines)
+
+    def isSlowCommand(self, cmd):
+        words = cmd.split()
+        for slowCmd in self.SLOW_COMMANDS:
+            slowWords = slowCmd.split()
+            if words[:len(slowWords)] == slowWords:
+                return True
+        return False
+
+    def cmdStream(self, cmd, expectedLinesCount=None):
+        """send command and yield answer lines as they are received
+
+        if consumer closes the stream before the end of answer,
+        device is asked to abort the command"""
+        if not self.term:
+            raise NotConnectedException()
+        self.term.flushInput()
+        self.term.cmdWrite(cmd, self.isSlowCommand(cmd))
+        finished = False
+        try:
+            for line in self.term.cmdReceiveLines(expectedLinesCount=expectedLinesCount):
+                yield line
+            finished = True
+        finally:
+            if not finished:
+                self.term.cmdAbort()
+
+    def checkAnswer(self, cmd, res, expectedLines=list()):
+        statusOk = not expectedLines
+        for line in res or []:
+            if line in expectedLines:
+                statusOk = True
+        if not statusOk:
+            raise UnexpectedAnswerException(cmd, res, expectedLines)
+        return res
+
+    def connect(self, port):
+        dbg.msg("openning port: %s" % port)
+        self.term = self.terminalClass(port)
+        self.port = port
+        self.hello()
+
+    def getDeviceName(self):
+        return self.deviceName
+
+    def isBootloader(self):
+        return self.deviceName == 'avrboot'
+
+    def isProgrammer(self):
+        return self.deviceName == 'avrprog'
+
+    def isKnownDevice(self):
+        return self.deviceName in ('avrprog', 'avrboot')
+
+    def isBinary(self, level=1):
+        return self.binaryMode and self.deviceBinary >= level
+
+    def isProgrammingDevice(self):
+        return self.deviceName in ('avrprog', 'avrboot')
+
+    def isFlashReadable(self):
+        return self.isProgrammer() or (self.isBootloader() and self.deviceRead)
+
+    def readFile(self, fileName=""):
+        dbg.msg("loading file: %s" % fileName)
+        if fileName.endswith('.srec'):
+            srecFile = Srec(self.dataBuffer)
+            srecFile.encodeFile(fileName)
+        elif fileName.endswith('.hex'):
+            hexFile = IntelHex(self.dataBuffer)
+            hexFile.encodeFile(fileName)
+        elif fileName.endswith('.bin'):
+            with open(fileName, 'rb') as binaryFile:
+                self.dataBuffer = MemoryImage(binaryFile.read())
+        else:
+            raise AvrProgException("Unsupported file format '%s'." % fileName.split('.')[-1])
+
+    def writeFile(self, fileName=""):
+        dbg.msg("saving file: %s" % fileName)
+        if not len(self.dataBuffer):
+            raise BufferEmptyException()
+        if fileName.endswith('.hex'):
+            hexFile = IntelHex(self.dataBuffer)
+            hexFile.decodeFile(fileName)
+        elif fileName.endswith('.bin'):
+            with open(fileName, 'wb') as binaryFile:
+                binaryFile.write(self.dataBuffer.read(0, self.dataBuffer.endAddr))
+        else:
+            raise AvrProgException("Unsupported file format '%s'." % fileName.split('.')[-1])
+
+    def clearBuffer(self):
+        self.dataBuffer = MemoryImage()
+
+    def signBuffer(self):
+        dbg.msg("signing for bootloader")
+        if not len(self.dataBuffer):
+            raise BufferEmptyException()
+        if not self.isBootloader():
+            raise NotInBootloaderException()
+        sizeLimit = self.flashSize - 4
+        bufferSize = self.dataBuffer.endAddr
+        if bufferSize > sizeLimit:
+            raise NotEnoughtSpaceException(bufferSize=bufferSize, flashSize=sizeLimit)
+        bufferCrc16 = self.dataBuffer.crc16(0, bufferSize)
+        self.dataBuffer.write(sizeLimit, struct.pack('<HH', bufferSize, bufferCrc16))
+
+    def printHexLine(self, addr, data):
+        if not data:
+            return
+        line = '%06x' % addr
+        ascii = '  |'
+        count = 0
+        for byte in data:
+            if count % 8 == 0:
+                line += ' '
+            count += 1
+            line += ' %02x' % byte
+            ascii += ('%c' % byte) if 0x20 <= byte < 0x7f else '.'
+        line += '   ' * (16 - count)
+        line += ' ' if (count <= 8) else ''
+        line += ascii
+        line += ' ' * (16 - count)
+        line += '|'
+        print line
+
+    def printBuffer(self):
+        dbg.msg("buffer hexdump:")
+        previousLineAddr = None
+        previousLineData = None
+        repeat = False
+        for lineAddr, lineData in self.dataBuffer.pages(16):
+            lineData = bytearray(lineData)
+            if lineData == previousLineData and lineAddr == previousLineAddr + 16:
+                if not repeat:
+                    print "*"
+                    repeat = True
+            else:
+                repeat = False
+                self.printHexLine(lineAddr, lineData)
+            previousLineData = lineData
+            previousLineAddr = lineAddr
+        if repeat:
+            self.printHexLine(previousLineAddr, previousLineData)
+
+    def hello(self):
+        self.helloAnswer(self.cmdSend('hello'))
+
+    def helloAnswer(self, res):
+        self.deviceName = ''
+        self.deviceCpu = ''
+        self.deviceVersion = ''
+        self.deviceCrcStatus = ''
+        self.deviceFlashCrc = None
+        self.deviceBinary = 0
+        self.deviceRead = False
+        hello = False
+        for line in res:
+            cmd = line.split()
+            if cmd[0] == 'hello':
+                hello = True
+            elif cmd[0] == 'device':
+                self.deviceName = cmd[1]
+                if len(cmd) >= 3:
+                    self.deviceVersion = cmd[2]
+            elif cmd[0] == 'cpu':
+                self.deviceCpu = cmd[1]
+            elif cmd[0] == 'bootaddr':
+                self.flashSize = int(cmd[1])
+            elif cmd[0] == 'pagesize':
+                self.flashPageSize = int(cmd[1])
+            elif cmd[0] == 'magic':
+                self.deviceFlashMagic = int(cmd[1])
+            elif cmd[0] == 'crc':
+                self.deviceCrcStatus = cmd[1]
+            elif cmd[0] == 'binary':
+                # 1: binary frames, 2: also sparse page frames
+                self.deviceBinary = int(cmd[1])
+            elif cmd[0] == 'read':
+                self.deviceRead = True
+        if not hello or not self.deviceName:
+            raise UnexpectedAnswerException('hello', res, ['hello', 'device <name>'])
+        dbg.info("  device: %s" % self.deviceName)
+        if self.deviceCpu:
+            dbg.info("  cpu: %s" % self.deviceCpu)
+        if self.isBootloader():
+            dbg.info("  space: %s" % byteSize(self.flashSize - 4, maxMult=100))
+            dbg.info("  app: %s" % self.deviceCrcStatus)
+            if not self.deviceRead:
+                # bootloader without read has no crc command too
+                self.deviceFlashCrc = False
+                dbg.info("  flash can not be read")
+
+    def flash(self, params=()):
+        blocks = self.flashPrepare(params, allowedParams=('diff', 'resume'))
+        # journal is written only by flash which can be resumed
+        journal = self.flashJournal() if 'resume' in params else None
+        boundary = []
+        if journal:
+            if journal.load():
+                if self.isFlashReadable():
+                    # last acknowledged page is verified after resumed flash
+                    boundary = [block for block in blocks if block['addr'] == journal.lastPage]
+                else:
+                    # and written again if it can not be verified
+                    journal.discard(journal.lastPage)
+                blocksCount = len(blocks)
+                blocks = [block for block in blocks if block['addr'] not in journal.pages]
+                dbg.info("  resumed, %d of %d pages were written" % (blocksCount - len(blocks), blocksCount))
+            else:
+                dbg.warning("no journal of interrupted flash, writing all pages")
+        if 'diff' in params and not self.isFlashReadable():
+            dbg.warning("device can not read flash, writing all pages")
+        elif 'diff' in params:
+            blocksCount = len(blocks)
+            blocks = self.flashChangedBlocks(blocks)
+            dbg.info("  skipped %d of %d unchanged pages" % (blocksCount - len(blocks), blocksCount))
+        if journal:
+            journal.open()
+        try:
+            self.flashBlocks(blocks, journal)
+        finally:
+            if journal:
+                journal.close()
+        if boundary:
+            # boundary page is written again by next resume, if it is
+            # wrong or verify is interrupted
+            journal.discard(boundary[0]['addr'])
+        for block in boundary:
+            self.flashVerifyRange(block['addr'], block['data'])
+        if journal:
+            journal.remove()
+
+    def flashJournal(self, withImage=True):
+        """journal of flash of actual port and device, None if port is not
+        known"""
+        if not self.port:
+            return None
+        return FlashJournal(
+            self.journalDir or JOURNAL_DIR,
+            self.port,
+            self.deviceCpu or self.deviceName,
+            imageHash(self.dataBuffer, self.flashPageSize) if withImage else None
+        )
+
+    def flashPrepare(self, params=(), allowedParams=('diff', )):
+        dbg.msg("writing flash")
+        if not len(self.dataBuffer):
+            raise BufferEmptyException()
+        if not self.isProgrammingDevice():
+            raise NotInBootloaderException()
+        for param in params:
+            if param not in allowedParams:
+                raise AvrProgException("Wrong flash option: %s" % param)
+        return self.flashBlocksPlan()
+
+    def flashBlocksPlan(self):
+        """split populated parts of buffer to pages, pages with 0xff only are skipped
+
+        data of blocks are memoryview slices of buffer (no copy)"""
+        blankPage = '\xff' * self.flashPageSize
+        blocks = []
+        for addr, data in self.dataBuffer.pages(self.flashPageSize):
+            if data == blankPage[:len(data)]:
+                continue
+            blocks.append({
+                'addr': addr,
+                'data': data,
+            })
+        return blocks
+
+    def flashBlockPage(self, block):
+        """block data as stored in device page (device fill rest of page with 0xff)"""
+        return block['data'].tobytes() + '\xff' * (self.flashPageSize - len(block['data']))
+
+    def flashChangedBlocks(self, blocks):
+        """return only blocks which differ from content of device"""
+        changedBlocks = self.flashChangedBlocksCrc(blocks)
+        if self.isBootloader():
+            return changedBlocks
+        # programmer need to check if changed pages can be written without erase
+        return self.flashChangedBlocksRead(blocks if changedBlocks is None else changedBlocks)
+
+    def flashChangedBlocksCrc(self, blocks):
+        """return blocks with other crc16 in device, None if device can not compute crc"""
+        crcs = self.flashCrc([(block['addr'], self.flashPageSize) for block in blocks])
+        if crcs is None:
+            return None
+        changedBlocks = []
+        for block, deviceCrc16 in zip(blocks, crcs):
+            if self.dataBuffer.crc16(block['addr'], self.flashPageSize) != deviceCrc16:
+                changedBlocks.append(block)
+        return changedBlocks
+
+    def flashCrcCommand(self, addr, size):
+        if self.isBootloader():
+            return "crc %04x %04x" % (addr, size)
+        if self.isProgrammer():
+            return "avr flash crc %06x %06x" % (addr, addr + size - 1)
+        raise NotInBootloaderException()
+
+    def flashCrc(self, ranges):
+        """crc16 of flash ranges [(addr, size), ..] computed in device
+
+        return list of crc16 or None if device can not compute crc
+        (firmware without crc command)"""
+        if self.deviceFlashCrc is False:
+            return None
+        crcs = []
+        for (addr, size), res in self.cmdPipeline(ranges, lambda item: self.flashCrcCommand(*item)):
+            deviceCrc16 = None
+            for line in res or []:
+                cmd = line.split()
+                if cmd[0] == 'crc' and len(cmd) == 2:
+                    deviceCrc16 = int(cmd[1], 16)
+                elif 'error' in line and self.deviceFlashCrc is None:
+                    self.deviceFlashCrc = False
+            if self.deviceFlashCrc is False:
+                # collect the rest of answers
+                continue
+            if deviceCrc16 is None:
+                raise UnexpectedAnswerException(self.flashCrcCommand(addr, size), res, ['crc <crc16>'])
+            crcs.append(deviceCrc16)
+        if self.deviceFlashCrc is False:
+            dbg.info("  device can not compute crc")
+            return None
+        self.deviceFlashCrc = True
+        return crcs
+
+    def flashChangedBlocksRead(self, blocks):
+        """read pages from device, consecutive pages are read by one command
+
+        without chip erase programmer can only clear bits in flash,
+        so pages which need to set some bit can not be written"""
+        changedBlocks = []
+        i = 0
+        while i < len(blocks):
+            j = i + 1
+            while j < len(blocks) and blocks[j]['addr'] == blocks[j - 1]['addr'] + self.flashPageSize:
+                j += 1
+            addrFrom = blocks[i]['addr']
+            data = self.flashRead(addrFrom, blocks[j - 1]['addr'] + self.flashPageSize - 1)
+            for block in blocks[i:j]:
+                offset = block['addr'] - addrFrom
+                devicePage = data[offset:offset + self.flashPageSize]
+                page = self.flashBlockPage(block)
+                if devicePage == page:
+                    continue
+                for deviceByte, byte in zip(devicePage, bytearray(page)):
+                    if deviceByte & byte != byte:
+                        raise AvrProgException(
+                            "Page 0x%06x can not be changed without chip erase, use erase and flash instead." % (
+                                block['addr']
+                            )
+                        )
+                changedBlocks.append(block)
+            i = j
+        return changedBlocks
+
+    def flashBlockCommand(self, block):
+        """page write command, trailing 0xff are not sent (device fill the
+        rest of page with 0xff), sparse frame is used if it is shorter"""
+        data = memoryview(block['data']).tobytes().rstrip('\xff')
+        binary = ''
+        if self.isBinary():
+            binary = 'b'
+            if self.isBinary(2):
+                sparseData = sparseEncode(data)
+                if len(sparseData) < len(data):
+                    binary = 's'
+                    data = sparseData
+        if self.isBootloader():
+            cmd = "%sflash %04x %04x " % (binary, block['addr'], self.deviceFlashMagic)
+        elif self.isProgrammer():
+            cmd = "avr flash %swrite %02x %06x " % (binary, self.flashPageSize / 2, block['addr'])
+        else:
+            raise NotInBootloaderException()
+        if binary:
+            return cmd + frameEncode(data)
+        if self.isProgrammer() and len(data) % 2:
+            # programmer reads hex data by words
+            data += '\xff'
+        hexData = binascii.hexlify(data)
+        return cmd + hexData + "%02x" % crc8(data, hexData)
+
+    def cmdPipeline(self, items, command, window=None):
+        """send command for each item, keeping up to window (default
+        flashWindow) commands in flight
+
+        device process commands in order, so each answer belongs to the
+        oldest command. Yield (item, answer), where answer is list of
+        received lines or None if device is not responding. Items are taken
+        lazily, so consumer can stop sending by ending the items iterator."""
+        if not self.term:
+            raise NotConnectedException()
+        items = iter(items)
+        pending = collections.deque()
+        itemsEnd = False
+        if window is None:
+            window = self.flashWindow
+        self.term.flushInput()
+        while True:
+            if not itemsEnd and len(pending) < max(window, 1):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    itemsEnd = True
+                    continue
+                cmd = command(item)
+                slow = self.isSlowCommand(cmd)
+                self.term.cmdWrite(cmd, slow)
+                pending.append((item, slow))
+                continue
+            if not pending:
+                return
+            item, slow = pending.popleft()
+            res = None
+            # second wait is longer, new line can not be sent to wake
+            # device, its answer would be taken as answer of next command
+            for retry in xrange(2):
+                try:
+                    res = self.term.cmdReceive(retry=retry, slow=slow)
+                    break
+                except NotReadyException, e:
+                    res = e.lines
+                    break
+                except NotRespondingException:
+                    pass
+            yield item, res
+
+    def flashBlockWritten(self, res):
+        return res is not None and ('avr flash write done' in res or 'flash ok' in res)
+
+    def flashBlocks(self, blocks, journal=None):
+        """write blocks, after first error no more blocks are sent,
+        but answers for blocks already in flight are collected,
+        acknowledged blocks are written to journal"""
+        failedPages = []
+        warnings = []
+
+        def blocksToSend():
+            for block in blocks:
+                if failedPages:
+                    return
+                yield block
+
+        def blockCommand(block):
+            cmd = self.flashBlockCommand(block)
+            # command with line end sent by terminal
+            if self.flashWindow > 1 and len(cmd) + 4 > self.DEVICE_RX_BUFFER and not warnings:
+                warnings.append(cmd)
+                dbg.warning("page command of %d bytes does not fit in device buffer, window %d may overrun it" % (
+                    len(cmd) + 4, self.flashWindow))
+            return cmd
+
+        self.progressStart('flash', sum(len(block['data']) for block in blocks))
+        try:
+            for block, res in self.cmdPipeline(blocksToSend(), blockCommand):
+                if not self.flashBlockWritten(res):
+                    failedPages.append((block['addr'], res))
+                    if res is None:
+                        # device is lost, no more answers will come
+                        break
+                elif journal:
+                    journal.add(block['addr'])
+                if self.progress:
+                    self.progress.add(len(block['data']))
+        finally:
+            self.progressEnd()
+        if failedPages:
+            raise FlashWriteException(failedPages)
+
+    def reboot(self):
+        if self.isKnownDevice():
+            dbg.msg("rebooting")
+            self.term.cmdSend('reboot', disableResultError=True)
+        self.deviceName = ''
+
+    def bootloader(self):
+        if not self.isBootloader():
+            dbg.msg("restarting in to bootloader")
+            self.term.cmdSend('bootloader', disableResultError=True)
+        self.deviceName = ''
+
+    def startBootloader(self, cpu):
+        if not self.isBootloader():
+            self.bootloader()
+            self.hello()
+        if not self.isBootloader():
+            raise AvrProgException("Can not start bootloader.")
+        if not cpu or 'auto' in cpu:
+            return
+        if self.deviceCpu not in cpu:
+            raise NotExpectedCpuException(expected=cpu, detected=self.deviceCpu)
+
+    def setCpu(self, cpu):
+        dbg.msg("detecting CPU")
+        if not self.isProgrammer():
+            self.reboot()
+            self.hello()
+            if not self.isProgrammer():
+                raise NotInProgrammerException()
+        self.setCpuAnswer(self.cmdSend('avr connect', ['avr connected']), cpu)
+
+    def setCpuAnswer(self, res, cpu):
+        from avrproglib.cpus import cpuDb
+        self.deviceCpu = ''
+        signature = []
+        for line in res:
+            cmd = line.split()
+            if cmd[0] == 'signature':
+                for sig in cmd[1:]:
+                    signature.append(int(sig, 16))
+        attr = cpuDb.bySignature(signature)
+        if not attr:
+            raise UnknownCpuException(signature)
+        self.deviceCpu = attr['id']
+        self.flashPageSize = attr['flashPageWords'] * 2
+        self.flashSize = attr['flashPagesCount'] * self.flashPageSize
+        self.eepromSize = attr['eepromSize']
+        self.fuses = attr['fuses']
+        dbg.info("  detected cpu: " + attr['name'])
+        dbg.info("  flash size: %s" % byteSize(self.flashSize))
+        dbg.info("  eeprom size: %s" % byteSize(self.eepromSize))
+        if not cpu or 'auto' in cpu:
+            return
+        # expected cpu can be given also by avrdude id (m8)
+        if attr not in [cpuDb.byId(cpuId) for cpuId in cpu]:
+            raise NotExpectedCpuException(expected=cpu, detected=self.deviceCpu)
+
+    def erase(self):
+        if not self.isProgrammer():
+            raise NotInProgrammerException()
+        dbg.msg("erasing chip")
+        self.cmdSend('avr flash erase', ['avr flash erase done'])
+        # pages of interrupted flash are erased
+        journal = self.flashJournal(withImage=False)
+        if journal:
+            journal.remove()
+
+    def avrDisable(self):
+        if not self.isProgrammer():
+            raise NotInProgrammerException()
+        self.cmdSend('avr disconnect', ['avr disconnected'])
+
+    def progressStart(self, phase, total):
+        self.progress = dbg.progress(phase, total)
+
+    def progressEnd(self):
+        if self.progress:
+            self.progress.end()
+        self.progress = None
+
+    def flashVerify(self, params=()):
+        ranges = self.flashVerifyPrepare(params)
+        if 'read' not in params:
+            ranges = self.flashVerifyCrc(ranges)
+        self.progressStart('verify', sum(len(data) for start, data in ranges))
+        try:
+            for start, data in ranges:
+                self.flashVerifyRange(start, data)
+        finally:
+            self.progressEnd()
+
+    def flashVerifyCrc(self, ranges):
+        """compare crc16 of ranges with device, return ranges which has to
+        be verified by reading, ranges are split to crcBlockSize parts"""
+        chunks = []
+        for start, data in ranges:
+            for offset in xrange(0, len(data), self.crcBlockSize):
+                chunks.append((start + offset, data[offset:offset + self.crcBlockSize]))
+        crcs = self.flashCrc([(start, len(data)) for start, data in chunks])
+        if crcs is None:
+            return ranges
+        changedChunks = []
+        for (start, data), deviceCrc16 in zip(chunks, crcs):
+            if Crc16().update(data).crc != deviceCrc16:
+                changedChunks.append((start, data))
+        return changedChunks
+
+    def flashVerifyPrepare(self, params=()):
+        if not self.isProgrammingDevice():
+            raise NotInBootloaderException()
+        if not self.isFlashReadable():
+            raise NotReadableException()
+        if not len(self.dataBuffer):
+            raise BufferEmptyException()
+        for param in params:
+            if param not in ('full', 'read'):
+                raise AvrProgException("Wrong verify option: %s" % param)
+        dbg.msg("verifying flash")
+        if 'full' in params:
+            return self.dataBuffer.extents()
+        return self.flashVerifyRanges()
+
+    def flashVerifyRanges(self):
+        """ranges of buffer written by flash, pages with 0xff only are
+        skipped (same as in flashBlocksPlan), consecutive pages are joined
+
+        return list of (addr, data), data are memoryview slices of buffer"""
+        blankPage = '\xff' * self.flashPageSize
+        ranges = []
+        for start, segment in self.dataBuffer.extents():
+            data = memoryview(segment)
+            begin = end = offset = 0
+            while offset < len(data):
+                pageEnd = min(len(data), offset + self.flashPageSize - (start + offset) % self.flashPageSize)
+                if data[offset:pageEnd] != blankPage[:pageEnd - offset]:
+                    if offset != end:
+                        if end > begin:
+                            ranges.append((start + begin, data[begin:end]))
+                        begin = offset
+                    end = pageEnd
+                offset = pageEnd
+            if end > begin:
+                ranges.append((start + begin, data[begin:end]))
+        return ranges
+
+    def flashReadCommand(self, addrFrom, addrTo):
+        binary = 'b' if self.isBinary() else ''
+        if self.isBootloader():
+            return '%sread %04x %04x' % (binary, addrFrom, addrTo - addrFrom + 1)
+        return 'avr flash %sread %06x %06x' % (binary, addrFrom, addrTo)
+
+    def flashReadLinesCount(self, addrFrom, addrTo):
+        """count of data lines in answer to flash read"""
+        return (addrTo - addrFrom) / (128 if self.isBinary() else 32)
+
+    def flashVerifyRange(self, addrFrom, bufferData):
+        addrTo = addrFrom + len(bufferData) - 1
+        lines = self.cmdStream(
+            self.flashReadCommand(addrFrom, addrTo),
+            expectedLinesCount=self.flashReadLinesCount(addrFrom, addrTo)
+        )
+        try:
+            self.flashVerifyAnswer(addrFrom, bufferData, lines)
+        finally:
+            # on first mismatch the rest of flash is not read
+            lines.close()
+
+    def flashVerifyAnswer(self, addrFrom, bufferData, res):
+        addrTo = addrFrom
+        for addr, data in self.flashReadLines(res, addrFrom):
+            offset = addr - addrFrom
+            self.flashVerifyData(addr, bufferData[offset:offset + len(data)], data)
+            addrTo = addr + len(data)
+        if addrTo != addrFrom + len(bufferData):
+            raise VerifyException(
+                "Verify error, received data for %06x - %06x, expected %06x - %06x" % (
+                    addrFrom, addrTo - 1, addrFrom, addrFrom + len(bufferData) - 1
+                )
+            )
+
+    def flashVerifyData(self, addr, bufferData, data):
+        if bufferData != data:
+            for i, (bufferByte, flashByte) in enumerate(zip(bytearray(bufferData), data)):
+                if bufferByte != flashByte:
+                    raise VerifyException(
+                        "Verify error, addr: %06x dataBuffer: %02x flash: %02x" % (
+                            addr + i,
+                            bufferByte,
+                            flashByte
+                        )
+                    )
+
+    def flashVerifyDownload(self, verifyParams=(), addresses=list()):
+        """verify followed by download with one readback, ranges to verify
+        which are inside of downloaded range are compared with read data"""
+        ranges = self.flashVerifyPrepare([param for param in verifyParams if param != 'read'])
+        addrFrom, addrTo = self.flashDownloadPrepare(addresses)
+        data = self.flashRead(addrFrom, addrTo)
+        for start, rangeData in ranges:
+            if start >= addrFrom and start + len(rangeData) - 1 <= addrTo:
+                offset = start - addrFrom
+                self.flashVerifyData(start, rangeData, data[offset:offset + len(rangeData)])
+            else:
+                self.flashVerifyRange(start, rangeData)
+        self.dataBuffer = MemoryImage(data, addrFrom)
+
+    def flashDownload(self, addresses=list()):
+        addrFrom, addrTo = self.flashDownloadPrepare(addresses)
+        self.dataBuffer = MemoryImage(self.flashRead(addrFrom, addrTo), addrFrom)
+
+    def flashDownloadPrepare(self, addresses=list()):
+        if not self.isProgrammingDevice():
+            raise NotInBootloaderException()
+        if not self.isFlashReadable():
+            raise NotReadableException()
+        dbg.msg("reading flash")
+        addrFrom = 0
+        addrTo = self.flashSize - 1
+        if len(addresses) > 1:
+            addrFrom = int(addresses[0], 16)
+            addrTo = int(addresses[1], 16)
+        elif len(addresses) > 0:
+            addrTo = int(addresses[0], 16)
+        return addrFrom, addrTo
+
+    def flashRead(self, addrFrom, addrTo):
+        if not self.isProgrammingDevice():
+            raise NotInBootloaderException()
+        lines = self.cmdStream(
+            self.flashReadCommand(addrFrom, addrTo),
+            expectedLinesCount=self.flashReadLinesCount(addrFrom, addrTo)
+        )
+        self.progressStart('download', addrTo - addrFrom + 1)
+        try:
+            return self.flashReadAnswer(lines, addrFrom)
+        finally:
+            self.progressEnd()
+            lines.close()
+
+    def flashReadAnswer(self, res, addrFrom):
+        data = bytearray()
+        for addr, lineData in self.flashReadLines(res, addrFrom):
+            data += lineData
+        return data
+
+    def flashReadLines(self, res, addrFrom):
+        """decode 'data <addr> <hex data><crc8>' or 'bdata <addr> <frame>'
+        lines of flash read answer
+
+        each line is decoded by one unhexlify, crc8 is checked on line
+        as one integer, yield (addr, data) for each line"""
+        for line in res:
+            cmd = line.split()
+            if not cmd or cmd[0] not in ('data', 'bdata'):
+                if 'error' in line:
+                    raise AvrProgException("Flash read error: %s" % line)
+                continue
+            try:
+                addr = int(cmd[1], 16)
+                if cmd[0] == 'bdata':
+                    data = frameDecode(cmd[2])
+                else:
+                    data = bytearray(binascii.unhexlify(cmd[2]))
+            except (IndexError, ValueError, TypeError):
+                raise AvrProgException("Wrong data line: %s" % printable(line))
+            if data is None or (cmd[0] == 'data' and crc8(data, cmd[2])):
+                raise AvrProgException("CRC8 error")
+            if addr != addrFrom:
+                raise AvrProgException("Returned Wrong address")
+            if cmd[0] == 'data':
+                del data[-1:]
+            if self.progress:
+                self.progress.add(len(data))
+            yield addr, data
+            addrFrom += len(data)
+
+    def avrFuse(self, fuseId, val=None):
+        cmd = 'avr fuse %s' % fuseId
+        if val:
+            cmd += ' %02x' % val
+        return self.avrFuseAnswer(fuseId, self.cmdSend(cmd))
+
+    def avrFuseAnswer(self, fuseId, res):
+        for line in res or ():
+            cmd = line.split()
+            if cmd[0] == 'fuse' and cmd[1] == fuseId:
+                return int(cmd[2], 16)
+        raise AvrProgException("Error reading fuse %s" % fuseId)
+
+    def readFuses(self, fuseIds):
+        """read fuses in one pipeline, answer for all fuses fit in to device
+        buffers, so all commands are sent at once, return {fuseId: value}"""
+        for fuseId in fuseIds:
+            if fuseId not in self.fuses:
+                raise AvrProgException("Wrong fuse: %s" % fuseId)
+        values = {}
+        for fuseId, res in self.cmdPipeline(fuseIds, lambda fuseId: 'avr fuse %s' % fuseId, len(fuseIds)):
+            values[fuseId] = self.avrFuseAnswer(fuseId, res)
+        return values
+
+    def printFuses(self, fuseIds=None):
+        if fuseIds is None:
+            fuseIds = self.fuses
+        values = self.readFuses(fuseIds)
+        for fuseId in fuseIds:
+            print "%5s: 0x%02x" % (fuseId, values[fuseId])
+
+    def fuse(self, params):
+        if not params:
+            # read and print all cnown fuses
+            self.printFuses()
+            return
+        # first param is fuseId
+        fuseId = params[0]
+        # test if fuseId is correct
+        if fuseId not in self.fuses:
+            raise AvrProgException("Wrong fuse: %s" % fuseId)
+        if len(params) > 1:
+            # second param can by hex number for set fuse
+            val = int(params[1], 16)
+            # we can write only these fuses..
+            if fuseId not in ('low', 'high', 'extend', 'lock'):
+                raise AvrProgException("Can not write fuse '%s'" % fuseId)
+            dbg.msg("writing %s: 0x%02x" % (fuseId, val))
+            # store fuse and test if fuse is stored correctly
+            if val != self.avrFuse(fuseId, val):
+                raise AvrProgException("Error setting fuse '%s' to %02x" % (fuseId, val))
+        else:
+            # print the fuse
+            print '%5s: 0x%02x' % (fuseId, self.avrFuse(fuseId))
+
+    def printLinkStats(self):
+        if not self.term:
+            raise NotConnectedException()
+        link = getattr(self.term, 'link', None)
+        print "link: %s" % (link if link is not None else "not measured by terminal")
+
+    def printCpuList(self):
+        from avrproglib.cpus import cpuDb
+        print "{:^12} {:^12} {:^12}".format('cpu', 'flash', 'eeprom')
+        for attr in cpuDb:
+            print "{:<12} {:>12} {:>12}".format(
+                attr['id'],
+                byteSize(2 * attr['flashPageWords'] * attr['flashPagesCount']),
+                byteSize(attr['eepromSize'])
+            )
+
+    # coroutine variants for TerminalLoop, they share answer parsing
+    # with blocking methods above
+
+    def connectAsync(self, port):
+        dbg.msg("openning port: %s" % port)
+        self.term = self.asyncTerminalClass(port)
+        yield self.helloAsync()
+
+    def cmdSendAsync(self, cmd, expectedLines=list(), retry=2):
+        yield CmdFlush()
+        yield CmdWrite(cmd)
+        res = None
+        for i in xrange(retry):
+            try:
+                res = yield CmdReceive()
+                break
+            except NotRespondingException:
+                if not expectedLines:
+                    dbg.warning('retrying', loglevel=2)
+            except NotReadyException:
+                if not expectedLines:
+                    raise
+        else:
+            if not expectedLines:
+                raise NotRespondingException()
+        yield Return(self.checkAnswer(cmd, res, expectedLines))
+
+    def helloAsync(self):
+        res = yield self.cmdSendAsync('hello')
+        self.helloAnswer(res)
+
+    def rebootAsync(self):
+        if self.isKnownDevice():
+            dbg.msg("rebooting")
+            yield CmdFlush()
+            yield CmdWrite('reboot')
+            try:
+                yield CmdReceive()
+            except (NotRespondingException, NotReadyException):
+                pass
+        self.deviceName = ''
+
+    def setCpuAsync(self, cpu):
+        dbg.msg("detecting CPU")
+        if not self.isProgrammer():
+            yield self.rebootAsync()
+            yield self.helloAsync()
+            if not self.isProgrammer():
+                raise NotInProgrammerException()
+        res = yield self.cmdSendAsync('avr connect', ['avr connected'])
+        self.setCpuAnswer(res, cpu)
+
+    def cmdPipelineAsync(self, items, command, onAnswer):
+        """coroutine variant of cmdPipeline, answers are passed to
+        onAnswer(item, answer), sending stops when it returns False"""
+        items = iter(items)
+        pending = collections.deque()
+        itemsEnd = False
+        yield CmdFlush()
+        while True:
+            if not itemsEnd and len(pending) < max(self.flashWindow, 1):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    itemsEnd = True
+                    continue
+                yield CmdWrite(command(item))
+                pending.append(item)
+                continue
+            if not pending:
+                return
+            item = pending.popleft()
+            try:
+                res = yield CmdReceive()
+            except NotReadyException, e:
+                res = e.lines
+            except NotRespondingException:
+                res = None
+            if not onAnswer(item, res):
+                itemsEnd = True
+            if res is None:
+                # device is lost, no more answers will come
+                return
+
+    def flashAsync(self, params=()):
+        """coroutine variant of flash, options diff and resume are not
+        supported, they need blocking reads of device and journal"""
+        for param in params:
+            if param in ('diff', 'resume'):
+                raise AvrProgException("Flash option %s is not supported in asynchronous flash." % param)
+        blocks = self.flashPrepare(params, allowedParams=())
+        failedPages = []
+
+        def written(block, res):
+            if not self.flashBlockWritten(res):
+                failedPages.append((block['addr'], res))
+            return not failedPages
+
+        yield self.cmdPipelineAsync(blocks, self.flashBlockCommand, written)
+        if failedPages:
+            raise FlashWriteException(failedPages)
+
+    def flashVerifyAsync(self, params=()):
+        for start, data in self.flashVerifyPrepare(params):
+            res = yield self.cmdSendAsync(self.flashReadCommand(start, start + len(data) - 1))
+            self.flashVerifyAnswer(start, data, res)
+
+    def flashDownloadAsync(self, addresses=list()):
+        addrFrom, addrTo = self.flashDownloadPrepare(addresses)
+        res = yield self.cmdSendAsync(self.flashReadCommand(addrFrom, addrTo))
+        self.dataBuffer = MemoryImage(self.flashReadAnswer(res, addrFrom), addrFrom)
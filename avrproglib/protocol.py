@@ -0,0 +1,113 @@
+"""encoding of data exchanged with avrprog and avrboot devices"""
+
+import collections
+import binascii
+import struct
+import re
+
+
+def xorFold(value, size):
+    """xor of all bytes of big endian integer of size bytes
+
+    integer is folded in halves, so only log2(size) big integer
+    operations are needed instead of one operation per byte"""
+    while size > 1:
+        size = (size + 1) / 2
+        value = (value >> (8 * size)) ^ (value & ((1 << (8 * size)) - 1))
+    return value
+
+
+def crc8(data, hexData=None):
+    """xor of all bytes, hexData is hexlified data when already known"""
+    if hexData is None:
+        hexData = binascii.hexlify(data)
+    if not hexData:
+        return 0
+    return xorFold(int(hexData, 16), len(hexData) / 2)
+
+
+# binary frame: <length 16bit><data><crc8>, bytes which would break line or
+# word in device parsers are sent as FRAME_ESC, byte ^ 0x40
+FRAME_ESC = '\x1b'
+FRAME_ESCAPE_RE = re.compile(r'[\x00\t\n\x0b\x0c\r\x1b ]')
+FRAME_UNESCAPE_RE = re.compile(r'\x1b(.)', re.DOTALL)
+
+
+def frameEncode(data):
+    data = memoryview(data).tobytes()
+    frame = struct.pack('>H', len(data)) + data + chr(crc8(data))
+    return FRAME_ESCAPE_RE.sub(lambda match: FRAME_ESC + chr(ord(match.group()) ^ 0x40), frame)
+
+
+def frameDecode(word):
+    """decode binary frame, return data or None if frame is broken"""
+    frame = FRAME_UNESCAPE_RE.sub(lambda match: chr(ord(match.group(1)) ^ 0x40), word)
+    if len(frame) < 3 or struct.unpack('>H', frame[:2])[0] != len(frame) - 3 or crc8(frame[2:]):
+        return None
+    return bytearray(frame[2:-1])
+
+
+SPARSE_RUN_RE = re.compile(r'\xff{3,}')
+
+
+def sparseEncode(data):
+    """encode page data as segments <skip 8bit><count 8bit><count bytes of data>
+
+    skip is count of 0xff bytes before data, only runs of at least three
+    0xff are skipped (segment header has two bytes), trailing 0xff are
+    not sent at all, device fills rest of page with 0xff"""
+    data = memoryview(data).tobytes().rstrip('\xff')
+    segments = []
+    pos = skip = 0
+    for match in SPARSE_RUN_RE.finditer(data):
+        if match.start() > pos:
+            segments.append((skip, data[pos:match.start()]))
+            skip = 0
+        skip += match.end() - match.start()
+        pos = match.end()
+    if pos < len(data):
+        segments.append((skip, data[pos:]))
+    encoded = []
+    for skip, chunk in segments:
+        while skip > 0xff:
+            encoded.append('\xff\x00')
+            skip -= 0xff
+        while len(chunk) > 0xff:
+            encoded.append(chr(skip) + '\xff' + chunk[:0xff])
+            skip = 0
+            chunk = chunk[0xff:]
+        encoded.append(chr(skip) + chr(len(chunk)) + chunk)
+    return ''.join(encoded)
+
+
+def sparseDecode(data):
+    data = bytearray(data)
+    decoded = bytearray()
+    pos = 0
+    while pos + 1 < len(data):
+        skip, count = data[pos], data[pos + 1]
+        decoded += '\xff' * skip + data[pos + 2:pos + 2 + count]
+        pos += 2 + count
+    return decoded
+
+
+def printable(line):
+    """line with escaped non printable characters, for log of binary frames"""
+    return line.encode('string_escape')
+
+
+class LineFramer(object):
+    """split received data to lines, lines are stripped and empty lines dropped"""
+
+    def __init__(self):
+        self.lines = collections.deque()
+        self.rest = ''
+
+    def feed(self, data):
+        lines = (self.rest + data).split('\n')
+        self.rest = lines.pop()
+        self.lines.extend(line for line in (line.strip() for line in lines) if line)
+
+    def clear(self):
+        self.lines.clear()
+        self.rest = ''
@@ -0,0 +1,278 @@
+"""scheduler of programming jobs on many stations (ports)
+
+each port has own worker thread, which takes next job allowed on the port,
+failed jobs are retried by policy of failure"""
+
+import json
+import time
+import threading
+
+from avrproglib.cli import expandPorts, reportedErrors, runCommands
+from avrproglib.cpus import FUSES
+from avrproglib.dbg import dbg
+from avrproglib.exceptions import (
+    AvrProgException,
+    FlashWriteException,
+    NotRespondingException,
+    SchedulerException,
+    VerifyException,
+)
+from avrproglib.programmer import AvrProg
+
+
+class RetryPolicy(object):
+    """count of retries and delay before each retry, delay grows by
+    factor up to maxDelay"""
+
+    def __init__(self, retries=0, delay=0, factor=2, maxDelay=30, linkError=False):
+        self.retries = retries
+        self.delay = delay
+        self.factor = factor
+        self.maxDelay = maxDelay
+        # failure of port, not of device or image
+        self.linkError = linkError
+
+    def retryDelay(self, retry):
+        return min(self.delay * self.factor ** retry, self.maxDelay)
+
+NO_RETRY = RetryPolicy()
+
+# first matching class is used
+DEFAULT_POLICIES = (
+    (NotRespondingException, RetryPolicy(retries=3, delay=1, linkError=True)),
+    (IOError, RetryPolicy(retries=3, delay=2, linkError=True)),
+    (FlashWriteException, RetryPolicy(retries=2, delay=0.5)),
+    (VerifyException, RetryPolicy(retries=1)),
+)
+
+
+class Job(object):
+    """image with fuses for expected cpu, programmed on one of ports"""
+
+    def __init__(self, name, image=None, fuses=None, cpu=None, ports=None, commands=()):
+        self.name = name
+        self.image = image
+        self.fuses = fuses or {}
+        self.cpu = cpu
+        # None is any port of scheduler
+        self.ports = ports
+        self.extraCommands = list(commands)
+        self.attempts = []
+        self.error = None
+        self.done = False
+        self.notBefore = 0
+        self.timeQueued = None
+        self.timeStart = None
+        self.timeEnd = None
+
+    @classmethod
+    def fromDict(cls, attr):
+        fuses = dict((fuseId, int(str(value), 16)) for fuseId, value in attr.get('fuses', {}).items())
+        return cls(
+            str(attr['name']),
+            image=attr.get('image') and str(attr['image']),
+            fuses=fuses,
+            cpu=attr.get('cpu') and str(attr['cpu']),
+            ports=attr.get('ports') and expandPorts([str(port) for port in attr['ports']]),
+            commands=[str(command) for command in attr.get('commands', [])],
+        )
+
+    def accepts(self, port):
+        return self.ports is None or port in self.ports
+
+    def commands(self):
+        commands = []
+        if self.image:
+            commands += ['clear', 'load:' + self.image]
+        commands.append('cpu:' + self.cpu if self.cpu else 'cpu')
+        if self.image:
+            commands += ['erase', 'flash', 'verify']
+        # lock is written after all other fuses
+        for fuseId in FUSES:
+            if fuseId in self.fuses:
+                commands.append('fuse:%s:%02x' % (fuseId, self.fuses[fuseId]))
+        return commands + self.extraCommands
+
+    @property
+    def time(self):
+        """time from first start to end"""
+        if self.timeStart is None or self.timeEnd is None:
+            return 0
+        return self.timeEnd - self.timeStart
+
+
+class Scheduler(object):
+    def __init__(self, ports, avrProgClass=AvrProg, policies=DEFAULT_POLICIES, maxPortFailures=3, flashWindow=1):
+        self.ports = expandPorts(ports)
+        self.avrProgClass = avrProgClass
+        self.policies = policies
+        # port is disabled after this count of link errors in row
+        self.maxPortFailures = maxPortFailures
+        self.flashWindow = flashWindow
+        self.jobs = []
+        self.queue = []
+        self.running = 0
+        self.activePorts = set()
+        self.portJobs = {}
+        self.time = 0
+        self.condition = threading.Condition()
+
+    def add(self, job):
+        with self.condition:
+            job.timeQueued = time.time()
+            self.jobs.append(job)
+            self.queue.append(job)
+            self.condition.notify_all()
+        return job
+
+    def loadJobs(self, fileName):
+        """job file is json list of jobs:
+        {"name": .., "image": .., "cpu": .., "fuses": {"low": "e1"}, "ports": [..]}"""
+        with open(fileName) as f:
+            for attr in json.load(f):
+                self.add(Job.fromDict(attr))
+
+    def policy(self, error):
+        for exceptionClass, policy in self.policies:
+            if isinstance(error, exceptionClass):
+                return policy
+        return NO_RETRY
+
+    def nextJob(self, port):
+        """wait for job allowed on port, return None if there will be none"""
+        with self.condition:
+            while port in self.activePorts:
+                now = time.time()
+                jobs = [job for job in self.queue if job.accepts(port)]
+                for job in jobs:
+                    if job.notBefore <= now:
+                        self.queue.remove(job)
+                        self.running += 1
+                        return job
+                if not jobs and not self.running:
+                    # no job for port and no running job can be retried
+                    return None
+                timeout = min(job.notBefore for job in jobs) - now if jobs else None
+                self.condition.wait(timeout)
+            return None
+
+    def finishJob(self, job, port, error, timeStart):
+        now = time.time()
+        with self.condition:
+            self.running -= 1
+            job.attempts.append({'port': port, 'time': now - timeStart, 'error': str(error) if error else None})
+            job.timeEnd = now
+            if error is None:
+                job.done = True
+                self.portJobs[port]['failures'] = 0
+            else:
+                policy = self.policy(error)
+                if policy.linkError:
+                    self.portJobs[port]['failures'] += 1
+                    if self.portJobs[port]['failures'] >= self.maxPortFailures:
+                        self.disablePort(port)
+                retries = len(job.attempts) - 1
+                if retries < policy.retries:
+                    job.notBefore = now + policy.retryDelay(retries)
+                    self.queue.append(job)
+                else:
+                    job.error = str(error)
+            self.failOrphans()
+            self.condition.notify_all()
+
+    def disablePort(self, port):
+        dbg.warning("port %s disabled after %d errors" % (port, self.maxPortFailures))
+        self.activePorts.discard(port)
+
+    def failOrphans(self):
+        """fail queued jobs, which have no active port"""
+        for job in list(self.queue):
+            if not [port for port in self.activePorts if job.accepts(port)]:
+                self.queue.remove(job)
+                job.error = job.attempts[-1]['error'] if job.attempts else "No active port for job."
+
+    def runJob(self, avrProg, job, port):
+        if avrProg.term is None:
+            avrProg.connect(port)
+        dbg.msg("job %s" % job.name)
+        runCommands(avrProg, job.commands())
+        if avrProg.isProgrammer() and avrProg.deviceCpu:
+            avrProg.avrDisable()
+
+    def worker(self, port):
+        dbg.prefix = '%s: ' % port
+        avrProg = None
+        while True:
+            job = self.nextJob(port)
+            if job is None:
+                return
+            if avrProg is None:
+                avrProg = self.avrProgClass()
+                avrProg.flashWindow = self.flashWindow
+            timeStart = time.time()
+            if job.timeStart is None:
+                job.timeStart = timeStart
+            # interrupted job is still finished, so other workers do not
+            # wait for it
+            error = AvrProgException("Job interrupted.")
+            try:
+                self.runJob(avrProg, job, port)
+                error = None
+                self.portJobs[port]['jobs'] += 1
+            except reportedErrors() as e:
+                error = e
+                dbg.error(e)
+            except Exception as e:
+                # unexpected error fails the job without retry, state of
+                # device is not known, so next job connects again
+                error = AvrProgException("%s: %s" % (e.__class__.__name__, e))
+                dbg.error(error)
+                avrProg = None
+            finally:
+                if error is not None and self.policy(error).linkError:
+                    # connect again for next job
+                    avrProg = None
+                self.portJobs[port]['time'] += time.time() - timeStart
+                self.finishJob(job, port, error, timeStart)
+
+    def run(self):
+        if not self.ports:
+            raise AvrProgException("No port found for scheduler.")
+        with self.condition:
+            self.activePorts = set(self.ports)
+            self.portJobs = dict((port, {'jobs': 0, 'time': 0, 'failures': 0}) for port in self.ports)
+            self.failOrphans()
+        timeStart = time.time()
+        threads = []
+        for port in self.ports:
+            thread = threading.Thread(target=self.worker, args=(port, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # join with timeout, so KeyboardInterrupt is not blocked
+            while thread.is_alive():
+                thread.join(0.1)
+        self.time = time.time() - timeStart
+        if [job for job in self.jobs if job.error]:
+            raise SchedulerException(self.jobs)
+
+    def printSummary(self):
+        print "{:<16} {:<24} {:>8} {:>8} {}".format('job', 'port', 'attempts', 'time', 'result')
+        for job in self.jobs:
+            print "{:<16} {:<24} {:>8} {:>7.1f}s {}".format(
+                job.name,
+                job.attempts[-1]['port'] if job.attempts else '-',
+                len(job.attempts),
+                job.time,
+                'ok' if job.done else 'error'
+            )
+        print "{:<24} {:>8} {:>8} {:>11}".format('port', 'jobs', 'busy', 'utilization')
+        for port in self.ports:
+            stats = self.portJobs.get(port, {'jobs': 0, 'time': 0})
+            print "{:<24} {:>8} {:>7.1f}s {:>10.0f}%".format(
+                port,
+                stats['jobs'],
+                stats['time'],
+                100 * stats['time'] / self.time if self.time else 0
+            )
@@ -0,0 +1,524 @@
+"""serial terminal and coroutine loop for programming many devices at once
+
+pyserial is imported when first port is opened"""
+
+import collections
+import threading
+import time
+import select
+import os
+
+from avrproglib.dbg import dbg
+from avrproglib.exceptions import AvrProgException, NotConnectedException, NotReadyException, NotRespondingException
+from avrproglib.protocol import LineFramer, printable
+
+# errors which fail only task of their device (serial.SerialException is
+# subclass of IOError)
+TASK_ERRORS = (AvrProgException, IOError)
+
+
+class LinkStats(object):
+    """measured round trip and per byte times of serial link
+
+    round trip is time from command written to first line of its answer,
+    it is smoothed like tcp retransmission timer (rfc 6298), answer
+    timeout is smoothed round trip with four deviations. Before first
+    measurement default timeout is used, it is also minimal timeout of
+    slow commands, which make device work before it answers (reading
+    flash, erase, reboot)."""
+
+    # timeout is kept between these limits, device needs some time to
+    # process even the shortest command
+    MIN_TIMEOUT = 0.3
+    MAX_TIMEOUT = 5.0
+    # timeout grows by this factor with each retry
+    BACKOFF = 2
+    # answers shorter than this are too noisy for per byte time
+    MIN_TRANSFER_BYTES = 64
+    # expected length of data line for deadline of long answers
+    LINE_BYTES = 80
+
+    def __init__(self, timeout=1):
+        self.defaultTimeout = timeout
+        self.rtt = None
+        self.rttVar = None
+        self.byteTime = None
+        self.commands = 0
+        self.timeouts = 0
+        self.retries = 0
+
+    def addRtt(self, rtt):
+        self.commands += 1
+        if self.rtt is None:
+            self.rtt = rtt
+            self.rttVar = rtt / 2
+        else:
+            self.rttVar += (abs(self.rtt - rtt) - self.rttVar) / 4
+            self.rtt += (rtt - self.rtt) / 8
+
+    def addTransfer(self, size, time):
+        if size < self.MIN_TRANSFER_BYTES:
+            return
+        byteTime = time / size
+        if self.byteTime is None:
+            self.byteTime = byteTime
+        else:
+            self.byteTime += (byteTime - self.byteTime) / 8
+
+    def timeout(self, retry=0, slow=False):
+        """time to wait for first line of answer and between lines"""
+        if self.rtt is None:
+            timeout = self.defaultTimeout
+        else:
+            timeout = max(self.rtt + 4 * self.rttVar, self.MIN_TIMEOUT)
+            if slow:
+                timeout = max(timeout, self.defaultTimeout)
+        return min(timeout * self.BACKOFF ** retry, max(self.MAX_TIMEOUT, timeout))
+
+    def answerTime(self, expectedLinesCount):
+        """time to receive expected lines of long answer"""
+        if not expectedLinesCount or self.byteTime is None:
+            return 0
+        # two times of measured transfer rate, link may slow down
+        return 2 * expectedLinesCount * self.LINE_BYTES * self.byteTime
+
+    def __str__(self):
+        if self.rtt is None:
+            return "link not measured, timeout %.2fs, %d timeouts, %d retries" % (
+                self.timeout(), self.timeouts, self.retries)
+        return "rtt %.1fms +-%.1fms, %s, timeout %.2fs, %d commands, %d timeouts, %d retries" % (
+            1000 * self.rtt,
+            1000 * self.rttVar,
+            "%.1fus/B" % (1e6 * self.byteTime) if self.byteTime is not None else "transfer not measured",
+            self.timeout(),
+            self.commands,
+            self.timeouts,
+            self.retries,
+        )
+
+
+class SerialTerminal(object):
+    # None is serial.Serial
+    serialClass = None
+    # port is polled in this interval while waiting for answer deadline
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, port, timeout=1):
+        import serial
+        self.ser = None
+        self.framer = LineFramer()
+        self.link = LinkStats(timeout)
+        # (write time, slow) of commands without received answer, answers
+        # of pipelined commands come in same order, write time is None for
+        # command written while other commands were waiting for answer
+        self.writeTimes = collections.deque()
+        self.ser = (self.serialClass or serial.Serial)(port, timeout=self.POLL_INTERVAL)
+
+    def __del__(self):
+        if self.ser and self.ser.isOpen():
+            self.ser.close()
+
+    def cmdReceive(self, expectedLinesCount=None, retry=0, slow=False):
+        lines = []
+        try:
+            for line in self.cmdReceiveLines(expectedLinesCount=expectedLinesCount, retry=retry, slow=slow):
+                lines.append(line)
+        except NotRespondingException:
+            if lines:
+                raise NotReadyException(lines)
+            raise
+        return lines
+
+    def readLine(self, deadline):
+        """return next received line or None after deadline
+
+        port is read in blocks of all waiting bytes, pyserial readline
+        would do one read for each byte"""
+        while not self.framer.lines:
+            data = self.ser.read(self.ser.inWaiting() or 1)
+            if not data:
+                if time.time() >= deadline:
+                    return None
+                continue
+            self.framer.feed(data)
+        return self.framer.lines.popleft()
+
+    def cmdReceiveLines(self, expectedLinesCount=None, retry=0, slow=False):
+        """yield lines of answer as they are received, until 'ready'
+
+        answer has to start in timeout and continue with at most timeout
+        between lines, long answer has at least time to transfer expected
+        lines"""
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        logLines = dbg.isLogged()
+        # answer of pipelined command can start only after previous answer
+        timeStart = time.time()
+        timeWrite, slowWrite = self.writeTimes.popleft() if self.writeTimes else (None, False)
+        timeout = self.link.timeout(retry)
+        answerDeadline = timeStart + timeout + self.link.answerTime(expectedLinesCount)
+        deadline = timeStart + self.link.timeout(retry, slow or slowWrite)
+        timeFirst = None
+        size = 0
+        while True:
+            line = self.readLine(max(deadline, answerDeadline))
+            now = time.time()
+            if line is None:
+                self.link.timeouts += 1
+                # answer is late, round trip of command can not be measured
+                self.writeTimes.clear()
+                raise NotRespondingException()
+            deadline = now + timeout
+            if timeFirst is None:
+                timeFirst = now
+                if timeWrite is not None and not retry:
+                    self.link.addRtt(now - timeWrite)
+            else:
+                size += len(line) + 2
+            if logLines:
+                dbg.log("<< " + printable(line), color='blue')
+            if line == 'ready':
+                self.link.addTransfer(size, now - timeFirst)
+                return
+            yield line
+
+    def cmdAbort(self):
+        """stop long answer of actual command and wait for 'ready'
+
+        any received character stops flash read, devices which can not
+        abort send the rest of answer, which is thrown away"""
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        dbg.log(">> (abort)", color='cyan')
+        self.ser.write('\r\n')
+        self.ser.flush()
+        self.writeTimes.clear()
+        try:
+            for line in self.cmdReceiveLines(retry=1):
+                pass
+        except NotRespondingException:
+            self.flushInput()
+
+    def flushInput(self):
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        self.ser.flushInput()
+        self.framer.clear()
+        self.writeTimes.clear()
+
+    def cmdWrite(self, cmd, slow=False):
+        """send command, answer of slow command is waited for at least
+        default timeout"""
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        if dbg.isLogged():
+            dbg.log(">> " + printable(cmd), color='cyan')
+        self.ser.write(cmd)
+        self.ser.write('\r\n\r\r')
+        self.ser.flush()
+        # round trip of pipelined command includes waiting for others
+        self.writeTimes.append((None if self.writeTimes else time.time(), slow))
+
+    def cmdSend(self, cmd, result=True, disableResultError=False, retry=2, expectedLinesCount=None, slow=False):
+        """send command and return its answer, if device does not answer
+        in timeout, it is woken by new line and waited for again with
+        longer timeout"""
+        self.flushInput()
+        self.cmdWrite(cmd, slow)
+        if not result:
+            return []
+        for attempt in xrange(retry):
+            try:
+                return self.cmdReceive(expectedLinesCount=expectedLinesCount, retry=attempt, slow=slow)
+            except NotRespondingException, e:
+                self.ser.write('\r\n')
+                self.ser.flush()
+                self.link.retries += 1
+                if not disableResultError:
+                    dbg.warning('retrying', loglevel=2)
+            except NotReadyException, e:
+                if not disableResultError:
+                    raise e
+        if disableResultError:
+            return None
+        raise NotRespondingException()
+
+
+class AsyncSerialTerminal(object):
+    """non blocking terminal for TerminalLoop
+
+    readAvailable() collects received lines, answers finished by 'ready'
+    are queued in answers, unfinished answer is kept in lines."""
+
+    def __init__(self, port, timeout=1):
+        import serial
+        self.ser = None
+        self.ser = serial.Serial(port, timeout=0)
+        self.timeout = timeout
+        self.answers = collections.deque()
+        self.lines = []
+        self.framer = LineFramer()
+
+    def __del__(self):
+        if self.ser and self.ser.isOpen():
+            self.ser.close()
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def readAvailable(self):
+        """read what is waiting in port, return True if anything was received"""
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        data = self.ser.read(self.ser.inWaiting() or 1)
+        if not data:
+            return False
+        self.framer.feed(data)
+        logLines = dbg.isLogged()
+        while self.framer.lines:
+            line = self.framer.lines.popleft()
+            if logLines:
+                dbg.log("<< " + printable(line), color='blue')
+            if line == 'ready':
+                self.answers.append(self.lines)
+                self.lines = []
+            else:
+                self.lines.append(line)
+        return True
+
+    def flushInput(self):
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        self.ser.flushInput()
+        self.answers.clear()
+        self.lines = []
+        self.framer.clear()
+
+    def cmdWrite(self, cmd, slow=False):
+        if not self.ser or not self.ser.isOpen():
+            raise NotConnectedException()
+        if dbg.isLogged():
+            dbg.log(">> " + printable(cmd), color='cyan')
+        self.ser.write(cmd + '\r\n\r\r')
+        self.ser.flush()
+
+    def cmdReceive(self, expectedLinesCount=None, retry=0, slow=False):
+        if not self.answers:
+            raise NotRespondingException()
+        return self.answers.popleft()
+
+
+class CmdFlush(object):
+    """coroutine operation: drop everything received so far"""
+
+
+class CmdWrite(object):
+    """coroutine operation: send command without waiting for answer"""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+
+class CmdReceive(object):
+    """coroutine operation: wait for next answer, result is list of lines"""
+
+
+class Return(object):
+    """coroutine operation: finish coroutine with value"""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class TerminalTask(object):
+    """one coroutine running in TerminalLoop against avrProg.term
+
+    coroutine is generator yielding Cmd* operations, other coroutines
+    (called as sub-coroutines) or Return."""
+
+    def __init__(self, avrProg, coroutine, name=''):
+        self.avrProg = avrProg
+        self.name = name
+        self.stack = [coroutine]
+        self.value = None
+        self.exception = None
+        self.deadline = None
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def fileno(self):
+        fileno = getattr(self.avrProg.term, 'fileno', None)
+        return fileno() if fileno else None
+
+    def operation(self, op):
+        """execute operation, return True if task has to wait for answer"""
+        term = self.avrProg.term
+        if not term:
+            raise NotConnectedException()
+        if isinstance(op, CmdFlush):
+            term.flushInput()
+        elif isinstance(op, CmdWrite):
+            term.cmdWrite(op.cmd)
+        elif isinstance(op, CmdReceive):
+            if not term.answers:
+                self.deadline = time.time() + getattr(term, 'timeout', 0)
+                return True
+            self.value = term.cmdReceive()
+        else:
+            raise TypeError("Unknown coroutine operation: %r" % op)
+        return False
+
+    def finish(self, value):
+        self.stack.pop()
+        self.value = value
+        if not self.stack:
+            self.done = True
+            self.result = value
+
+    def resume(self):
+        """run coroutine until it waits for answer or ends"""
+        prefix = dbg.prefix
+        dbg.prefix = self.name and '%s: ' % self.name
+        try:
+            while self.stack:
+                try:
+                    if self.exception:
+                        exception, self.exception = self.exception, None
+                        op = self.stack[-1].throw(exception)
+                    else:
+                        value, self.value = self.value, None
+                        op = self.stack[-1].send(value)
+                except StopIteration:
+                    self.finish(None)
+                    continue
+                except TASK_ERRORS, e:
+                    self.stack.pop()
+                    if self.stack:
+                        self.exception = e
+                    else:
+                        self.done = True
+                        self.error = e
+                    continue
+                if isinstance(op, Return):
+                    self.stack[-1].close()
+                    self.finish(op.value)
+                elif hasattr(op, 'send') and hasattr(op, 'throw'):
+                    self.stack.append(op)
+                else:
+                    try:
+                        if self.operation(op):
+                            return
+                    except TASK_ERRORS, e:
+                        self.exception = e
+        finally:
+            dbg.prefix = prefix
+
+    def poll(self):
+        """take answer received by terminal or throw timeout in to coroutine"""
+        term = self.avrProg.term
+        readAvailable = getattr(term, 'readAvailable', None)
+        try:
+            received = readAvailable and readAvailable()
+        except TASK_ERRORS, e:
+            # port is lost, error is thrown in to coroutine
+            self.exception = e
+            self.deadline = None
+            self.resume()
+            return
+        if received:
+            self.deadline = time.time() + term.timeout
+        if term.answers:
+            self.deadline = None
+            self.value = term.cmdReceive()
+            self.resume()
+        elif time.time() >= self.deadline:
+            lines = getattr(term, 'lines', None)
+            if lines:
+                term.lines = []
+                self.exception = NotReadyException(lines)
+            else:
+                self.exception = NotRespondingException()
+            self.deadline = None
+            self.resume()
+
+
+class TerminalLoop(object):
+    """run coroutines of many devices in one thread
+
+    while one device is waiting for answer, others are sending or
+    processing their data, all terminals are waited for by select."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, avrProg, coroutine, name=''):
+        task = TerminalTask(avrProg, coroutine, name)
+        self.tasks.append(task)
+        return task
+
+    def run(self):
+        for task in self.tasks:
+            if not task.done and task.deadline is None:
+                task.resume()
+        while True:
+            waiting = [task for task in self.tasks if not task.done]
+            if not waiting:
+                return
+            timeout = max(0, min(task.deadline for task in waiting) - time.time())
+            fds = [fd for fd in (task.fileno() for task in waiting) if fd is not None]
+            if fds:
+                select.select(fds, [], [], timeout)
+            elif timeout:
+                time.sleep(timeout)
+            for task in waiting:
+                task.poll()
+
+
+def benchmarkTerminal(kbytes=256):
+    """receive flash read answer from pseudo terminal, pyserial readline
+    against SerialTerminal, print count of port reads and CPU time per KB"""
+    import serial
+
+    class CountingSerial(serial.Serial):
+        reads = 0
+
+        def read(self, size=1):
+            CountingSerial.reads += 1
+            return serial.Serial.read(self, size)
+
+    class CountingTerminal(SerialTerminal):
+        serialClass = CountingSerial
+
+    line = 'data 000000 ' + '5a' * 32 + '00\n'
+    lines = kbytes * 1024 / len(line)
+    master, slave = os.openpty()
+
+    def device():
+        for i in xrange(0, lines, 100):
+            os.write(master, line * min(100, lines - i))
+        os.write(master, 'ready\n')
+
+    def readline(term):
+        while term.ser.readline().strip() != 'ready':
+            pass
+
+    def framer(term):
+        for line in term.cmdReceiveLines():
+            pass
+
+    print "{:<16} {:>10} {:>12} {:>12}".format('reader', 'reads', 'reads/KB', 'CPU ms/KB')
+    for name, receive in (('pyserial', readline), ('SerialTerminal', framer)):
+        term = CountingTerminal(os.ttyname(slave))
+        CountingSerial.reads = 0
+        thread = threading.Thread(target=device)
+        thread.start()
+        cpu = sum(os.times()[:2])
+        receive(term)
+        cpu = sum(os.times()[:2]) - cpu
+        thread.join()
+        term.ser.close()
+        kb = lines * len(line) / 1024.
+        print "{:<16} {:>10} {:>12.1f} {:>12.3f}".format(name, CountingSerial.reads, CountingSerial.reads / kb, 1000 * cpu / kb)
+    os.close(master)
+    os.close(slave)
@@ -0,0 +1,1389 @@
+"""unit tests, run by: avrprog.py test"""
+
+import unittest
+import collections
+import binascii
+import struct
+import threading
+import time
+import os
+import tempfile
+import StringIO
+import subprocess
+import sys
+
+from avrproglib.cli import Batch, Fleet, importCpus, runCommands
+from avrproglib.cpus import CpuDb, importAvrdudeConf
+from avrproglib.daemon import Daemon, sendJob
+from avrproglib.scheduler import Job, RetryPolicy, Scheduler
+from avrproglib.dbg import Dbg, Progress, dbg
+from avrproglib.exceptions import (
+    AvrProgException,
+    FlashWriteException,
+    FleetException,
+    NotReadableException,
+    NotReadyException,
+    NotRespondingException,
+    SchedulerException,
+    VerifyException,
+)
+from avrproglib.image import Crc16, IntelHex, IntelHexException, MemoryImage, Srec, SrecException, crc16_update
+from avrproglib.programmer import AvrProg
+from avrproglib.protocol import LineFramer, crc8, frameDecode, frameEncode, sparseDecode, sparseEncode
+from avrproglib.terminal import AsyncSerialTerminal, LinkStats, Return, SerialTerminal, TerminalLoop
+
+
+class TestDbg(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO.StringIO()
+        self.dbg = Dbg(verbose=3, useColors=False, progressInterval=10, stream=self.stream)
+
+    def testProgressRateLimited(self):
+        progress = self.dbg.progress('flash', 1000)
+        for i in xrange(10):
+            progress.add(100)
+        progress.end()
+        draws = self.stream.getvalue().split('\r')[1:]
+        self.assertEqual(len(draws), 2)
+        self.assertIn(' 10% ', draws[0])
+        self.assertTrue(draws[1].startswith('flash    [%s] 100%% ' % ('=' * 50)))
+        self.assertIn('B/s in ', draws[1])
+        self.assertTrue(draws[1].endswith('\n'))
+
+    def testProgressEta(self):
+        progress = Progress(self.dbg, 'verify', 1000, 10)
+        progress.timeStart -= 2
+        progress.done = 250
+        self.assertAlmostEqual(progress.rate(progress.timeStart + 2), 125)
+        self.assertAlmostEqual(progress.eta(progress.timeStart + 2), 6)
+        progress.done = 0
+        self.assertEqual(progress.eta(progress.timeStart + 2), None)
+
+    def testProgressDisabled(self):
+        self.dbg.progressInterval = None
+        self.assertEqual(self.dbg.progress('flash', 1000), None)
+        self.dbg.progressInterval = 0.1
+        self.dbg.verbose = 2
+        self.assertEqual(self.dbg.progress('flash', 1000), None)
+        self.assertFalse(self.dbg.isLogged())
+
+
+class TestMemoryImage(unittest.TestCase):
+
+    def setUp(self):
+        self.image = MemoryImage()
+
+    def testWriteSequential(self):
+        self.image.write(4, 'ab')
+        self.image.write(6, 'cd')
+        self.assertEqual(self.image.extents(), [(4, bytearray('abcd'))])
+        self.assertEqual(len(self.image), 4)
+        self.assertEqual(self.image.endAddr, 8)
+
+    def testWriteSparse(self):
+        self.image.write(0x1000, 'cd')
+        self.image.write(0x10, 'ab')
+        self.assertEqual(self.image.extents(), [(0x10, bytearray('ab')), (0x1000, bytearray('cd'))])
+
+    def testWriteMerge(self):
+        self.image.write(0, 'ab')
+        self.image.write(4, 'ef')
+        self.image.write(8, 'ij')
+        self.image.write(1, 'XYZW')
+        self.assertEqual(self.image.extents(), [(0, bytearray('aXYZWf')), (8, bytearray('ij'))])
+        self.image.write(6, 'gh')
+        self.assertEqual(self.image.extents(), [(0, bytearray('aXYZWfghij'))])
+        self.image.write(2, '12')
+        self.assertEqual(self.image.extents(), [(0, bytearray('aX12Wfghij'))])
+
+    def testWriteExported(self):
+        self.image.write(0, 'ab')
+        view = self.image.view(0, 2)
+        self.image.write(2, 'cd')
+        self.assertEqual(view.tobytes(), 'ab')
+        self.assertEqual(self.image.read(0, 4), bytearray('abcd'))
+
+    def testRead(self):
+        self.image.write(2, 'ab')
+        self.image.write(6, 'cd')
+        self.assertEqual(self.image.read(0, 10), bytearray('\xff\xffab\xff\xffcd\xff\xff'))
+        self.assertEqual(self.image.read(3, 4), bytearray('b\xff\xffc'))
+
+    def testPages(self):
+        self.image.write(2, 'ab')
+        self.image.write(6, 'cd')
+        self.image.write(0x100, 'ef')
+        self.assertEqual(
+            [(addr, data.tobytes()) for addr, data in self.image.pages(4)],
+            [(0, '\xff\xffab'), (4, '\xff\xffcd'), (0x100, 'ef')]
+        )
+
+    def testCrc16(self):
+        self.image.write(2, 'ab')
+        self.image.write(6, 'cd')
+        self.assertEqual(self.image.crc16(1, 8), Crc16().update(self.image.read(1, 8)).crc)
+
+
+class TestIntelHex(unittest.TestCase):
+
+    def setUp(self):
+        self.intelHex = IntelHex()
+
+    def testEncodeLinesWrongFile(self):
+        with self.assertRaises(IntelHexException) as context:
+            self.intelHex.encodeLines(['abc'])
+        self.assertEqual(context.exception.message, "This is not an intel hex file.")
+
+    def testEncodeWrongLength(self):
+        with self.assertRaises(IntelHexException) as context:
+            self.intelHex.encodeLines([':050000006162636400'])
+        self.assertEqual(context.exception.message, "Wrong intel hex line length.")
+
+    def testEncodeWrongChecksum(self):
+        with self.assertRaises(IntelHexException) as context:
+            self.intelHex.encodeLines([':03000000616263FF'])
+        self.assertEqual(context.exception.message, "Wrong intel hex checksum.")
+
+    def testEncodeUnknownRecord(self):
+        with self.assertRaises(IntelHexException) as context:
+            self.intelHex.encodeLines([':00000006FA'])
+        self.assertEqual(context.exception.message, "Unknown record: 06.")
+
+    def testEncodeNoDataSection(self):
+        with self.assertRaises(IntelHexException) as context:
+            self.intelHex.encodeLines([':00000001FF'])
+        self.assertEqual(context.exception.message, "No data section found in intel hex file.")
+
+    def testEncodeLoad(self):
+        self.intelHex.encodeLines([':03000000616263D7', ':00000001FF'])
+        self.assertEqual(self.intelHex.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testEncodeLoadNoZeroAddress(self):
+        self.intelHex.encodeLines([':03000400616263D3', ':00000001FF'])
+        self.assertEqual(self.intelHex.dataBuffer.extents(), [(4, bytearray('abc'))])
+
+    def testEncodeExtendedAddress(self):
+        self.intelHex.encodeLines([':020000021000EC', ':03000000616263D7', ':00000001FF'])
+        self.assertEqual(self.intelHex.dataBuffer.extents(), [(0x10000, bytearray('abc'))])
+        self.intelHex = IntelHex()
+        self.intelHex.encodeLines([':020000040001F9', ':03000000616263D7', ':00000001FF'])
+        self.assertEqual(self.intelHex.dataBuffer.extents(), [(0x10000, bytearray('abc'))])
+
+    def testEncodeStartAddress(self):
+        self.intelHex.encodeLines([':03000000616263D7', ':0400000500001234B1', ':00000001FF'])
+        self.assertEqual(self.intelHex.entryAddr, 0x1234)
+
+    def testEncodeEndOfFile(self):
+        self.intelHex.encodeLines([':03000000616263D7', ':00000001FF', ':03000300646566CB'])
+        self.assertEqual(self.intelHex.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testDecodeLines(self):
+        self.intelHex = IntelHex(MemoryImage('abc'))
+        self.assertEqual(list(self.intelHex.decodeLines()), [':03000000616263D7', ':00000001FF'])
+
+    def testDecodeEncodeLarge(self):
+        dataBuffer = MemoryImage(bytearray(xrange(256)) * 300)
+        dataBuffer.write(0x20000, 'abc')
+        lines = list(IntelHex(dataBuffer).decodeLines())
+        self.assertIn(':020000040001F9', lines)
+        self.intelHex.encodeLines(lines)
+        self.assertEqual(self.intelHex.dataBuffer.extents(), dataBuffer.extents())
+
+
+class TestSrec(unittest.TestCase):
+
+    def setUp(self):
+        self.srec = Srec()
+
+    def testEncodeSrecLinesWrongFileFile(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['abc'])
+        self.assertEqual(context.exception.message, "This is not an motorola srec file.")
+
+    def testEncodeSrecLongLine(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S0050000616263D3'])
+        self.assertEqual(context.exception.message, "Wrong srec line length.")
+
+    def testEncodeSrecShortLine(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S0070000616263D3'])
+        self.assertEqual(context.exception.message, "Wrong srec line length.")
+
+    def testEncodeSrecLinesNoDataSectionInSrecFile(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S0060000616263D3'])
+        self.assertEqual(context.exception.message, "No data section found in srec file.")
+
+    def testEncodeSrecWrongChecksum(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S006000061626300'])
+        self.assertEqual(context.exception.message, "Wrong srec checksum.")
+
+    def testEncodeSrecUnknownRecord(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S4060000616263D3'])
+        self.assertEqual(context.exception.message, "Unknown record: 4.")
+
+    def testEncodeSrecLoad16BitAddress(self):
+        self.srec.encodeLines(['S1060000616263D3'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testEncodeSrecLoad24BitAddress(self):
+        self.srec.encodeLines(['S207000000616263D2'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testEncodeSrecLoad32BitAddress(self):
+        self.srec.encodeLines(['S30800000000616263D1'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testEncodeSrecLoadNoZeroAddress(self):
+        self.srec.encodeLines(['S1060004616263CF'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(4, bytearray('abc'))])
+
+    def testEncodeSrecLoadAppendToBuffer(self):
+        self.srec = Srec(MemoryImage('\x01\x02\x03'))
+        self.srec.encodeLines(['S1060004616263CF'])
+        self.assertEqual(self.srec.dataBuffer.read(0, 7), bytearray('\x01\x02\x03\xffabc'))
+
+    def testEncodeSrecSkipEmptyLines(self):
+        self.srec.encodeLines(['\r\n', 'S1060000616263D3\r\n', '\n'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+    def testEncodeSrecWrongData(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S1060000616263DX'])
+        self.assertEqual(context.exception.message, "Wrong srec data.")
+
+    def testEncodeSrecRecordsCount(self):
+        self.srec.encodeLines(['S1060000616263D3', 'S1060003646566C7', 'S5030002FA'])
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abcdef'))])
+
+    def testEncodeSrecWrongRecordsCount(self):
+        with self.assertRaises(SrecException) as context:
+            self.srec.encodeLines(['S1060000616263D3', 'S5030002FA'])
+        self.assertEqual(context.exception.message, "Wrong srec records count, expected 2, found 1.")
+
+    def testEncodeSrecEndRecord(self):
+        self.srec.encodeLines(['S1060000616263D3', 'S9030010EC', 'S1060003646566C7'])
+        self.assertEqual(self.srec.entryAddr, 0x0010)
+        self.assertEqual(self.srec.dataBuffer.extents(), [(0, bytearray('abc'))])
+
+
+class TestCrc16(unittest.TestCase):
+
+    def crc16Reference(self, data, crc=0):
+        for byte in bytearray(data):
+            crc = crc16_update(crc, byte)
+        return crc
+
+    def testCheckValue(self):
+        # CRC-16/ARC check value
+        self.assertEqual(Crc16().update('123456789').crc, 0xbb3d)
+
+    def testUpdateSameAsReference(self):
+        data = bytearray(xrange(256)) * 3 + bytearray('\x00\xff\x55\xaa')
+        self.assertEqual(Crc16().update(data).crc, self.crc16Reference(data))
+
+    def testUpdateIncremental(self):
+        data = bytearray(xrange(200))
+        self.assertEqual(Crc16().update(data[:77]).update(memoryview(data)[77:]).crc, Crc16().update(data).crc)
+
+    def testUpdateFill(self):
+        for count in (0, 1, 2, 3, 7, 64, 1000, 4093):
+            for byte in (0xff, 0x00, 0x5a):
+                self.assertEqual(
+                    Crc16(0x1234).updateFill(count, byte).crc,
+                    self.crc16Reference(chr(byte) * count, 0x1234)
+                )
+
+    def testUpdateFillReference(self):
+        data = 'abc' + '\xff' * 300
+        self.assertEqual(Crc16().update('abc').updateFill(300).crc, self.crc16Reference(data))
+
+    def testSignedBufferPassBootloaderCheck(self):
+        # same check as checkCrc() in avrboot.c
+        avrProg = AvrProg()
+        avrProg.deviceName = 'avrboot'
+        avrProg.flashSize = 0x1800
+        avrProg.dataBuffer = MemoryImage(bytearray(xrange(256)) * 5)
+        avrProg.dataBuffer.write(0x1000, 'abc')
+        avrProg.signBuffer()
+        bootAddress = avrProg.flashSize
+        size, crc16 = struct.unpack('<HH', str(avrProg.dataBuffer.read(bootAddress - 4, 4)))
+        self.assertEqual(avrProg.dataBuffer.endAddr, bootAddress)
+        self.assertEqual(size, 0x1003)
+        self.assertEqual(crc16, self.crc16Reference(avrProg.dataBuffer.read(0, size)))
+
+
+class FakeTerminal(object):
+    """in-process stand-in for SerialTerminal answering like avrprog or avrboot device"""
+
+    def __init__(self, port=None, flashSize=0x2000, failAddresses=(), flashCrc=True, binary=0):
+        self.port = port
+        self.flashCrc = flashCrc
+        self.binary = binary
+        self.flashMemory = bytearray('\xff') * flashSize
+        self.failAddresses = failAddresses
+        self.commands = []
+        self.answers = collections.deque()
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.receivedLines = 0
+        self.aborted = 0
+        self.fuses = {'low': 0xe1, 'high': 0xd9, 'lock': 0xff, 'calib': 0xa5}
+        # count of next answers received only after first timeout
+        self.lateAnswers = 0
+
+    def flushInput(self):
+        self.answers.clear()
+        self.inFlight = 0
+
+    def hexData(self, data):
+        return bytearray(binascii.unhexlify(data))[:-1]
+
+    def payload(self, command, word):
+        if command.startswith('s'):
+            return sparseDecode(frameDecode(word))
+        if command.startswith('b'):
+            return frameDecode(word)
+        return self.hexData(word)
+
+    def dataLines(self, command, addrFrom, addrTo, addrFormat):
+        lineSize = 32
+        if command.startswith('b'):
+            lineSize = 128
+        lines = []
+        for addr in xrange(addrFrom, addrTo + 1, lineSize):
+            data = self.flashMemory[addr:min(addr + lineSize, addrTo + 1)]
+            if lineSize == 128:
+                lines.append(('bdata ' + addrFormat + ' %s') % (addr, frameEncode(data)))
+            else:
+                lines.append(('data ' + addrFormat + ' %s%02x') % (addr, binascii.hexlify(data), crc8(data)))
+        return lines
+
+    def answer(self, cmd):
+        args = cmd.split()
+        if args == ['hello']:
+            return ['hello', 'device avrprog v2.0'] + (['binary %d' % self.binary] if self.binary else [])
+        if args == ['avr', 'connect']:
+            return ['signature 1e 93 07', 'avr connected']
+        if args == ['avr', 'disconnect']:
+            return ['avr disconnected']
+        if args == ['avr', 'flash', 'erase']:
+            self.flashMemory[:] = '\xff' * len(self.flashMemory)
+            return ['avr flash erase done']
+        if args[:2] == ['avr', 'flash'] and args[2] in ('write', 'bwrite', 'swrite'):
+            addr = int(args[4], 16)
+            if addr in self.failAddresses:
+                return ['wrong checksum: 01']
+            data = self.payload(args[2], args[5])
+            if args[2] == 'write' and len(data) % 2:
+                # programmer reads hex data by words
+                return ['unexpected end of data']
+            data += '\xff' * (int(args[3], 16) * 2 - len(data))
+            for i, byte in enumerate(data):
+                # without erase programmer can only clear bits
+                self.flashMemory[addr + i] &= byte
+            return ['avr flash write done']
+        if args[:3] == ['avr', 'flash', 'crc'] and self.flashCrc:
+            addrFrom, addrTo = int(args[3], 16), int(args[4], 16)
+            return ['crc %04x' % Crc16().update(self.flashMemory[addrFrom:addrTo + 1]).crc]
+        if args[:2] == ['avr', 'flash'] and args[2] in ('read', 'bread'):
+            addrFrom, addrTo = int(args[3], 16), int(args[4], 16)
+            return self.dataLines(args[2], addrFrom, addrTo, '%06x') + ['avr flash read done']
+        if args[0] in ('flash', 'bflash', 'sflash'):
+            addr = int(args[1], 16)
+            if addr in self.failAddresses:
+                return ['data error']
+            data = self.payload(args[0], args[3])
+            self.flashMemory[addr:addr + len(data)] = data
+            return ['flash ok']
+        if args[0] in ('read', 'bread'):
+            addr, size = int(args[1], 16), int(args[2], 16)
+            if addr + size > len(self.flashMemory):
+                return ['address error']
+            return self.dataLines(args[0], addr, addr + size - 1, '%04x')
+        if args[0] == 'crc' and self.flashCrc:
+            addr, size = int(args[1], 16), int(args[2], 16)
+            return ['crc %04x' % Crc16().update(self.flashMemory[addr:addr + size]).crc]
+        if args[:2] == ['avr', 'fuse']:
+            if len(args) > 3:
+                self.fuses[args[2]] = int(args[3], 16)
+            return ['fuse %s %02x' % (args[2], self.fuses[args[2]])]
+        if args[:2] == ['avr', 'flash']:
+            return ['error: bad param']
+        return ['error: unknown command ' + args[0]]
+
+    def cmdWrite(self, cmd, slow=False):
+        self.commands.append(cmd)
+        self.answers.append(self.answer(cmd))
+        self.inFlight += 1
+        self.maxInFlight = max(self.maxInFlight, self.inFlight)
+
+    def cmdReceive(self, expectedLinesCount=None, retry=0, slow=False):
+        if not self.answers:
+            raise NotRespondingException()
+        if self.lateAnswers and not retry:
+            self.lateAnswers -= 1
+            raise NotRespondingException()
+        self.inFlight -= 1
+        return self.answers.popleft()
+
+    def cmdReceiveLines(self, expectedLinesCount=None):
+        for line in self.cmdReceive():
+            self.receivedLines += 1
+            yield line
+
+    def cmdAbort(self):
+        self.aborted += 1
+        self.flushInput()
+
+    def cmdSend(self, cmd, result=True, disableResultError=False, retry=2, expectedLinesCount=None, slow=False):
+        self.flushInput()
+        self.cmdWrite(cmd)
+        return self.cmdReceive()
+
+
+class FakeAvrProg(AvrProg):
+    terminalClass = FakeTerminal
+    asyncTerminalClass = FakeTerminal
+
+
+AVRDUDE_CONF = """
+# comment with "quotes"
+default_programmer = "avrprog";
+
+programmer
+    id = "avrisp";
+    desc = "Atmel AVR ISP";
+;
+
+part
+    id = "m328";
+    desc = "ATmega328";
+    signature = 0x1e 0x95 0x14;
+    prog_modes = PM_SPM | PM_ISP | PM_HVPP | PM_debugWIRE;
+    memory "eeprom"
+        size = 1024;
+        read = "1 0 1 0 0 0 0 0", "0 0 0 x x x a9 a8";
+    ;
+    memory "flash"
+        paged = yes;
+        size = 32768;
+        page_size = 128;
+    ;
+    memory "lfuse" size = 1; ;
+    memory "hfuse" size = 1; ;
+    memory "efuse" size = 1; ;
+    memory "lock" size = 1; ;
+;
+
+part parent "m328" # m328p
+    id = "m328p";
+    desc = "ATmega328P";
+    signature = 0x1e 0x95 0x0f;
+    memory "calibration" size = 1; ;
+;
+
+part
+    id = "x128a1";
+    desc = "ATxmega128A1";
+    signature = 0x1e 0x97 0x4c;
+    prog_modes = PM_SPM | PM_PDI;
+    memory "flash" size = 0x22000; page_size = 512; ;
+;
+
+part
+    id = "m2560";
+    desc = "ATmega2560";
+    signature = 0x1e 0x98 0x01;
+    has_jtag = yes;
+    memory "flash" paged = yes; size = 262144; page_size = 256; ;
+;
+"""
+
+
+class TestCpuDb(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.confFile = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(AVRDUDE_CONF)
+
+    def tearDown(self):
+        os.remove(self.confFile)
+
+    def testCpuDbImportAvrdudeConf(self):
+        cpus = importAvrdudeConf(self.confFile)
+        self.assertEqual([cpu['id'] for cpu in cpus], ['atmega328', 'atmega328p'])
+        self.assertEqual(cpus[1], {
+            'id': 'atmega328p',
+            'alias': 'm328p',
+            'name': 'ATmega328P',
+            'signature': (0x1e, 0x95, 0x0f),
+            'flashPageWords': 64,
+            'flashPagesCount': 256,
+            'eepromSize': 1024,
+            'fuses': ('low', 'high', 'extend', 'lock', 'calib'),
+        })
+        self.assertEqual(cpus[0]['fuses'], ('low', 'high', 'extend', 'lock'))
+
+    def testCpuDbMergeAndSave(self):
+        db = CpuDb()
+        self.assertEqual(db.byId('atmega328p')['signature'], (0x1e, 0x95, 0x0f))
+        count = len(db)
+        self.assertEqual(db.merge(importAvrdudeConf(self.confFile)), 1)
+        self.assertEqual(db.bySignature([0x1e, 0x95, 0x14])['id'], 'atmega328')
+        self.assertEqual(db.byId('m328')['id'], 'atmega328')
+        fd, fileName = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            db.save(fileName)
+            saved = CpuDb(fileName)
+            self.assertEqual(len(saved), count + 1)
+            self.assertEqual(list(saved), list(db))
+        finally:
+            os.remove(fileName)
+
+    def testCpuDbUserFile(self):
+        fd, userFile = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(userFile)
+        with open(CpuDb().fileName) as f:
+            packageCpus = f.read()
+        try:
+            importCpus(self.confFile, userFile)
+            db = CpuDb(userFileName=userFile)
+            self.assertEqual(len(db), len(CpuDb()) + 1)
+            self.assertEqual(db.byId('atmega328')['name'], 'ATmega328')
+            self.assertEqual(db.byId('atmega8')['id'], 'atmega8')
+            with open(CpuDb().fileName) as f:
+                self.assertEqual(f.read(), packageCpus)
+        finally:
+            os.remove(userFile)
+
+    def testCpuDbExpectedAlias(self):
+        avrProg = FakeAvrProg()
+        avrProg.connect('port1')
+        avrProg.setCpu(['m8'])
+        self.assertEqual(avrProg.deviceCpu, 'atmega8')
+        self.assertEqual(avrProg.flashSize, 8192)
+        with self.assertRaises(AvrProgException):
+            avrProg.setCpu(['atmega88'])
+
+
+class TestAvrProg(unittest.TestCase):
+
+    def setUp(self):
+        self.avrProg = AvrProg()
+        self.avrProg.term = FakeTerminal()
+        self.avrProg.deviceName = 'avrprog'
+        self.avrProg.flashPageSize = 4
+        self.avrProg.flashSize = 64
+
+    def testFlashSkipBlankPages(self):
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 4 + [0xff] * 4 + [0x02] * 2)
+        self.avrProg.flash()
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash write 02 000000 0101010100',
+            'avr flash write 02 000008 020200',
+        ])
+
+    def testFlashSparseImage(self):
+        self.avrProg.dataBuffer = MemoryImage('\x01\x02')
+        self.avrProg.dataBuffer.write(0x31, '\x03')
+        self.avrProg.flash()
+        self.avrProg.flashVerify()
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash write 02 000000 010203',
+            'avr flash write 02 000030 ff03fc',
+            'avr flash crc 000000 000001',
+            'avr flash crc 000031 000031',
+        ])
+
+    def testFlashWindow(self):
+        self.avrProg.flashWindow = 3
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 20)
+        self.avrProg.flash()
+        self.assertEqual(len(self.avrProg.term.commands), 5)
+        self.assertEqual(self.avrProg.term.maxInFlight, 3)
+
+    def testFlashWindowFailedPage(self):
+        self.avrProg.term = FakeTerminal(failAddresses=(0x08, ))
+        self.avrProg.flashWindow = 2
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 20)
+        with self.assertRaises(FlashWriteException) as context:
+            self.avrProg.flash()
+        self.assertEqual(context.exception.failedPages, [(0x08, ['wrong checksum: 01'])])
+        # no more pages are sent after error is detected
+        self.assertEqual(len(self.avrProg.term.commands), 4)
+        self.assertEqual(self.avrProg.term.answers, collections.deque())
+
+    def testFlashDiffProgrammer(self):
+        self.avrProg.term.flashMemory[0:8] = bytearray([0x01] * 4 + [0x03] * 4)
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 4 + [0x02] * 4 + [0xff] * 4 + [0x04] * 4)
+        self.avrProg.flash(['diff'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash crc 000000 000003',
+            'avr flash crc 000004 000007',
+            'avr flash crc 00000c 00000f',
+            'avr flash read 000004 000007',
+            'avr flash read 00000c 00000f',
+            'avr flash write 02 000004 0202020200',
+            'avr flash write 02 00000c 0404040400',
+        ])
+        self.assertEqual(self.avrProg.term.flashMemory[0:16], self.avrProg.dataBuffer.read(0, 16))
+
+    def testFlashDiffProgrammerWithoutCrc(self):
+        self.avrProg.term = FakeTerminal(flashCrc=False)
+        self.avrProg.term.flashMemory[0:8] = bytearray([0x01] * 4 + [0x03] * 4)
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 4 + [0x02] * 4 + [0xff] * 4 + [0x04] * 4)
+        self.avrProg.flash(['diff'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash crc 000000 000003',
+            'avr flash crc 000004 000007',
+            'avr flash crc 00000c 00000f',
+            'avr flash read 000000 000007',
+            'avr flash read 00000c 00000f',
+            'avr flash write 02 000004 0202020200',
+            'avr flash write 02 00000c 0404040400',
+        ])
+        self.assertEqual(self.avrProg.term.flashMemory[0:16], self.avrProg.dataBuffer.read(0, 16))
+
+    def testFlashDiffProgrammerNeedErase(self):
+        self.avrProg.term.flashMemory[0:4] = bytearray([0x01] * 4)
+        self.avrProg.dataBuffer = MemoryImage([0x02] * 4)
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flash(['diff'])
+        self.assertEqual(
+            context.exception.message,
+            "Page 0x000000 can not be changed without chip erase, use erase and flash instead."
+        )
+
+    def testFlashDiffBootloader(self):
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.deviceRead = True
+        self.avrProg.flashWindow = 2
+        self.avrProg.term.flashMemory[0:8] = bytearray([0x01] * 4 + [0x03] * 4)
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 4 + [0x02] * 4)
+        self.avrProg.flash(['diff'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'crc 0000 0004',
+            'crc 0004 0004',
+            'flash 0004 4321 0202020200',
+        ])
+        self.assertEqual(self.avrProg.term.flashMemory[0:8], self.avrProg.dataBuffer.read(0, 8))
+
+    def testCrc8(self):
+        for data in ('', '\x5a', 'abc', bytearray(range(256)) * 3):
+            self.assertEqual(crc8(data), reduce(lambda crc, byte: crc ^ byte, bytearray(data), 0))
+
+    def testVerifyMismatch(self):
+        self.avrProg.term.flashMemory[0:40] = bytearray([0x01] * 40)
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 40)
+        self.avrProg.dataBuffer.write(35, '\x02')
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashVerify()
+        self.assertEqual(context.exception.message, "Verify error, addr: 000023 dataBuffer: 02 flash: 01")
+
+    def testVerifyAbortOnMismatch(self):
+        self.avrProg.flashSize = 0x2000
+        self.avrProg.term.flashMemory[:] = bytearray([0x01] * 0x2000)
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 0x2000)
+        self.avrProg.dataBuffer.write(0x21, '\x00')
+        with self.assertRaises(AvrProgException):
+            self.avrProg.flashVerify()
+        self.assertEqual(self.avrProg.term.receivedLines, 2)
+        self.assertEqual(self.avrProg.term.aborted, 1)
+        # device is in sync again
+        self.avrProg.hello()
+
+    def testVerifySkipBlankPages(self):
+        self.avrProg.dataBuffer = MemoryImage([0xff] * 2 + [0x01] * 8 + [0xff] * 10 + [0x02] * 3)
+        self.avrProg.dataBuffer.write(0x30, [0xff] * 4 + [0x03])
+        self.avrProg.flash()
+        self.avrProg.term.commands = []
+        self.avrProg.flashVerify(['read'])
+        self.avrProg.flashVerify(['full', 'read'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash read 000000 00000b',
+            'avr flash read 000014 000016',
+            'avr flash read 000034 000034',
+            'avr flash read 000000 000016',
+            'avr flash read 000030 000034',
+        ])
+
+    def testVerifyByCrc(self):
+        self.avrProg.crcBlockSize = 32
+        self.avrProg.term.flashMemory[0:100] = bytearray([0x01] * 100)
+        self.avrProg.term.flashMemory[70] = 0x00
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 100)
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashVerify()
+        self.assertEqual(context.exception.message, "Verify error, addr: 000046 dataBuffer: 01 flash: 00")
+        self.assertEqual(self.avrProg.term.commands, [
+            'avr flash crc 000000 00001f',
+            'avr flash crc 000020 00003f',
+            'avr flash crc 000040 00005f',
+            'avr flash crc 000060 000063',
+            'avr flash read 000040 00005f',
+        ])
+
+    def testVerifyByCrcBootloader(self):
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.deviceRead = True
+        self.avrProg.term.flashMemory[4:8] = bytearray([0x01] * 4)
+        self.avrProg.dataBuffer = MemoryImage([0xff] * 4 + [0x01] * 4)
+        self.avrProg.flashVerify()
+        self.avrProg.dataBuffer.write(6, '\x02')
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashVerify()
+        self.assertEqual(context.exception.message, "Verify error, addr: 000006 dataBuffer: 02 flash: 01")
+        self.assertEqual(self.avrProg.term.commands, ['crc 0004 0004', 'crc 0004 0004', 'read 0004 0004'])
+
+    def testDownloadBootloader(self):
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.deviceRead = True
+        self.avrProg.term.flashMemory[0x10:0x60] = bytearray(range(0x50))
+        self.avrProg.flashDownload(['10', '5f'])
+        self.assertEqual(self.avrProg.term.commands, ['read 0010 0050'])
+        self.assertEqual(self.avrProg.dataBuffer.extents(), [(0x10, bytearray(range(0x50)))])
+
+    def testBootloaderWithoutRead(self):
+        self.avrProg.helloAnswer(['hello', 'device avrboot v1.0', 'bootaddr 6144', 'pagesize 64', 'crc ok'])
+        self.assertFalse(self.avrProg.isFlashReadable())
+        self.avrProg.dataBuffer = MemoryImage([0x01] * 4)
+        with self.assertRaises(NotReadableException):
+            self.avrProg.flashVerify()
+        with self.assertRaises(NotReadableException):
+            self.avrProg.flashDownload()
+        # diff falls back to writing all pages
+        self.avrProg.flash(['diff'])
+        self.assertEqual(self.avrProg.term.commands, ['flash 0000 4321 0101010100'])
+        self.avrProg.helloAnswer(['hello', 'device avrboot v1.0', 'bootaddr 6144', 'pagesize 64', 'crc ok', 'read 1'])
+        self.assertTrue(self.avrProg.isFlashReadable())
+
+    def testDownloadError(self):
+        self.avrProg.term = FakeTerminal(flashSize=0x20)
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.deviceRead = True
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashDownload(['10', '5f'])
+        self.assertEqual(context.exception.message, "Flash read error: address error")
+
+    def testFrame(self):
+        data = bytearray(range(256)) * 2
+        frame = frameEncode(data)
+        self.assertEqual(frame.split(), [frame])
+        self.assertEqual(frame.strip(), frame)
+        self.assertLess(len(frame), len(data) * 1.05)
+        self.assertEqual(frameDecode(frame), data)
+        self.assertEqual(frameDecode(frameEncode('')), bytearray())
+        self.assertEqual(frameDecode(frame[:-1]), None)
+        self.assertEqual(frameDecode(frame.replace('\x80', '\x81', 1)), None)
+
+    def testBinary(self):
+        self.avrProg.term = FakeTerminal(binary=True)
+        self.avrProg.hello()
+        self.avrProg.setCpu(['atmega8'])
+        self.avrProg.dataBuffer = MemoryImage(bytearray(range(256)) * 2)
+        self.avrProg.flash()
+        self.avrProg.flashVerify(['read'])
+        self.assertEqual(self.avrProg.term.flashMemory[:512], self.avrProg.dataBuffer.read(0, 512))
+        commands = self.avrProg.term.commands
+        self.assertEqual(commands[2][:35], 'avr flash bwrite 20 000000 \x1b@@\x1b@\x01\x02\x03')
+        self.assertEqual(commands[-1], 'avr flash bread 000000 0001ff')
+        self.avrProg.binaryMode = False
+        self.avrProg.flashDownload(['0', '1ff'])
+        self.assertEqual(self.avrProg.term.commands[-1], 'avr flash read 000000 0001ff')
+        self.assertEqual(self.avrProg.dataBuffer.read(0, 512), bytearray(range(256)) * 2)
+
+    def testSparse(self):
+        self.assertEqual(sparseEncode('\xff' * 4 + 'ab\xff\xffc' + '\xff' * 3 + 'd' + '\xff' * 10), '\x04\x05ab\xff\xffc\x03\x01d')
+        self.assertEqual(sparseEncode('\xff' * 300 + 'a' * 300), '\xff\x00\x2d\xff' + 'a' * 255 + '\x00\x2d' + 'a' * 45)
+        for data in ('', 'abc', '\xff\xff\xffabc\xff\xff', '\xff' * 300 + 'a' * 300 + '\xff' * 5 + 'b'):
+            self.assertEqual(sparseDecode(sparseEncode(data)), data.rstrip('\xff'))
+
+    def testPipelineLateAnswer(self):
+        self.avrProg.dataBuffer = MemoryImage(bytearray(range(256)) * 8)
+        self.avrProg.flash()
+        self.avrProg.flashWindow = 2
+        self.avrProg.term.lateAnswers = 2
+        self.avrProg.flashVerify()
+        self.assertEqual(self.avrProg.term.lateAnswers, 0)
+
+    def testSlowCommands(self):
+        self.assertTrue(self.avrProg.isSlowCommand('avr flash crc 000000 0003ff'))
+        self.assertTrue(self.avrProg.isSlowCommand('hello'))
+        self.assertTrue(self.avrProg.isSlowCommand('bread 0000 0008'))
+        self.assertFalse(self.avrProg.isSlowCommand('avr flash write 04 000000 010203'))
+        self.assertFalse(self.avrProg.isSlowCommand('reboot'))
+
+    def testFlashTrailingBlank(self):
+        self.avrProg.flashPageSize = 8
+        self.avrProg.dataBuffer = MemoryImage('\x01\x02' + '\xff' * 6)
+        self.avrProg.flash()
+        self.assertEqual(self.avrProg.term.commands, ['avr flash write 04 000000 010203'])
+        # programmer gets whole words
+        self.avrProg.term.commands = []
+        self.avrProg.dataBuffer = MemoryImage('\x01\x02\x04' + '\xff' * 5)
+        self.avrProg.flash()
+        self.assertEqual(self.avrProg.term.commands, ['avr flash write 04 000000 010204fff8'])
+
+    def testFlashSparseFrame(self):
+        self.avrProg.term = FakeTerminal(binary=2)
+        self.avrProg.hello()
+        self.avrProg.setCpu(['atmega8'])
+        page = bytearray('\xff' * 20 + 'table' + '\xff' * 30 + 'end' + '\xff' * 6)
+        self.avrProg.dataBuffer = MemoryImage(page)
+        self.avrProg.flash()
+        self.assertEqual(self.avrProg.term.commands[-1], 'avr flash swrite 20 000000 \x1b@\x1bL\x14\x05table\x1e\x03end\x1d')
+        self.assertEqual(self.avrProg.term.flashMemory[:64], page)
+
+    def testBinaryBootloader(self):
+        self.avrProg.term = FakeTerminal(binary=True)
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.deviceRead = True
+        self.avrProg.deviceBinary = True
+        self.avrProg.dataBuffer = MemoryImage('\x0a\x20\x00\x1b\xff')
+        self.avrProg.flash()
+        self.avrProg.flashDownload(['0', '7'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'bflash 0000 4321 \x1b@\x04\x1bJ\x1b`\x1b@\x1b[1',
+            'bread 0000 0008',
+        ])
+        self.assertEqual(self.avrProg.dataBuffer.read(0, 8), bytearray('\x0a\x20\x00\x1b\xff\xff\xff\xff'))
+
+    def testVerifyCrcError(self):
+        res = ['data 000000 0102ff', 'avr flash read done']
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashVerifyAnswer(0, bytearray('\x01\x02'), res)
+        self.assertEqual(context.exception.message, "CRC8 error")
+
+    def testVerifyMissingData(self):
+        res = ['data 000000 010203', 'avr flash read done']
+        with self.assertRaises(AvrProgException) as context:
+            self.avrProg.flashVerifyAnswer(0, bytearray('\x01\x02\x03'), res)
+        self.assertEqual(
+            context.exception.message,
+            "Verify error, received data for 000000 - 000001, expected 000000 - 000002"
+        )
+
+    def testDownload(self):
+        self.avrProg.term.flashMemory[0x10:0x60] = bytearray(range(0x50))
+        self.avrProg.flashDownload(['10', '5f'])
+        self.assertEqual(self.avrProg.dataBuffer.extents(), [(0x10, bytearray(range(0x50)))])
+
+
+class TestFlashJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.journalDir = tempfile.mkdtemp()
+        self.avrProg = FakeAvrProg()
+        self.avrProg.journalDir = self.journalDir
+        self.avrProg.connect('port1')
+        self.avrProg.setCpu(['atmega8'])
+        self.avrProg.dataBuffer = MemoryImage(''.join(chr(i) * 64 for i in xrange(1, 5)))
+        # link is lost when page 0x80 is sent
+        self.avrProg.term.failAddresses = (0x80, )
+        with self.assertRaises(FlashWriteException):
+            self.avrProg.flash(['resume'])
+        self.avrProg.term.failAddresses = ()
+        self.avrProg.term.commands = []
+
+    def tearDown(self):
+        for fileName in os.listdir(self.journalDir):
+            os.remove(os.path.join(self.journalDir, fileName))
+        os.rmdir(self.journalDir)
+
+    def testFlashJournalResume(self):
+        journal = self.avrProg.flashJournal()
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.pages, set([0x00, 0x40]))
+        self.avrProg.flash(['resume'])
+        self.assertEqual([cmd.split()[4] for cmd in self.avrProg.term.commands if 'write' in cmd], ['000080', '0000c0'])
+        # boundary page is verified
+        self.assertIn('avr flash read 000040 00007f', self.avrProg.term.commands)
+        self.assertEqual(os.listdir(self.journalDir), [])
+        self.avrProg.flashVerify(['read'])
+
+    def testFlashJournalWithoutRead(self):
+        # boundary page is written again by bootloader which can not verify it
+        self.avrProg.deviceName = 'avrboot'
+        self.avrProg.flash(['resume'])
+        self.assertEqual(self.avrProg.term.commands, [
+            'flash %04x 4321 %s' % (addr, binascii.hexlify(chr(addr / 64 + 1) * 64) + '00') for addr in (0x40, 0x80, 0xc0)
+        ])
+        self.assertEqual(os.listdir(self.journalDir), [])
+
+    def testFlashJournalOtherImage(self):
+        self.avrProg.dataBuffer.write(0, '\x00')
+        self.assertFalse(self.avrProg.flashJournal().load())
+        self.avrProg.flash(['resume'])
+        self.assertEqual(len([cmd for cmd in self.avrProg.term.commands if 'write' in cmd]), 4)
+
+    def testFlashJournalBoundaryError(self):
+        # boundary page was not written correctly
+        self.avrProg.term.flashMemory[0x40] = 0
+        with self.assertRaises(VerifyException):
+            self.avrProg.flash(['resume'])
+        journal = self.avrProg.flashJournal()
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.pages, set([0x00, 0x80, 0xc0]))
+        self.avrProg.term.commands = []
+        self.avrProg.term.flashMemory[0x40] = 0xff
+        self.avrProg.flash(['resume'])
+        self.assertEqual([cmd.split()[4] for cmd in self.avrProg.term.commands if 'write' in cmd], ['000040'])
+
+    def testFlashWithoutJournal(self):
+        self.avrProg.flash()
+        self.assertEqual(len(os.listdir(self.journalDir)), 1)
+        self.avrProg.journalDir = tempfile.mkdtemp()
+        try:
+            self.avrProg.flash()
+            self.assertEqual(os.listdir(self.avrProg.journalDir), [])
+        finally:
+            os.rmdir(self.avrProg.journalDir)
+
+    def testFlashJournalErase(self):
+        self.avrProg.erase()
+        self.assertEqual(os.listdir(self.journalDir), [])
+
+    def testFlashJournalUnfinishedLine(self):
+        journal = self.avrProg.flashJournal()
+        with open(journal.fileName, 'a') as f:
+            f.write('0000')
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.lastPage, 0x40)
+
+
+class TestFleet(unittest.TestCase):
+
+    def testFleet(self):
+        fleet = Fleet(['port1', 'port2', 'port3'], MemoryImage('abc'), avrProgClass=FakeAvrProg)
+        fleet.run(['cpu:atmega8', 'erase', 'flash', 'verify'])
+        self.assertEqual([result['port'] for result in fleet.results], ['port1', 'port2', 'port3'])
+        self.assertEqual([result['cpu'] for result in fleet.results], ['atmega8'] * 3)
+        self.assertEqual([result['error'] for result in fleet.results], [None] * 3)
+
+    def testFleetFailure(self):
+        fleet = Fleet(['port1', 'port2'], MemoryImage('abc'), avrProgClass=FakeAvrProg)
+        with self.assertRaises(FleetException) as context:
+            fleet.run(['cpu:atmega88'])
+        self.assertEqual(context.exception.message, "Failed 2 of 2 devices.")
+
+    def testFleetUnexpectedError(self):
+        fleet = Fleet(['port1', 'port2'], MemoryImage('abc'), avrProgClass=FakeAvrProg)
+        with self.assertRaises(FleetException) as context:
+            fleet.run(['cpu:atmega8', 'window:x'])
+        self.assertEqual(context.exception.message, "Failed 2 of 2 devices.")
+        self.assertIn('ValueError', fleet.results[0]['error'])
+
+    def testFleetGlob(self):
+        fleet = Fleet([__file__[:-1] + '[y]', 'port1'])
+        self.assertEqual(fleet.ports, [__file__, 'port1'])
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.avrProg = FakeAvrProg()
+        self.avrProg.connect('port1')
+        self.avrProg.setCpu(['atmega8'])
+        self.avrProg.term.commands = []
+
+    def testBatchCompile(self):
+        self.assertEqual(Batch(['cpu', 'cpu', 'fuse:low', 'fuse:high', 'fuse:low:e2', 'fuse']).plan, [
+            ('cpu', []),
+            ('fuses', ['low', 'high']),
+            ('fuse', ['low', 'e2']),
+            ('fuses', [None]),
+        ])
+        self.assertEqual(Batch(['erase', 'flash:diff', 'verify', 'download:ff', 'flash:diff']).plan, [
+            ('erase', []),
+            ('flash', []),
+            ('verify+download', ([], ['ff'])),
+            ('flash', ['diff']),
+        ])
+
+    def testBatchReadFuses(self):
+        self.assertEqual(self.avrProg.readFuses(['low', 'high', 'lock']), {'low': 0xe1, 'high': 0xd9, 'lock': 0xff})
+        self.assertEqual(self.avrProg.term.maxInFlight, 3)
+        with self.assertRaises(AvrProgException):
+            self.avrProg.readFuses(['low', 'extend'])
+
+    def testBatchVerifyDownload(self):
+        self.avrProg.dataBuffer = MemoryImage('abc')
+        self.avrProg.dataBuffer.write(0x100, 'def')
+        Batch(['flash', 'verify', 'download:ff']).run(self.avrProg)
+        self.assertEqual([cmd for cmd in self.avrProg.term.commands if 'read' in cmd or 'crc' in cmd], [
+            'avr flash read 000000 0000ff',
+            'avr flash read 000100 000102',
+        ])
+        self.assertEqual(str(self.avrProg.dataBuffer.read(0, 4)), 'abc\xff')
+        self.avrProg.term.flashMemory[0x101] = 0
+        self.avrProg.dataBuffer.write(0x100, 'def')
+        with self.assertRaises(AvrProgException):
+            Batch(['verify', 'download:ff']).run(self.avrProg)
+
+    def testBatchJobFile(self):
+        fd, jobFile = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('erase  # blank device\nflash:diff verify\n')
+        try:
+            self.avrProg.dataBuffer = MemoryImage('abc')
+            runCommands(self.avrProg, ['batch:' + jobFile, 'download:3'])
+        finally:
+            os.remove(jobFile)
+        self.assertEqual(self.avrProg.term.commands[0], 'avr flash erase')
+        self.assertEqual(str(self.avrProg.dataBuffer.read(0, 4)), 'abc\xff')
+
+
+class StationTerminal(FakeTerminal):
+    """port 'dead' can not be opened, on port 'flaky' page 0 is never written"""
+
+    def __init__(self, port=None):
+        if port == 'dead':
+            raise IOError("could not open port %s" % port)
+        FakeTerminal.__init__(self, port, failAddresses=(0, ) if port == 'flaky' else ())
+
+
+class StationAvrProg(FakeAvrProg):
+    terminalClass = StationTerminal
+
+
+class TestScheduler(unittest.TestCase):
+
+    policies = (
+        (IOError, RetryPolicy(retries=3, linkError=True)),
+        (FlashWriteException, RetryPolicy(retries=2)),
+    )
+
+    def setUp(self):
+        fd, self.image = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\x01\x02\x03' * 100)
+
+    def tearDown(self):
+        os.remove(self.image)
+
+    def scheduler(self, stations, jobsCount, **jobAttr):
+        scheduler = Scheduler(stations, avrProgClass=StationAvrProg, policies=self.policies, maxPortFailures=1)
+        for i in xrange(jobsCount):
+            scheduler.add(Job('job%d' % i, self.image, cpu='atmega8', fuses={'lock': 0x3c, 'low': 0xe1}, **jobAttr))
+        return scheduler
+
+    def testSchedulerRunsJobs(self):
+        scheduler = self.scheduler(['port1', 'port2'], 5)
+        scheduler.run()
+        self.assertEqual([job.done for job in scheduler.jobs], [True] * 5)
+        self.assertEqual(sum(stats['jobs'] for stats in scheduler.portJobs.values()), 5)
+        self.assertEqual(scheduler.jobs[0].commands()[-2:], ['fuse:low:e1', 'fuse:lock:3c'])
+
+    def testSchedulerDisablesDeadPort(self):
+        scheduler = self.scheduler(['dead', 'port1'], 3)
+        scheduler.run()
+        self.assertEqual([job.done for job in scheduler.jobs], [True] * 3)
+        self.assertEqual(scheduler.activePorts, set(['port1']))
+        self.assertEqual(scheduler.portJobs['port1']['jobs'], 3)
+
+    def testSchedulerRetryPolicy(self):
+        scheduler = self.scheduler(['flaky'], 1)
+        with self.assertRaises(SchedulerException):
+            scheduler.run()
+        job = scheduler.jobs[0]
+        self.assertEqual([attempt['port'] for attempt in job.attempts], ['flaky'] * 3)
+        self.assertIn('FlashWriteException', job.error)
+
+    def testSchedulerUnexpectedError(self):
+        scheduler = self.scheduler(['port1'], 0)
+        scheduler.add(Job('broken', self.image, cpu='atmega8', ports=['port1'], commands=['window:x']))
+        scheduler.add(Job('next', self.image, cpu='atmega8', ports=['port1']))
+        with self.assertRaises(SchedulerException) as context:
+            scheduler.run()
+        self.assertEqual(len(context.exception.messages), 1)
+        self.assertIn('ValueError', context.exception.messages[0])
+        self.assertEqual([job.done for job in scheduler.jobs], [False, True])
+        self.assertEqual(len(scheduler.jobs[0].attempts), 1)
+
+    def testSchedulerPortPool(self):
+        scheduler = self.scheduler(['port1'], 1, ports=['port2'])
+        with self.assertRaises(SchedulerException) as context:
+            scheduler.run()
+        self.assertEqual(context.exception.messages, ['job0: No active port for job.'])
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.tempDir, 'avrprog.sock')
+        self.daemon = Daemon(self.socketPath, avrProgClass=FakeAvrProg)
+        self.daemon.listen()
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.thread.join()
+        os.rmdir(self.tempDir)
+
+    def testDaemonReusesPort(self):
+        for i in xrange(2):
+            result = sendJob(['port:port1', 'cpu:atmega8', 'fuse:low'], self.socketPath)
+            self.assertEqual(result['error'], None)
+            self.assertEqual(result['output'], '  low: 0xe1\n')
+        commands = self.daemon.sessions['port1'].avrProg.term.commands
+        self.assertEqual(commands.count('hello'), 1)
+        self.assertEqual(commands.count('avr connect'), 2)
+
+    def testDaemonConnectsDetectedCpu(self):
+        result = sendJob(['port:port1', 'cpu:atmega8'], self.socketPath)
+        self.assertEqual(result['error'], None)
+        # AVR disconnected after job is connected again for next job
+        result = sendJob(['port:port1', 'fuse:low'], self.socketPath)
+        self.assertEqual(result['error'], None)
+        self.assertEqual(result['output'], '  low: 0xe1\n')
+        result = sendJob(['port:port1', 'about'], self.socketPath)
+        commands = self.daemon.sessions['port1'].avrProg.term.commands
+        self.assertEqual(commands, [
+            'hello',
+            'avr connect',
+            'avr disconnect',
+            'avr connect',
+            'avr fuse low',
+            'avr disconnect',
+        ])
+
+    def testDaemonResetsJob(self):
+        fileNames = []
+        for i, size in ((1, 0x20), (2, 0x10)):
+            fileName = os.path.join(self.tempDir, 'image%d.hex' % i)
+            IntelHex(MemoryImage([i] * size)).decodeFile(fileName)
+            fileNames.append(fileName)
+        result = sendJob(['port:port1', 'window:4', 'load:' + fileNames[0]], self.socketPath)
+        self.assertEqual(result['error'], None)
+        result = sendJob(['port:port1', 'load:' + fileNames[1]], self.socketPath)
+        self.assertEqual(result['error'], None)
+        avrProg = self.daemon.sessions['port1'].avrProg
+        self.assertEqual(list(avrProg.dataBuffer.extents()), [(0, '\x02' * 0x10)])
+        self.assertEqual(avrProg.flashWindow, 1)
+        self.assertEqual(avrProg.term.commands.count('hello'), 1)
+        for fileName in fileNames:
+            os.remove(fileName)
+
+    def testDaemonJobError(self):
+        result = sendJob(['port:port1', 'fleet:port2'], self.socketPath)
+        self.assertIn('Command fleet can not run in daemon.', result['error'])
+        verbose = dbg.verbose
+        result = sendJob(['verbose:1', 'port:port1', 'dance'], self.socketPath)
+        self.assertIn('dance', result['error'])
+        result = sendJob(['port:port1', 'window:x'], self.socketPath)
+        self.assertIn('ValueError', result['error'])
+        # loglevel of job does not change daemon loglevel
+        self.assertEqual(dbg.verbose, verbose)
+
+    def testDaemonJobCommands(self):
+        port, commands = Daemon.jobCommands(
+            ['port:port1', 'load:a.hex', 'load:/b.hex', 'cpu'], '/work', lambda port: True
+        )
+        self.assertEqual(port, 'port1')
+        self.assertEqual(commands, ['load:/work/a.hex', 'load:/b.hex', 'cpu'])
+
+
+class TestTerminalLoop(unittest.TestCase):
+
+    def program(self, avrProg, port):
+        yield avrProg.connectAsync(port)
+        yield avrProg.setCpuAsync(['atmega8'])
+        yield avrProg.flashAsync()
+        yield avrProg.flashVerifyAsync()
+        yield avrProg.flashDownloadAsync(['000000', '00003f'])
+        yield Return(avrProg.deviceCpu)
+
+    def testLostPort(self):
+
+        class LostTerminal(FakeTerminal):
+            def cmdWrite(self, cmd, slow=False):
+                if cmd.startswith('avr flash'):
+                    raise IOError("port is lost")
+                FakeTerminal.cmdWrite(self, cmd, slow)
+
+        loop = TerminalLoop()
+        avrProgs = [FakeAvrProg() for i in xrange(2)]
+        avrProgs[0].asyncTerminalClass = LostTerminal
+        for i, avrProg in enumerate(avrProgs):
+            avrProg.dataBuffer = MemoryImage([i] * 100)
+            loop.add(avrProg, self.program(avrProg, 'port%d' % i), 'port%d' % i)
+        loop.run()
+        self.assertIsInstance(loop.tasks[0].error, IOError)
+        self.assertEqual(loop.tasks[1].result, 'atmega8')
+
+    def testFlashAsyncOptions(self):
+        loop = TerminalLoop()
+        avrProg = FakeAvrProg()
+        avrProg.connect('port1')
+        avrProg.dataBuffer = MemoryImage('abc')
+        task = loop.add(avrProg, avrProg.flashAsync(['diff']))
+        loop.run()
+        self.assertIn('option diff is not supported', str(task.error))
+
+    def testManyDevices(self):
+        loop = TerminalLoop()
+        avrProgs = [FakeAvrProg() for i in xrange(3)]
+        for i, avrProg in enumerate(avrProgs):
+            avrProg.flashWindow = 2
+            avrProg.dataBuffer = MemoryImage([i] * 100)
+            loop.add(avrProg, self.program(avrProg, 'port%d' % i), 'port%d' % i)
+        loop.run()
+        self.assertEqual([task.result for task in loop.tasks], ['atmega8'] * 3)
+        for i, avrProg in enumerate(avrProgs):
+            self.assertEqual(avrProg.term.flashMemory[:100], bytearray([i] * 100))
+            self.assertEqual(avrProg.term.maxInFlight, 2)
+            self.assertEqual(avrProg.dataBuffer.read(0, 64), bytearray([i] * 64))
+
+    def testFailedPage(self):
+        avrProg = FakeAvrProg()
+        avrProg.term = FakeTerminal(failAddresses=(0x40, ))
+        avrProg.hello()
+        avrProg.setCpu(['atmega8'])
+        avrProg.dataBuffer = MemoryImage([0x01] * 200)
+        loop = TerminalLoop()
+        task = loop.add(avrProg, avrProg.flashAsync())
+        loop.run()
+        self.assertEqual(task.error.failedPages, [(0x40, ['wrong checksum: 01'])])
+
+    def testLinkStats(self):
+        link = LinkStats(timeout=1)
+        self.assertEqual(link.timeout(), 1)
+        self.assertEqual(link.answerTime(100), 0)
+        link.addRtt(0.2)
+        self.assertAlmostEqual(link.rtt, 0.2)
+        self.assertAlmostEqual(link.timeout(), 0.6)
+        for i in xrange(100):
+            link.addRtt(0.01)
+        self.assertAlmostEqual(link.rtt, 0.01, places=3)
+        self.assertEqual(link.timeout(), LinkStats.MIN_TIMEOUT)
+        self.assertEqual(link.timeout(retry=1), 2 * LinkStats.MIN_TIMEOUT)
+        self.assertEqual(link.timeout(retry=10), LinkStats.MAX_TIMEOUT)
+        # device works before answer of slow command
+        self.assertEqual(link.timeout(slow=True), 1)
+        # short answers are not measured
+        link.addTransfer(10, 1)
+        self.assertEqual(link.byteTime, None)
+        link.addTransfer(1000, 0.1)
+        self.assertAlmostEqual(link.answerTime(100), 2 * 100 * LinkStats.LINE_BYTES * 0.0001)
+        self.assertIn('rtt 10.0ms', str(link))
+
+    def testLineFramer(self):
+        framer = LineFramer()
+        framer.feed('hel')
+        self.assertEqual(list(framer.lines), [])
+        framer.feed('lo\r\n\r\ndevice avrprog v2.0\r\nready\r\nda')
+        self.assertEqual(list(framer.lines), ['hello', 'device avrprog v2.0', 'ready'])
+        self.assertEqual(framer.rest, 'da')
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), "pseudo terminal is not available")
+    def testSerialTerminalPseudoTerminal(self):
+        master, slave = os.openpty()
+        term = SerialTerminal(os.ttyname(slave))
+        os.write(master, 'line 1\r\nline 2\r\nready\r\n')
+        self.assertEqual(term.cmdReceive(), ['line 1', 'line 2'])
+        term.link.defaultTimeout = 0.05
+        os.write(master, 'line 3\r\n')
+        with self.assertRaises(NotReadyException) as context:
+            term.cmdReceive()
+        self.assertEqual(context.exception.lines, ['line 3'])
+        term.ser.close()
+        os.close(master)
+        os.close(slave)
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), "pseudo terminal is not available")
+    def testSerialTerminalRetry(self):
+        master, slave = os.openpty()
+
+        def readCommand():
+            data = ''
+            while not data.endswith('\r\r'):
+                data += os.read(master, 100)
+
+        def device():
+            readCommand()
+            time.sleep(0.05)
+            os.write(master, 'hello\r\nready\r\n')
+            # command is lost, device answers new line sent by retry
+            readCommand()
+            os.read(master, 100)
+            os.write(master, 'device avrprog v2.0\r\nready\r\n')
+
+        thread = threading.Thread(target=device)
+        thread.start()
+        term = SerialTerminal(os.ttyname(slave), timeout=0.5)
+        self.assertEqual(term.cmdSend('hello'), ['hello'])
+        self.assertTrue(0.04 < term.link.rtt < 0.5)
+        self.assertEqual(term.link.timeout(), LinkStats.MIN_TIMEOUT)
+        self.assertEqual(term.cmdSend('hello'), ['device avrprog v2.0'])
+        thread.join()
+        self.assertEqual((term.link.commands, term.link.timeouts, term.link.retries), (1, 1, 1))
+        term.ser.close()
+        os.close(master)
+        os.close(slave)
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), "pseudo terminal is not available")
+    def testPseudoTerminal(self):
+        master, slave = os.openpty()
+
+        def device():
+            os.read(master, 100)
+            time.sleep(0.05)
+            os.write(master, 'hello\r\ndevice avr')
+            time.sleep(0.05)
+            os.write(master, 'prog v2.0\r\nready\r\n')
+
+        thread = threading.Thread(target=device)
+        thread.start()
+        avrProg = AvrProg()
+        avrProg.term = AsyncSerialTerminal(os.ttyname(slave), timeout=0.5)
+        loop = TerminalLoop()
+        hello = loop.add(avrProg, avrProg.helloAsync())
+        loop.run()
+        thread.join()
+        self.assertEqual(hello.error, None)
+        self.assertEqual(avrProg.getDeviceName(), 'avrprog')
+        # nobody answers now
+        avrProg.term.timeout = 0.05
+        hello = loop.add(avrProg, avrProg.helloAsync())
+        loop.run()
+        self.assertIsInstance(hello.error, NotRespondingException)
+        os.close(master)
+        os.close(slave)
+
+
+class TestStartup(unittest.TestCase):
+
+    def imported(self, args):
+        """run commands in new interpreter, return its imported modules"""
+        script = (
+            "import sys; from avrproglib.cli import main; main(%r); "
+            "sys.stderr.write(' '.join(sys.modules))" % args
+        )
+        process = subprocess.Popen(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        return stderr.split()
+
+    def testStartupWithoutSerial(self):
+        image = tempfile.NamedTemporaryFile(suffix='.bin')
+        image.write('\x01\x02\x03')
+        image.flush()
+        for args in (['help'], ['cpulist'], ['verbose:0', 'load:' + image.name, 'buffer']):
+            modules = self.imported(args)
+            self.assertNotIn('serial', modules)
+            self.assertNotIn('unittest', modules)